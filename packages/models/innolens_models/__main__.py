@@ -7,7 +7,8 @@ from argparse import ArgumentParser
 from .models.access_causality import AccessCausalityCli
 from .models.history_forecast import HistoryForecastCli
 from .models.member_cluster import MemberClusterCli
-from .server import ServerCli
+from .models.simulation_result import SimulationResultCli
+from .server import ServerBenchmarkCli, ServerCli, ServerStartupBenchmarkCli
 
 
 parser = ArgumentParser(
@@ -25,7 +26,10 @@ for sub_cli in (
   AccessCausalityCli(),
   HistoryForecastCli(),
   MemberClusterCli(),
-  ServerCli()
+  SimulationResultCli(),
+  ServerCli(),
+  ServerStartupBenchmarkCli(),
+  ServerBenchmarkCli()
 ):
   subparser = subparsers.add_parser(name=sub_cli.name)
   sub_cli.configure_parser(subparser)
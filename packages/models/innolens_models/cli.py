@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from abc import ABCMeta, abstractmethod
-from argparse import ArgumentParser, Namespace
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
 
 
 class Cli(metaclass=ABCMeta):
@@ -15,3 +15,16 @@ class Cli(metaclass=ABCMeta):
 
   @abstractmethod
   def handle(self, args: Namespace) -> None: ...
+
+
+def positive_int(value_str: str) -> int:
+  '''
+  An argparse type for counts which must be at least 1.
+  '''
+  try:
+    value = int(value_str)
+  except ValueError:
+    raise ArgumentTypeError(f'invalid int value: {value_str!r}')
+  if value < 1:
+    raise ArgumentTypeError(f'must be at least 1, got {value}')
+  return value
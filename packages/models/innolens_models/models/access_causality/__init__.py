@@ -6,7 +6,7 @@ from typing import Optional
 from typing_extensions import Final
 from pathlib import Path
 
-from ...cli import Cli
+from ...cli import Cli, positive_int
 
 
 hk_timezone: Final = timezone(timedelta(hours=8))
@@ -23,6 +23,12 @@ class AccessCausalityCli(Cli):
     )
     for sub_cli in (
       AccessCausalityModelTrainingCli(),
+      AccessCausalityModelUpdateCli(),
+      AccessCausalityModelExportCli(),
+      AccessCausalityDataConversionCli(),
+      AccessCausalityWindowingBenchmarkCli(),
+      AccessCausalityInputBenchmarkCli(),
+      AccessCausalitySweepCli(),
     ):
       subparser = subparsers.add_parser(name=sub_cli.name)
       sub_cli.configure_parser(subparser)
@@ -42,11 +48,11 @@ class AccessCausalityModelTrainingCli(Cli):
     )
     parser.add_argument(
       '--training-data',
-      help='Path to the training data csv'
+      help='Path to the training data json, or the .npy written by the convert action'
     )
     parser.add_argument(
       '--evaluation-data',
-      help='Path to the evaluation data csv'
+      help='Path to the evaluation data json, or the .npy written by the convert action'
     )
     parser.add_argument(
       '--log-dir',
@@ -57,6 +63,35 @@ class AccessCausalityModelTrainingCli(Cli):
       help='Show UI or not',
       action='store_true'
     )
+    parser.add_argument(
+      '--epochs',
+      help='Maximum number of epochs to train, defaults to 100',
+      type=int
+    )
+    parser.add_argument(
+      '--patience',
+      help='Stop training after this many epochs without improving the validation loss, defaults to 5',
+      type=int
+    )
+    parser.add_argument(
+      '--keep-checkpoints',
+      help='Number of best checkpoints to keep, defaults to 3',
+      type=int
+    )
+    parser.add_argument(
+      '--cache-dir',
+      help='The dir caching the parsed datasets'
+    )
+    parser.add_argument(
+      '--cache-max-size',
+      help='Evict the least recently used cached datasets when the cache grows over this size in MB',
+      type=int
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
 
   def handle(self, args: Namespace) -> None:
     checkpoint_dir_path: str = args.checkpoint_dir
@@ -64,6 +99,12 @@ class AccessCausalityModelTrainingCli(Cli):
     evaluation_data_path: Optional[str] = args.evaluation_data
     log_dir_path: Optional[str] = args.log_dir
     show_ui: bool = args.ui
+    epochs: Optional[int] = args.epochs
+    patience: Optional[int] = args.patience
+    keep_checkpoints: Optional[int] = args.keep_checkpoints
+    cache_dir_path: Optional[str] = args.cache_dir
+    cache_max_size: Optional[int] = args.cache_max_size
+    no_cache: bool = args.no_cache
 
     from .model import train_model
     train_model(
@@ -71,5 +112,254 @@ class AccessCausalityModelTrainingCli(Cli):
       training_data_path=None if training_data_path is None else str(Path(training_data_path)),
       evaluation_data_path=None if evaluation_data_path is None else str(Path(evaluation_data_path)),
       log_dir_path=None if log_dir_path is None else str(Path(log_dir_path)),
-      show_ui=show_ui
+      show_ui=show_ui,
+      epochs=epochs,
+      patience=patience,
+      keep_checkpoints=keep_checkpoints,
+      cache_dir_path=None if cache_dir_path is None else str(Path(cache_dir_path)),
+      cache_max_size=None if cache_max_size is None else cache_max_size * 1024 * 1024,
+      no_cache=no_cache
+    )
+
+class AccessCausalityDataConversionCli(Cli):
+  name: Final[str] = 'convert'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--input',
+      help='Path to the training data json',
+      required=True
+    )
+    parser.add_argument(
+      '--output',
+      help='Path to the memory-mappable .npy training data, whose index is written next to it',
+      required=True
+    )
+
+  def handle(self, args: Namespace) -> None:
+    input_path: str = args.input
+    output_path: str = args.output
+
+    from ..utils.series_matrix import SeriesMatrix
+    series = SeriesMatrix.load(str(Path(input_path)), names_key='features')
+    series.save_npy(str(Path(output_path)))
+
+class AccessCausalityWindowingBenchmarkCli(Cli):
+  name: Final[str] = 'bench-windowing'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--steps',
+      help='Number of batches to time for each pipeline',
+      type=positive_int,
+      default=50
+    )
+
+  def handle(self, args: Namespace) -> None:
+    data_path: str = args.data
+    steps: int = args.steps
+
+    from .model import benchmark_model_windowing
+    benchmark_model_windowing(data_path=str(Path(data_path)), steps=steps)
+
+class AccessCausalityInputBenchmarkCli(Cli):
+  name: Final[str] = 'bench-input'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--checkpoint-dir',
+      help='The dir storing the checkpoints, whose standardization params are used',
+      required=True
+    )
+    parser.add_argument(
+      '--training-data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--steps',
+      help='Number of batches to time',
+      type=positive_int,
+      default=100
+    )
+    parser.add_argument(
+      '--log-dir',
+      help='The dir to write a profiler trace of the input pipeline for TensorBoard'
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    checkpoint_dir_path: str = args.checkpoint_dir
+    training_data_path: str = args.training_data
+    steps: int = args.steps
+    log_dir_path: Optional[str] = args.log_dir
+    no_cache: bool = args.no_cache
+
+    from .model import benchmark_model_input
+    benchmark_model_input(
+      checkpoint_dir_path=str(Path(checkpoint_dir_path)),
+      data_path=str(Path(training_data_path)),
+      steps=steps,
+      log_dir_path=None if log_dir_path is None else str(Path(log_dir_path)),
+      no_cache=no_cache
+    )
+
+class AccessCausalitySweepCli(Cli):
+  name: Final[str] = 'sweep'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--spec',
+      help='Path to the search spec json, listing the values of each hyperparam to try',
+      required=True
+    )
+    parser.add_argument(
+      '--output-dir',
+      help='The dir storing the checkpoints of each trial and the sweep.json ranking',
+      required=True
+    )
+    parser.add_argument(
+      '--epochs',
+      help='Number of epochs to train in each trial',
+      type=int,
+      default=20
+    )
+    parser.add_argument(
+      '--steps-per-epoch',
+      help='Number of batches in each epoch, defaults to a full pass over the training windows',
+      type=int
+    )
+    parser.add_argument(
+      '--workers',
+      help='Number of trials to run in parallel, defaults to the number of CPUs divided by --threads-per-worker',
+      type=int
+    )
+    parser.add_argument(
+      '--threads-per-worker',
+      help='Number of TF threads of each worker',
+      type=int,
+      default=1
+    )
+    parser.add_argument(
+      '--cache-dir',
+      help='The dir caching the parsed datasets'
+    )
+    parser.add_argument(
+      '--cache-max-size',
+      help='Evict the least recently used cached datasets when the cache grows over this size in MB',
+      type=int
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    data_path: str = args.data
+    spec_path: str = args.spec
+    output_dir_path: str = args.output_dir
+    epochs: int = args.epochs
+    steps_per_epoch: Optional[int] = args.steps_per_epoch
+    workers: Optional[int] = args.workers
+    threads_per_worker: int = args.threads_per_worker
+    cache_dir_path: Optional[str] = args.cache_dir
+    cache_max_size: Optional[int] = args.cache_max_size
+    no_cache: bool = args.no_cache
+
+    from .model import sweep_model
+    sweep_model(
+      data_path=str(Path(data_path)),
+      spec_path=str(Path(spec_path)),
+      output_dir_path=str(Path(output_dir_path)),
+      epochs=epochs,
+      steps_per_epoch=steps_per_epoch,
+      workers=workers,
+      threads_per_worker=threads_per_worker,
+      cache_dir_path=None if cache_dir_path is None else str(Path(cache_dir_path)),
+      cache_max_size=None if cache_max_size is None else cache_max_size * 1024 * 1024,
+      no_cache=no_cache
+    )
+
+class AccessCausalityModelUpdateCli(Cli):
+  name: Final[str] = 'update'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--checkpoint-dir',
+      help='The dir storing the checkpoints of a trained model',
+      required=True
+    )
+    parser.add_argument(
+      '--data',
+      help='Path to a json, or the .npy written by the convert action, holding only the rows after the data trained on so far',
+      required=True
+    )
+    parser.add_argument(
+      '--epochs',
+      help='Number of epochs to fine-tune, defaults to 5',
+      type=int
+    )
+    parser.add_argument(
+      '--replay-ratio',
+      help='Number of older windows replayed per new window, defaults to 1',
+      type=float
+    )
+    parser.add_argument(
+      '--log-dir',
+      help='The dir storing the log for TensorBoard'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    checkpoint_dir_path: str = args.checkpoint_dir
+    data_path: str = args.data
+    epochs: Optional[int] = args.epochs
+    replay_ratio: Optional[float] = args.replay_ratio
+    log_dir_path: Optional[str] = args.log_dir
+
+    from .model import update_model
+    update_model(
+      checkpoint_dir_path=str(Path(checkpoint_dir_path)),
+      data_path=str(Path(data_path)),
+      epochs=epochs,
+      replay_ratio=replay_ratio,
+      log_dir_path=None if log_dir_path is None else str(Path(log_dir_path))
+    )
+
+class AccessCausalityModelExportCli(Cli):
+  name: Final[str] = 'export'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--checkpoint-dir',
+      help='The dir storing the checkpoints of a trained model',
+      required=True
+    )
+    parser.add_argument(
+      '--output',
+      help='Path to the .npz loaded by the NumPy backend of the server, defaults to model.npz in the checkpoint dir'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    checkpoint_dir_path: str = args.checkpoint_dir
+    output_path: Optional[str] = args.output
+
+    from .model import export_model
+    export_model(
+      checkpoint_dir_path=str(Path(checkpoint_dir_path)),
+      export_path=None if output_path is None else str(Path(output_path))
     )
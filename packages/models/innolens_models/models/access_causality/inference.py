@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+from abc import ABCMeta, abstractmethod
+from typing import Any, Iterable, Sequence
+from typing_extensions import Final
+
+import numpy as np
+
+from ..utils.dense_stack import DenseStack
+from ..utils.series_matrix import SeriesMatrix
+
+
+class MissingFeautureException(Exception):
+  def __init__(self, features: Iterable[str]):
+    features_str = ', '.join(features)
+    super().__init__(f'Missing features: {features_str}')
+
+class UnknownFeautureException(Exception):
+  def __init__(self, features: Iterable[str]):
+    features_str = ', '.join(features)
+    super().__init__(f'Unknown features: {features_str}')
+
+
+class AccessCausalityPredictor(metaclass=ABCMeta):
+  '''
+  The serving side of the access causality model, shared by the TensorFlow model
+  and the NumPy one loaded from its export.
+  '''
+
+  features: Sequence[str]
+  history_window_size: int
+  forecast_window_size: int
+  time_step_ms: Final = 30 * 60 * 1000 # 30 minutes, not used by the models, just a constant for the server
+
+  @abstractmethod
+  def predict_flat(self, X_batch: np.ndarray) -> np.ndarray:
+    '''
+    Forecast a batch of samples flattened feature by feature, in the original unit.
+    '''
+    ...
+
+  def predict(self, history_batch: Any) -> Any:
+    X_batch = np.stack([
+      np.stack([
+        history[feature]
+        for feature in self.features
+      ], axis=1)
+      for history in history_batch
+    ])
+
+    predictions = self.predict_matrix(X_batch)
+
+    def iter_forecast() -> Any:
+      for prediction in predictions:
+        yield {
+          feature: prediction[:, f]
+          for f, feature in enumerate(self.features)
+        }
+    return list(iter_forecast())
+
+  def predict_matrix(self, X_batch: np.ndarray) -> np.ndarray:
+    '''
+    Forecast a batch of (history time, feature) matrices, with the features in the
+    order of self.features, into a batch of (forecast time, feature) matrices.
+    '''
+    # Flatten each sample feature by feature
+    X_batch = X_batch.transpose((0, 2, 1)).reshape((X_batch.shape[0], -1))
+    predictions = self.predict_flat(X_batch)
+    return predictions.reshape((-1, len(self.features), self.forecast_window_size)).transpose((0, 2, 1))
+
+  def predict_json(self, history_json: Any) -> Any:
+    forecast_matrix = self.predict_matrix(self.matrix_from_json(history_json)[np.newaxis])[0]
+    return self.matrix_to_json(history_json, forecast_matrix)
+
+  def matrix_from_json(self, history_json: Any) -> np.ndarray:
+    '''
+    Check the features of a history json and turn it into a (history time, feature)
+    matrix for predict_matrix.
+    '''
+    missing_features = set(self.features) - set(history_json['features'])
+    unknown_features = set(history_json['features']) - set(self.features)
+    if len(missing_features) > 0:
+      raise MissingFeautureException(missing_features)
+    if len(unknown_features) > 0:
+      raise UnknownFeautureException(unknown_features)
+
+    # Ingest the history the same way as the training data
+    history = SeriesMatrix.from_json(history_json, names_key='features').select(self.features)
+    return history.values
+
+  def matrix_to_json(self, history_json: Any, forecast_matrix: np.ndarray) -> Any:
+    '''
+    Turn a (forecast time, feature) matrix into a json with the features in the
+    order of the history json.
+    '''
+    forecast = {
+      feature: forecast_matrix[:, f]
+      for f, feature in enumerate(self.features)
+    }
+
+    forecast_json = {
+      'features': history_json['features'],
+      'values': [
+        forecast[feature].tolist()
+        for feature in history_json['features']
+      ]
+    }
+    return forecast_json
+
+
+class AccessCausalityNumpyModel(AccessCausalityPredictor):
+  '''
+  The access causality model loaded from the .npz written by the export action,
+  which serves without TensorFlow.
+  '''
+
+  stack: Final[DenseStack]
+
+  def __init__(self, *, export_path: str):
+    super().__init__()
+    self.stack = DenseStack.load(export_path)
+    self.features = self.stack.meta['features']
+    self.history_window_size = self.stack.meta['historyWindowSize']
+    self.forecast_window_size = self.stack.meta['forecastWindowSize']
+
+  def predict_flat(self, X_batch: np.ndarray) -> np.ndarray:
+    return self.stack.predict(X_batch)
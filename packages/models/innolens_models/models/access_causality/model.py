@@ -1,35 +1,42 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from math import ceil
-from typing import Any, Optional, Iterable, ClassVar, Sequence
+from typing import Any, Mapping, NamedTuple, Optional, Iterable, Sequence, Tuple, TYPE_CHECKING
 from typing_extensions import Final
 from pathlib import Path
 import logging
 from pprint import pprint
-import os.path
-import re
-import json
 
-import matplotlib.pyplot as plt
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
-import pandas as pd
 
+from ..utils.checkpoints import TopKCheckpoint, find_checkpoint, replace_checkpoints
+from ..utils.dataset_cache import DatasetCache, create_dataset_cache
+from ..utils.dense_stack import DenseStack
+from ..utils.hyperparams import load_hyperparams, parse_hyperparams, save_hyperparams
+from ..utils.input_benchmark import benchmark_input
+from ..utils.running_moments import RunningMoments
+from ..utils.series_matrix import SeriesMatrix
+from ..utils.serving import compile_serving_predict
+from ..utils.sweep import Trial, load_search_spec, plan_trials, run_sweep
+from ..utils.windowing import SlidingWindows, benchmark_windowing
+from .inference import AccessCausalityPredictor
+
+if TYPE_CHECKING:
+  import matplotlib.pyplot as plt
 
-hk_timezone: Final = timezone(timedelta(hours=8))
 
+hk_timezone: Final = timezone(timedelta(hours=8))
 
-class MissingFeautureException(Exception):
-  def __init__(self, features: Iterable[str]):
-    features_str = ', '.join(features)
-    super().__init__(f'Missing features: {features_str}')
 
-class UnknownFeautureException(Exception):
-  def __init__(self, features: Iterable[str]):
-    features_str = ', '.join(features)
-    super().__init__(f'Unknown features: {features_str}')
+class AccessCausalityHyperparams(NamedTuple):
+  history_window_size: int = 2 * 2 # 2 hours
+  hidden_units: Sequence[int] = (256,)
+  learning_rate: float = 0.001
+  batch_size: int = 128
 
 
 def train_model(
@@ -38,33 +45,181 @@ def train_model(
   training_data_path: Optional[str] = None,
   evaluation_data_path: Optional[str] = None,
   log_dir_path: Optional[str] = None,
-  show_ui: bool = False
+  show_ui: bool = False,
+  epochs: Optional[int] = None,
+  patience: Optional[int] = None,
+  keep_checkpoints: Optional[int] = None,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
 ) -> None:
   logging.getLogger().setLevel(logging.INFO)
   tf.get_logger().setLevel(logging.INFO)
 
   model = AccessCausalityModel(
     checkpoint_dir_path=checkpoint_dir_path,
-    log_dir_path=log_dir_path
+    log_dir_path=log_dir_path,
+    dataset_cache=create_dataset_cache(
+      no_cache=no_cache,
+      cache_dir_path=cache_dir_path,
+      cache_max_size=cache_max_size
+    )
   )
 
   if training_data_path is not None:
-    model.train(training_data_path, show_ui=show_ui)
+    model.train(
+      training_data_path,
+      epochs=epochs,
+      patience=patience,
+      keep_checkpoints=keep_checkpoints,
+      show_ui=show_ui
+    )
 
   if evaluation_data_path is not None:
     result = model.evaluate(evaluation_data_path, show_ui=show_ui)
     pprint(result)
 
-class AccessCausalityModel:
+def update_model(
+  *,
+  checkpoint_dir_path: str,
+  data_path: str,
+  epochs: Optional[int] = None,
+  replay_ratio: Optional[float] = None,
+  log_dir_path: Optional[str] = None
+) -> None:
+  logging.getLogger().setLevel(logging.INFO)
+  tf.get_logger().setLevel(logging.INFO)
+
+  model = AccessCausalityModel(
+    checkpoint_dir_path=checkpoint_dir_path,
+    log_dir_path=log_dir_path,
+    dataset_cache=None
+  )
+  history = model.update(data_path, epochs=epochs, replay_ratio=replay_ratio)
+  pprint({ name: values[-1] for name, values in history.items() })
+
+def export_model(
+  *,
+  checkpoint_dir_path: str,
+  export_path: Optional[str] = None
+) -> None:
+  logging.getLogger().setLevel(logging.INFO)
+
+  if export_path is None:
+    export_path = str(Path(checkpoint_dir_path) / 'model.npz')
+  model = AccessCausalityModel(checkpoint_dir_path=checkpoint_dir_path)
+  pprint({ 'exportPath': export_path, 'maxAbsDiff': model.export(export_path) })
+
+def benchmark_model_windowing(
+  *,
+  data_path: str,
+  steps: int = 50
+) -> None:
+  series = SeriesMatrix.load(
+    data_path,
+    names_key='features',
+    dataset_cache=create_dataset_cache()
+  )
+  pprint(benchmark_windowing(
+    series.select(AccessCausalityModel.features).values,
+    history_size=AccessCausalityHyperparams().history_window_size,
+    forecast_size=AccessCausalityModel.forecast_window_size,
+    per_series=False,
+    steps=steps
+  ))
+
+def benchmark_model_input(
+  *,
+  checkpoint_dir_path: str,
+  data_path: str,
+  steps: int = 100,
+  log_dir_path: Optional[str] = None,
+  no_cache: bool = False
+) -> None:
+  logging.getLogger().setLevel(logging.INFO)
+
+  model = AccessCausalityModel(
+    checkpoint_dir_path=checkpoint_dir_path,
+    dataset_cache=create_dataset_cache(no_cache=no_cache)
+  )
+  pprint(model.benchmark_input(data_path, steps=steps, log_dir_path=log_dir_path))
+
+def sweep_model(
+  *,
+  data_path: str,
+  spec_path: str,
+  output_dir_path: str,
+  epochs: int = 20,
+  steps_per_epoch: Optional[int] = None,
+  workers: Optional[int] = None,
+  threads_per_worker: int = 1,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> None:
+  logging.getLogger().setLevel(logging.INFO)
+
+  trials = plan_trials(load_search_spec(spec_path), output_dir_path=output_dir_path)
+  for trial in trials:
+    parse_hyperparams(AccessCausalityHyperparams(), trial.params)
+
+  if not no_cache:
+    SeriesMatrix.load_cached(data_path, names_key='features', cache_dir_path=cache_dir_path, cache_max_size=cache_max_size)
+
+  run_sweep(
+    trials,
+    partial(
+      run_sweep_trial,
+      data_path=data_path,
+      epochs=epochs,
+      steps_per_epoch=steps_per_epoch,
+      cache_dir_path=cache_dir_path,
+      cache_max_size=cache_max_size,
+      no_cache=no_cache
+    ),
+    output_dir_path=output_dir_path,
+    metric='val_loss',
+    workers=workers,
+    threads_per_worker=threads_per_worker
+  )
+
+def run_sweep_trial(
+  trial: Trial,
+  *,
+  data_path: str,
+  epochs: int,
+  steps_per_epoch: Optional[int],
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> Mapping[str, float]:
+  logging.getLogger().setLevel(logging.INFO)
+
+  model = AccessCausalityModel(
+    checkpoint_dir_path=trial.checkpoint_dir_path,
+    hyperparams=parse_hyperparams(AccessCausalityHyperparams(), trial.params),
+    dataset_cache=create_dataset_cache(
+      no_cache=no_cache,
+      cache_dir_path=cache_dir_path,
+      cache_max_size=cache_max_size
+    )
+  )
+  history = model.train(data_path, epochs=epochs, steps_per_epoch=steps_per_epoch)
+  return {
+    name: float(np.min(values))
+    for name, values in history.items()
+  }
+
+class AccessCausalityModel(AccessCausalityPredictor):
   checkpoint_dir_path: Final[str]
   log_dir_path: Final[Optional[str]]
+  dataset_cache: Final[Optional[DatasetCache]]
+  hyperparams: Final[AccessCausalityHyperparams]
 
-  history_window_size: Final = 2 * 2 # 2 hours
-  forecast_window_size: Final = 1 * 2 # 1 hour
+  forecast_window_size = 1 * 2 # 1 hour
   window_shift: Final = 1 # 30 minutes
-  time_step_ms: Final = 30 * 60 * 1000 # 30 minutes, not used by this class, just a constant for the server
 
-  features: Final[ClassVar[Sequence[str]]] = [
+  features = [
     # 'inno_wing',
     'ar_vr_room',
     'laser_cutting_room',
@@ -92,13 +247,13 @@ class AccessCausalityModel:
   ]
 
   # Show these moments in plots
-  interested_times: Final[ClassVar[Sequence[datetime]]] = [
+  interested_times: Final[Sequence[datetime]] = [
     datetime(2020, 4, 27, 12, 30, tzinfo=hk_timezone), # Mon
     datetime(2020, 4, 27, 13, 30, tzinfo=hk_timezone) # Mon
   ]
 
   # Only show these in plots
-  interested_features: Final[ClassVar[Sequence[str]]] = [
+  interested_features: Final[Sequence[str]] = [
     'open_event_area',
     'brainstorming_area',
     'event_hall_a',
@@ -107,30 +262,46 @@ class AccessCausalityModel:
     'machine_room'
   ]
 
+  __validation_size: Final = 30 * 24 * 2 # Use the first 30 days as the validation set
+  __replay_size: Final = 60 * 24 * 2 # Last 60 days of rows kept for update
+
   __model: Final[Any]
   __mean: float
   __stddev: float
   __last_epoch: int
+  __serving_predict: Optional[Any]
+  __serving_params: Optional[Tuple[float, float]]
+  __serving_xla: bool
 
   def __init__(
     self,
     *,
     checkpoint_dir_path: str,
-    log_dir_path: Optional[str] = None
+    log_dir_path: Optional[str] = None,
+    dataset_cache: Optional[DatasetCache] = None,
+    hyperparams: Optional[AccessCausalityHyperparams] = None
   ):
     super().__init__()
 
     self.checkpoint_dir_path = checkpoint_dir_path
     self.log_dir_path = log_dir_path
+    self.dataset_cache = dataset_cache
+    # The hyperparams saved with the checkpoints decide the architecture, unless overridden
+    self.hyperparams = (
+      load_hyperparams(checkpoint_dir_path, AccessCausalityHyperparams())
+      if hyperparams is None
+      else hyperparams
+    )
+    self.history_window_size = self.hyperparams.history_window_size
 
     '''
-    TODO: tune this model.
+    Tune the hyperparams with the sweep action.
     '''
     model = keras.models.Sequential([
-      keras.layers.Dense(
-        256, # (len(self.features) * self.history_window_size) ** 2,
-        input_shape=(len(self.features) * self.history_window_size,),
-        activation=keras.activations.relu
+      keras.layers.InputLayer(input_shape=(len(self.features) * self.history_window_size,)),
+      *(
+        keras.layers.Dense(units, activation=keras.activations.relu)
+        for units in self.hyperparams.hidden_units
       ),
       keras.layers.Dense(
         len(self.features) * self.forecast_window_size
@@ -139,7 +310,7 @@ class AccessCausalityModel:
     self.__model = model
 
     model.compile(
-      optimizer=keras.optimizers.Adam(),
+      optimizer=keras.optimizers.Adam(learning_rate=self.hyperparams.learning_rate),
       loss='mae',
       metrics=['mae', 'mse']
     )
@@ -147,20 +318,21 @@ class AccessCausalityModel:
     self.__mean = np.float_(0.0)
     self.__stddev = np.float_(1.0)
     self.__last_epoch = 0
+    self.__serving_predict = None
+    self.__serving_params = None
+    self.__serving_xla = False
 
-    latest_ckpt = tf.train.latest_checkpoint(self.checkpoint_dir_path)
-    if latest_ckpt is not None:
-      match = re.search(r'\d+', Path(latest_ckpt).name)
-      if match is not None:
-        self.__last_epoch = int(match[0])
+    checkpoint = find_checkpoint(self.checkpoint_dir_path)
+    if checkpoint is not None:
+      ckpt_path, self.__last_epoch = checkpoint
 
-        model.load_weights(latest_ckpt)
-        logging.info(f'Load checkpoint from {latest_ckpt}')
+      model.load_weights(ckpt_path)
+      logging.info(f'Load checkpoint from {ckpt_path}')
 
-        std_path = Path(self.checkpoint_dir_path) / 'standardize_params.npz'
-        arrs = np.load(std_path)
-        self.__mean = np.float_(arrs['mean'])
-        self.__stddev = np.float_(arrs['stddev'])
+      std_path = Path(self.checkpoint_dir_path) / 'standardize_params.npz'
+      arrs = np.load(std_path)
+      self.__mean = np.float_(arrs['mean'])
+      self.__stddev = np.float_(arrs['stddev'])
 
   def train(
     self,
@@ -169,39 +341,43 @@ class AccessCausalityModel:
     epochs: Optional[int] = None,
     steps_per_epoch: Optional[int] = None,
     validation_steps: Optional[int] = None,
+    patience: Optional[int] = None,
+    keep_checkpoints: Optional[int] = None,
     show_ui: bool = False
-  ) -> None:
+  ) -> Mapping[str, Sequence[float]]:
+    '''
+    Train on the data and return the metrics of each epoch.
+    '''
     if epochs is None:
-      epochs = 20
-    if steps_per_epoch is None:
-      steps_per_epoch = 20
-    if validation_steps is None:
-      validation_steps = 10
+      epochs = 100
+    if patience is None:
+      patience = 5
+    if keep_checkpoints is None:
+      keep_checkpoints = 3
 
-    if self.__last_epoch == 0:
-      # Commented below to not standardize the features
-      df = self.__load_dataframe(path)
-      self.__mean = df.drop(['start_time', 'end_time'], axis=1).values.mean()
-      self.__stddev = df.drop(['start_time', 'end_time'], axis=1).values.std()
-      std_path = Path(self.checkpoint_dir_path) / 'standardize_params.npz'
-      std_path.parent.mkdir(parents=True, exist_ok=True)
-      np.savez(
-        std_path,
-        mean=self.__mean,
-        stddev=self.__stddev
-      )
+    series = self.__load_series(path)
 
-    ds = self.__load_dataset(path)
-    # Use the first 30 days as the validation set
-    train_ds = ds.skip(30 * 24 * 2).shuffle(10000).batch(128).repeat()
-    val_ds = ds.take(30 * 24 * 2).batch(128).repeat()
+    if self.__last_epoch == 0:
+      moments = RunningMoments.of(series.values)
+      self.__mean = np.float_(moments.mean)
+      self.__stddev = np.float_(moments.stddev)
+      moments.save(str(Path(self.checkpoint_dir_path) / 'standardize_params.npz'))
+      save_hyperparams(self.checkpoint_dir_path, self.hyperparams)
+    self.__save_replay(series)
+
+    windows = self.__create_windows(series)
+    train_ds = self.__create_training_dataset(windows)
+    val_ds = self.__create_validation_dataset(windows)
+    # Go through every sample once per epoch by default
+    batch_size = self.hyperparams.batch_size
+    if steps_per_epoch is None:
+      steps_per_epoch = max(1, ceil((len(windows) - self.__validation_size) / batch_size))
+    if validation_steps is None:
+      validation_steps = max(1, ceil(min(len(windows), self.__validation_size) / batch_size))
 
     callbacks = []
-    callbacks.append(keras.callbacks.ModelCheckpoint(
-      filepath=os.path.join(self.checkpoint_dir_path, 'checkpoint-{epoch:04d}'),
-      verbose=1,
-      save_weights_only=True
-    ))
+    callbacks.append(TopKCheckpoint(self.checkpoint_dir_path, k=keep_checkpoints))
+    callbacks.append(keras.callbacks.EarlyStopping(patience=patience, restore_best_weights=True))
     if self.log_dir_path is not None:
       callbacks.append(keras.callbacks.TensorBoard(self.log_dir_path))
 
@@ -214,14 +390,84 @@ class AccessCausalityModel:
       validation_steps=validation_steps,
       callbacks=callbacks
     )
-    self.last_epoch = training_history.epoch[-1]
+    self.__last_epoch = training_history.epoch[-1] + 1
 
     if show_ui:
-      self.__visualize_examples(path, 'Training')
+      self.__visualize_examples(series, 'Training')
+
+    return training_history.history
+
+  def update(
+    self,
+    path: str,
+    *,
+    epochs: Optional[int] = None,
+    replay_ratio: Optional[float] = None
+  ) -> Mapping[str, Sequence[float]]:
+    '''
+    Fine-tune on data holding only the rows appended after the data trained on so
+    far. The windows reaching into the new rows are mixed with a random replay of
+    replay_ratio times as many older windows, so the older patterns are not
+    forgotten. The older windows are drawn from the last rows trained on, which
+    are kept in the checkpoint dir instead of all of them. The standardization
+    params are updated with the running moments instead of being recomputed over
+    all the data.
+    '''
+    if epochs is None:
+      epochs = 5
+    if replay_ratio is None:
+      replay_ratio = 1.0
+
+    replay_path = Path(self.checkpoint_dir_path) / 'replay.npy'
+    std_path = Path(self.checkpoint_dir_path) / 'standardize_params.npz'
+    moments = RunningMoments.load(str(std_path))
+    if self.__last_epoch == 0 or not replay_path.exists() or moments is None:
+      raise ValueError('Train the model before updating it')
+
+    old_series = SeriesMatrix.load_npy(str(replay_path))
+    new_series = self.__load_series(path)
+    series = old_series.append(new_series)
+
+    moments.update(series.values[old_series.values.shape[0]:])
+    self.__mean = np.float_(moments.mean)
+    self.__stddev = np.float_(moments.stddev)
+
+    windows = self.__create_windows(series)
+    window_size = self.history_window_size + self.forecast_window_size
+    first_new_window = max(0, (old_series.values.shape[0] - window_size) // self.window_shift + 1)
+    if first_new_window >= windows.window_count:
+      raise ValueError('Not enough new rows for a window')
+    new_windows = np.arange(first_new_window, windows.window_count)
+    replay_windows = np.random.default_rng().choice(
+      first_new_window,
+      size=min(first_new_window, int(new_windows.shape[0] * replay_ratio)),
+      replace=False
+    )
+    idxs = windows.sample_idxs(np.concatenate([replay_windows, new_windows]))
+    logging.info(f'Update with {new_windows.shape[0]} new and {replay_windows.shape[0]} replayed windows')
+
+    batch_size = self.hyperparams.batch_size
+    callbacks = []
+    if self.log_dir_path is not None:
+      callbacks.append(keras.callbacks.TensorBoard(self.log_dir_path))
+
+    training_history = self.__model.fit(
+      windows.dataset(batch_size=batch_size, idxs=idxs, shuffle=True, repeat=True),
+      initial_epoch=self.__last_epoch,
+      epochs=self.__last_epoch + epochs,
+      steps_per_epoch=max(1, ceil(idxs.shape[0] / batch_size)),
+      callbacks=callbacks
+    )
+    self.__last_epoch = training_history.epoch[-1] + 1
+
+    replace_checkpoints(self.__model, self.checkpoint_dir_path, epoch=self.__last_epoch)
+    moments.save(str(std_path))
+    self.__save_replay(series)
+    return training_history.history
 
   def evaluate(self, path: str, *, show_ui: bool = False) -> Any:
-    ds = self.__load_dataset(path)
-    eval_ds = ds.shuffle(1000).batch(128).repeat().take(10)
+    series = self.__load_series(path)
+    eval_ds = self.__create_windows(series).dataset(batch_size=self.hyperparams.batch_size, shuffle=True, repeat=True).take(10)
 
     callbacks = []
     if self.log_dir_path is not None:
@@ -233,121 +479,114 @@ class AccessCausalityModel:
     )
 
     if show_ui:
-      self.__visualize_examples(path, 'evaluation')
+      self.__visualize_examples(series, 'evaluation')
 
     return result
 
-  def predict(self, history_batch: Any) -> Any:
-    X_batch = np.vstack([
-      np.vstack([
-        history[feature]
-        for feature in self.features
-      ]).reshape((-1,))
-      for history in history_batch
-    ])
-    X_batch = (X_batch - self.__mean) / self.__stddev
-
-    predictions = self.__model.predict(X_batch)
-    predictions = predictions * self.__stddev + self.__mean
-
-    def iter_forecast() -> Any:
-      for i in range(len(history_batch)):
-        prediction = predictions[i].reshape((len(self.features), self.forecast_window_size))
-        yield {
-          feature: prediction[f]
-          for f, feature in enumerate(self.features)
-        }
-    return list(iter_forecast())
-
-  def predict_json(self, history_json: Any) -> Any:
-    missing_features = set(self.features) - set(history_json['features'])
-    unknown_features = set(history_json['features']) - set(self.features)
-    if len(missing_features) > 0:
-      raise MissingFeautureException(missing_features)
-    if len(unknown_features) > 0:
-      raise UnknownFeautureException(unknown_features)
-
-    history = {
-      feature: np.array(history_json['values'][f], dtype=np.int32)
-      for f, feature in enumerate(history_json['features'])
-    }
-    history = {
-      feature: history[feature]
-      for feature in self.features
-    }
-
-    forecast = self.predict([history])[0]
+  def compile_predict(self, *, xla: Optional[bool] = None, warmup: bool = True) -> None:
+    '''
+    Trace the predict used for serving, optionally compiled with XLA, and warm it up.
+    '''
+    if xla is not None:
+      self.__serving_xla = xla
+    self.__serving_predict = compile_serving_predict(
+      self.__model,
+      input_size=len(self.features) * self.history_window_size,
+      mean=self.__mean,
+      stddev=self.__stddev,
+      xla=self.__serving_xla,
+      warmup=warmup
+    )
+    self.__serving_params = (self.__mean, self.__stddev)
 
-    # fig = plt.figure()
-    # axs = fig.subplots(ceil(len(interested_features) / 2), 2).flatten()
-    # self.__visualize_example(axs, history, None, forecast)
-    # fig.tight_layout()
-    # plt.show()
+  def predict_flat(self, X_batch: np.ndarray) -> np.ndarray:
+    # The standardization params are baked into the graph, so retrace after they change
+    if self.__serving_predict is None or self.__serving_params != (self.__mean, self.__stddev):
+      self.compile_predict(warmup=False)
+    serving_predict = self.__serving_predict
+    assert serving_predict is not None
+    return serving_predict(np.asarray(X_batch, dtype=np.float64)).numpy()
 
-    forecast_json = {
-      'features': history_json['features'],
-      'values': [
-        forecast[feature].tolist()
-        for feature in history_json['features']
-      ]
-    }
-    return forecast_json
-
-  def __load_dataframe(self, path: str) -> pd.DataFrame:
-    with open(path) as file:
-      data = json.load(file)
-    df = pd.DataFrame({
-      feature: pd.Series(data['values'][f], dtype=np.int32)
-      for f, feature in enumerate(data['features'])
-    })
-    df['start_time'] = pd.Series(
-      [datetime.fromisoformat(start_time) for start_time in data['startTimes']],
-      dtype=pd.DatetimeTZDtype(tz=hk_timezone)
+  def export(self, export_path: str) -> float:
+    '''
+    Write the weights and standardization params to an .npz for
+    AccessCausalityNumpyModel, after checking the NumPy forward pass matches this
+    model. Returns the max abs difference between the two on random histories.
+    '''
+    input_size = len(self.features) * self.history_window_size
+    stack = DenseStack.from_keras(
+      self.__model,
+      mean=self.__mean,
+      stddev=self.__stddev,
+      meta={
+        'features': list(self.features),
+        'historyWindowSize': self.history_window_size,
+        'forecastWindowSize': self.forecast_window_size
+      }
+    )
+    X_batch = np.random.default_rng(0).normal(self.__mean, self.__stddev, size=(256, input_size))
+    expected = self.predict_flat(X_batch)
+    actual = stack.predict(X_batch)
+    if not np.allclose(actual, expected, rtol=1e-4, atol=1e-4 * self.__stddev):
+      raise ValueError('The NumPy forward pass does not match the model')
+    stack.save(export_path)
+    logging.info(f'Export the model to {export_path}')
+    return float(np.max(np.abs(actual - expected)))
+
+  def benchmark_input(self, path: str, *, steps: int = 100, log_dir_path: Optional[str] = None) -> Any:
+    return benchmark_input(
+      load_series=lambda: self.__load_series(path),
+      create_windows=self.__create_windows,
+      create_dataset=self.__create_training_dataset,
+      forward=self.__model.predict_on_batch,
+      batch_size=self.hyperparams.batch_size,
+      start=self.__validation_size,
+      steps=steps,
+      log_dir_path=log_dir_path
     )
-    df['end_time'] = pd.Series(
-      [datetime.fromisoformat(end_time) for end_time in data['endTimes']],
-      dtype=pd.DatetimeTZDtype(tz=hk_timezone)
+
+  def __load_series(self, path: str) -> SeriesMatrix:
+    series = SeriesMatrix.load(path, names_key='features', dataset_cache=self.dataset_cache)
+    series = series.select(self.features)
+    assert np.isfinite(series.values).all()
+    return series
+
+  def __save_replay(self, series: SeriesMatrix) -> None:
+    # Enough rows for the windows across the appended rows, and recent windows to replay
+    replay_size = max(self.__replay_size, self.history_window_size + self.forecast_window_size - 1)
+    replay_series = series.slice(max(0, series.values.shape[0] - replay_size), None)
+    replay_series.save_npy(str(Path(self.checkpoint_dir_path) / 'replay.npy'))
+
+  def __create_windows(self, series: SeriesMatrix) -> SlidingWindows:
+    return SlidingWindows(
+      series.values,
+      history_size=self.history_window_size,
+      forecast_size=self.forecast_window_size,
+      shift=self.window_shift,
+      per_series=False,
+      mean=self.__mean,
+      stddev=self.__stddev
     )
-    assert df.notna().all(None)
-
-    df = df[['start_time', 'end_time', *self.features]]
-    return df
-
-  def __load_dataset(self, path: str) -> Any:
-    df = self.__load_dataframe(path)
-
-    ds = tf.data.Dataset.from_tensor_slices({
-      feature: df[feature].to_numpy()
-      for feature in self.features
-    })
-    ds = ds.map(lambda xs: {
-      name: (x - self.__mean) / self.__stddev
-      for name, x in xs.items()
-    })
-    ds = ds.window(size=self.history_window_size + self.forecast_window_size, shift=self.window_shift, drop_remainder=True)
-    ds = ds.flat_map(lambda dsd: tf.data.Dataset.zip({
-      name: sub_vals.batch(self.history_window_size + self.forecast_window_size).map(lambda x: tf.reshape(x, [self.history_window_size + self.forecast_window_size]))
-      for name, sub_vals in dsd.items()
-    }))
-    ds = ds.map(lambda xs: {
-      name: (x[:-self.forecast_window_size], x[-self.forecast_window_size:])
-      for name, x in xs.items()
-    })
-    ds = ds.map(lambda xys: (
-      tf.reshape(tf.stack([xys[feature][0] for feature in self.features]), shape=(-1,)), # Flatten to 1D array
-      tf.reshape(tf.stack([xys[feature][1] for feature in self.features]), shape=(-1,))
-    ))
-    return ds
-
-  def __visualize_examples(self, path: str, subtitle: str) -> None:
-    df = self.__load_dataframe(path)
+
+  def __create_training_dataset(self, windows: SlidingWindows) -> Any:
+    return windows.dataset(batch_size=self.hyperparams.batch_size, start=self.__validation_size, shuffle=True, repeat=True)
+
+  def __create_validation_dataset(self, windows: SlidingWindows) -> Any:
+    return windows.dataset(batch_size=self.hyperparams.batch_size, stop=self.__validation_size, repeat=True, cache=True)
+
+  def __visualize_examples(self, series: SeriesMatrix, subtitle: str) -> None:
+    # Imported here so serving does not load matplotlib
+    import matplotlib.pyplot as plt
+
+    assert series.end_times is not None
 
     history_batch = []
     label_batch = []
     for time in self.interested_times:
-      start_idx = df[df['end_time'] == time].index[0]
-      history_batch.append(df.iloc[start_idx - self.history_window_size + 1 : start_idx + 1, :]) # including end
-      label_batch.append(df.iloc[start_idx + 1 : start_idx + self.forecast_window_size + 1, :])
+      time_utc = np.datetime64(int(time.timestamp() * 1000), 'ms')
+      start_idx = int(np.flatnonzero(series.end_times == time_utc)[0])
+      history_batch.append(self.__to_feature_dict(series.values[start_idx - self.history_window_size + 1 : start_idx + 1])) # including end
+      label_batch.append(self.__to_feature_dict(series.values[start_idx + 1 : start_idx + self.forecast_window_size + 1]))
 
     forecast_batch = self.predict(history_batch)
 
@@ -359,6 +598,12 @@ class AccessCausalityModel:
       fig.tight_layout()
       plt.show()
 
+  def __to_feature_dict(self, values: np.ndarray) -> Any:
+    return {
+      feature: values[:, f]
+      for f, feature in enumerate(self.features)
+    }
+
   def __visualize_example(self, axs: Iterable[plt.Axes], history: Any, label: Any, forecast: Any) -> None:
     for feature, ax in zip(self.interested_features, axs):
       ax.set_title(f'{feature}')
@@ -4,7 +4,6 @@ from argparse import ArgumentParser, Namespace
 from datetime import datetime, timedelta, timezone
 from typing import MutableSequence, Iterator, Mapping, Any, Optional, Sequence, Callable, TypeVar
 from typing_extensions import Final
-from pathlib import Path
 from logging import INFO
 from pprint import pprint
 from math import floor
@@ -15,6 +14,7 @@ import pandas as pd
 
 from ..cli import Cli
 from .utils.estimator_metrics import to_estimator_metrics
+from .utils.access_record_stream import read_access_record_chunks, iterate_periods, CsvChunkWriter
 
 
 hk_timezone: Final = timezone(timedelta(hours=8))
@@ -52,7 +52,8 @@ class AccessRecordPreprocessorCli(Cli):
 
     parser.add_argument(
       '--input',
-      help='Path to the input data csv',
+      help='Path to the input data csv. Multiple paths are read as consecutive time partitions',
+      nargs='+',
       required=True
     )
     parser.add_argument(
@@ -93,9 +94,19 @@ class AccessRecordPreprocessorCli(Cli):
       help='Fraction of data to be the evaluation data',
       type=float
     )
+    parser.add_argument(
+      '--chunk-size',
+      help='Stream the time-ordered input this many rows at a time instead of loading it into memory',
+      type=int
+    )
+    parser.add_argument(
+      '--max-stay',
+      help='Drop stays that are still open after this long, which bounds the memory used with --chunk-size',
+      type=rename('timedelta', lambda s: timedelta(**eval(f'dict({s})')))
+    )
 
   def handle(self, args: Namespace) -> None:
-    input_path: str = args.input
+    input_paths: Sequence[str] = args.input
     is_space: bool = args.space
     training_data_path: str = args.training_data
     evaluation_data_path: str = args.evaluation_data
@@ -103,16 +114,20 @@ class AccessRecordPreprocessorCli(Cli):
     end_time: datetime = args.end_time
     time_step: timedelta = args.time_step
     evaluation_fraction: Optional[float] = args.evaluation_fraction
+    chunk_size: Optional[int] = args.chunk_size
+    max_stay: Optional[timedelta] = args.max_stay
 
     preprocess(
-      input_path=input_path,
+      input_paths=input_paths,
       is_space=is_space,
       training_data_path=training_data_path,
       evaluation_data_path=evaluation_data_path,
       start_time=start_time,
       end_time=end_time,
       time_step=time_step,
-      evaluation_fraction=evaluation_fraction
+      evaluation_fraction=evaluation_fraction,
+      chunk_size=chunk_size,
+      max_stay=max_stay
     )
 
 class AccessRecordModelTrainingCli(Cli):
@@ -218,66 +233,25 @@ class AccessRecordModelEvaluationCli(Cli):
 
 
 def preprocess(
-  input_path: str,
+  input_paths: Sequence[str],
   is_space: bool,
   training_data_path: str,
   evaluation_data_path: str,
   start_time: datetime,
   end_time: datetime,
   time_step: timedelta,
-  evaluation_fraction: Optional[float] = None
+  evaluation_fraction: Optional[float] = None,
+  chunk_size: Optional[int] = None,
+  max_stay: Optional[timedelta] = None
 ) -> None:
   if evaluation_fraction is None:
     evaluation_fraction = 0.2
 
-  def load_access_records(path: str) -> pd.DataFrame:
-    df = pd.read_csv(
-      path,
-      parse_dates=['time'],
-      dtype={
-        'member_id': str,
-        'action': (
-          pd.CategoricalDtype(['enter', 'exit'])
-          if is_space
-          else pd.CategoricalDtype(['acquire', 'release'])
-        )
-      }
-    )
-    assert df.columns.to_list() == ['time', 'member_id', 'action']
-    return df
-
-  def iterate_spans(
-    df: pd.DataFrame,
-    start_time: pd.Timestamp,
-    end_time: pd.Timestamp,
-    time_step: pd.Timedelta
-  ) -> Iterator[Mapping[str, Any]]:
-    df = df.sort_values('time')
-
-    staying_uids = {}
-    for _, row in df.iterrows():
-      time = row['time']
-      uid = row['member_id']
-      action = row['action']
-      if action == 'enter' or action == 'acquire':
-        staying_uids[uid] = time
-      elif action == 'exit' or action == 'release':
-        enter_time = staying_uids.get(uid)
-        if enter_time is not None:
-          if enter_time < time:
-            yield {
-              'enter_time': enter_time,
-              'exit_time': time,
-              'member_id': uid
-            }
-          del staying_uids[uid]
-
-  def iterate_rows(
-    spans: Sequence[Mapping[str, Any]],
-    start_time: pd.Timestamp,
-    end_time: pd.Timestamp,
-    time_step: pd.Timedelta
-  ) -> Iterator[Mapping[str, Any]]:
+  def to_row(
+    period_start_time: pd.Timestamp,
+    period_end_time: pd.Timestamp,
+    curr_spans: Sequence[Mapping[str, Any]]
+  ) -> Mapping[str, Any]:
 
     def time_components(prefix: str, time: pd.Timestamp) -> Mapping[str, Any]:
       time = time.astimezone(hk_timezone)
@@ -291,58 +265,39 @@ def preprocess(
         f'{prefix}_minute': time.minute
       }
 
-    period_start_time = start_time
-    period_end_time = period_start_time + time_step
-    i = 0
-    curr_spans: MutableSequence[Mapping[str, Any]] = []
-    while period_end_time <= end_time:
-
-      while i < len(spans) and spans[i]['enter_time'] < period_end_time:
-        if spans[i]['exit_time'] > period_start_time:
-          curr_spans.append(spans[i])
-        i += 1
-
-      enter_count = sum(
-        span['enter_time'] >= period_start_time
-        for span in curr_spans
-      )
-      unique_enter_count = len(set(
-        span['member_id']
-        for span in curr_spans
-        if span['enter_time'] >= period_start_time
-      ))
-      exit_count = sum(
-        span['exit_time'] <= period_end_time
-        for span in curr_spans
-      )
-      unique_exit_count = len(set(
-        span['member_id']
-        for span in curr_spans
-        if span['exit_time'] <= period_end_time
-      ))
-      stay_count = len(curr_spans)
-      unique_stay_count = len(set(
-        span['member_id']
-        for span in curr_spans
-      ))
-      yield {
-        **time_components('start_time', period_start_time),
-        **time_components('end_time', period_end_time),
-        'enter_count': enter_count,
-        'unique_enter_count': unique_enter_count,
-        'exit_count': exit_count,
-        'unique_exit_count': unique_exit_count,
-        'stay_count': stay_count,
-        'unique_stay_count': unique_stay_count
-      }
-
-      curr_spans = [
-        span
-        for span in curr_spans
-        if span['exit_time'] > period_end_time
-      ]
-      period_start_time = period_end_time
-      period_end_time = period_start_time + time_step
+    enter_count = sum(
+      span['enter_time'] >= period_start_time
+      for span in curr_spans
+    )
+    unique_enter_count = len(set(
+      span['member_id']
+      for span in curr_spans
+      if span['enter_time'] >= period_start_time
+    ))
+    exit_count = sum(
+      span['exit_time'] <= period_end_time
+      for span in curr_spans
+    )
+    unique_exit_count = len(set(
+      span['member_id']
+      for span in curr_spans
+      if span['exit_time'] <= period_end_time
+    ))
+    stay_count = len(curr_spans)
+    unique_stay_count = len(set(
+      span['member_id']
+      for span in curr_spans
+    ))
+    return {
+      **time_components('start_time', period_start_time),
+      **time_components('end_time', period_end_time),
+      'enter_count': enter_count,
+      'unique_enter_count': unique_enter_count,
+      'exit_count': exit_count,
+      'unique_exit_count': unique_exit_count,
+      'stay_count': stay_count,
+      'unique_stay_count': unique_stay_count
+    }
 
   def to_data_frame(rows: Sequence[Mapping[str, Any]]) -> pd.DataFrame:
 
@@ -374,33 +329,55 @@ def preprocess(
       }.items()
     })
 
-  input_df = load_access_records(input_path)
-  spans = list(iterate_spans(
-    df=input_df,
-    start_time=start_time,
-    end_time=end_time,
-    time_step=time_step
-  ))
-  rows = list(iterate_rows(
-    spans=spans,
+  records = read_access_record_chunks(
+    input_paths,
+    dtype={
+      'member_id': str,
+      'action': (
+        pd.CategoricalDtype(['enter', 'exit'])
+        if is_space
+        else pd.CategoricalDtype(['acquire', 'release'])
+      )
+    },
+    chunk_size=chunk_size
+  )
+  periods = iterate_periods(
+    records,
     start_time=start_time,
     end_time=end_time,
-    time_step=time_step
-  ))
-  df = to_data_frame(rows)
-  assert df.notna().all(axis=None)
-
-  evaluation_start_idx = floor(df.shape[0] * (1 - evaluation_fraction))
-  training_df = df.iloc[:evaluation_start_idx]
-  evaluation_df = df.iloc[evaluation_start_idx:]
-
-  for output_path, output_df in {
-    training_data_path: training_df,
-    evaluation_data_path: evaluation_df
-  }.items():
-    output_path_obj = Path(output_path).resolve(strict=False)
-    output_path_obj.parent.mkdir(parents=True, exist_ok=True)
-    output_df.to_csv(str(output_path_obj), index=False)
+    time_step=time_step,
+    enter_actions=('enter', 'acquire'),
+    exit_actions=('exit', 'release'),
+    max_stay=max_stay
+  )
+
+  period_count = (end_time - start_time) // time_step
+  evaluation_start_idx = floor(period_count * (1 - evaluation_fraction))
+  write_size = 1000 if chunk_size is None else chunk_size
+
+  with CsvChunkWriter(training_data_path) as training_writer, \
+      CsvChunkWriter(evaluation_data_path) as evaluation_writer:
+    rows: MutableSequence[Mapping[str, Any]] = []
+
+    def write_rows(writer: CsvChunkWriter) -> None:
+      df = to_data_frame(rows)
+      assert df.notna().all(axis=None)
+      writer.write(df)
+      rows.clear()
+
+    for i, (period_start_time, period_end_time, curr_spans) in enumerate(periods):
+      if i == evaluation_start_idx and len(rows) > 0:
+        write_rows(training_writer)
+      rows.append(to_row(period_start_time, period_end_time, curr_spans))
+      if len(rows) >= write_size:
+        write_rows(training_writer if i < evaluation_start_idx else evaluation_writer)
+
+    if len(rows) > 0:
+      write_rows(evaluation_writer if period_count > evaluation_start_idx else training_writer)
+
+    # Write the header of a split even if it has no rows
+    training_writer.write(to_data_frame([]))
+    evaluation_writer.write(to_data_frame([]))
 
 
 def train_or_evaluate_model(
@@ -1,9 +1,6 @@
 from __future__ import annotations
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.cluster import hierarchy as sch
 
 
 class CorrelationModel:
@@ -2,11 +2,11 @@ from __future__ import annotations
 
 from argparse import ArgumentParser, Namespace
 from datetime import timedelta, timezone
-from typing import Optional
+from typing import Any, Callable, Optional, TypeVar
 from typing_extensions import Final
 from pathlib import Path
 
-from ...cli import Cli
+from ...cli import Cli, positive_int
 
 
 hk_timezone: Final = timezone(timedelta(hours=8))
@@ -24,6 +24,14 @@ class HistoryForecastCli(Cli):
     for sub_cli in (
       # HistoryForecastPreprocessorCli(),
       HistoryForecastModelTrainingCli(),
+      HistoryForecastModelUpdateCli(),
+      HistoryForecastGroupTrainingCli(),
+      HistoryForecastModelExportCli(),
+      HistoryForecastDataConversionCli(),
+      HistoryForecastWindowingBenchmarkCli(),
+      HistoryForecastInputBenchmarkCli(),
+      HistoryForecastBacktestCli(),
+      HistoryForecastSweepCli(),
     ):
       subparser = subparsers.add_parser(name=sub_cli.name)
       sub_cli.configure_parser(subparser)
@@ -103,11 +111,11 @@ class HistoryForecastModelTrainingCli(Cli):
     )
     parser.add_argument(
       '--training-data',
-      help='Path to the training data csv'
+      help='Path to the training data json, or the .npy written by the convert action'
     )
     parser.add_argument(
       '--evaluation-data',
-      help='Path to the evaluation data csv'
+      help='Path to the evaluation data json, or the .npy written by the convert action'
     )
     parser.add_argument(
       '--log-dir',
@@ -118,6 +126,44 @@ class HistoryForecastModelTrainingCli(Cli):
       help='Show UI or not',
       action='store_true'
     )
+    parser.add_argument(
+      '--epochs',
+      help='Maximum number of epochs to train, defaults to 100',
+      type=int
+    )
+    parser.add_argument(
+      '--patience',
+      help='Stop training after this many epochs without improving the validation loss, defaults to 5',
+      type=int
+    )
+    parser.add_argument(
+      '--keep-checkpoints',
+      help='Number of best checkpoints to keep, defaults to 3',
+      type=int
+    )
+    parser.add_argument(
+      '--cache-dir',
+      help='The dir caching the parsed datasets'
+    )
+    parser.add_argument(
+      '--cache-max-size',
+      help='Evict the least recently used cached datasets when the cache grows over this size in MB',
+      type=int
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+    parser.add_argument(
+      '--full-evaluation',
+      help='Score every window of the evaluation data instead of a random sample of them',
+      action='store_true'
+    )
+    parser.add_argument(
+      '--evaluation-report',
+      help='Path to write the per step and per group errors of the full evaluation as json (implies --full-evaluation)'
+    )
 
   def handle(self, args: Namespace) -> None:
     checkpoint_dir_path: str = args.checkpoint_dir
@@ -125,6 +171,14 @@ class HistoryForecastModelTrainingCli(Cli):
     evaluation_data_path: Optional[str] = args.evaluation_data
     log_dir_path: Optional[str] = args.log_dir
     show_ui: bool = args.ui
+    epochs: Optional[int] = args.epochs
+    patience: Optional[int] = args.patience
+    keep_checkpoints: Optional[int] = args.keep_checkpoints
+    cache_dir_path: Optional[str] = args.cache_dir
+    cache_max_size: Optional[int] = args.cache_max_size
+    no_cache: bool = args.no_cache
+    full_evaluation: bool = args.full_evaluation
+    evaluation_report_path: Optional[str] = args.evaluation_report
 
     from .model import train_model
     train_model(
@@ -132,5 +186,453 @@ class HistoryForecastModelTrainingCli(Cli):
       training_data_path=None if training_data_path is None else str(Path(training_data_path)),
       evaluation_data_path=None if evaluation_data_path is None else str(Path(evaluation_data_path)),
       log_dir_path=None if log_dir_path is None else str(Path(log_dir_path)),
-      show_ui=show_ui
+      show_ui=show_ui,
+      epochs=epochs,
+      patience=patience,
+      keep_checkpoints=keep_checkpoints,
+      cache_dir_path=None if cache_dir_path is None else str(Path(cache_dir_path)),
+      cache_max_size=None if cache_max_size is None else cache_max_size * 1024 * 1024,
+      no_cache=no_cache,
+      full_evaluation=full_evaluation,
+      evaluation_report_path=None if evaluation_report_path is None else str(Path(evaluation_report_path))
+    )
+
+class HistoryForecastDataConversionCli(Cli):
+  name: Final[str] = 'convert'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--input',
+      help='Path to the training data json',
+      required=True
+    )
+    parser.add_argument(
+      '--output',
+      help='Path to the memory-mappable .npy training data, whose index is written next to it',
+      required=True
+    )
+
+  def handle(self, args: Namespace) -> None:
+    input_path: str = args.input
+    output_path: str = args.output
+
+    from ..utils.series_matrix import SeriesMatrix
+    series = SeriesMatrix.load(str(Path(input_path)), names_key='groups')
+    series.save_npy(str(Path(output_path)))
+
+class HistoryForecastWindowingBenchmarkCli(Cli):
+  name: Final[str] = 'bench-windowing'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--steps',
+      help='Number of batches to time for each pipeline',
+      type=positive_int,
+      default=50
+    )
+
+  def handle(self, args: Namespace) -> None:
+    data_path: str = args.data
+    steps: int = args.steps
+
+    from .model import benchmark_model_windowing
+    benchmark_model_windowing(data_path=str(Path(data_path)), steps=steps)
+
+class HistoryForecastInputBenchmarkCli(Cli):
+  name: Final[str] = 'bench-input'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--checkpoint-dir',
+      help='The dir storing the checkpoints, whose standardization params are used',
+      required=True
+    )
+    parser.add_argument(
+      '--training-data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--steps',
+      help='Number of batches to time',
+      type=positive_int,
+      default=100
+    )
+    parser.add_argument(
+      '--log-dir',
+      help='The dir to write a profiler trace of the input pipeline for TensorBoard'
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    checkpoint_dir_path: str = args.checkpoint_dir
+    training_data_path: str = args.training_data
+    steps: int = args.steps
+    log_dir_path: Optional[str] = args.log_dir
+    no_cache: bool = args.no_cache
+
+    from .model import benchmark_model_input
+    benchmark_model_input(
+      checkpoint_dir_path=str(Path(checkpoint_dir_path)),
+      data_path=str(Path(training_data_path)),
+      steps=steps,
+      log_dir_path=None if log_dir_path is None else str(Path(log_dir_path)),
+      no_cache=no_cache
+    )
+
+class HistoryForecastBacktestCli(Cli):
+  name: Final[str] = 'backtest'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    T = TypeVar('T', bound=Callable[..., Any])
+    def rename(name: str, f: T) -> T:
+      f.__name__ = name
+      return f
+
+    parser.add_argument(
+      '--data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--output-dir',
+      help='The dir storing the checkpoints of each fold and the backtest.json report',
+      required=True
+    )
+    parser.add_argument(
+      '--initial-train',
+      help='Length of the training data of the first fold',
+      type=rename('timedelta', lambda s: timedelta(**eval(f'dict({s})'))),
+      required=True
+    )
+    parser.add_argument(
+      '--test',
+      help='Length of the test data of each fold',
+      type=rename('timedelta', lambda s: timedelta(**eval(f'dict({s})'))),
+      required=True
+    )
+    parser.add_argument(
+      '--step',
+      help='How far the cutoff moves between folds, defaults to --test',
+      type=rename('timedelta', lambda s: timedelta(**eval(f'dict({s})')))
+    )
+    parser.add_argument(
+      '--max-folds',
+      help='Maximum number of folds',
+      type=int
+    )
+    parser.add_argument(
+      '--epochs',
+      help='Number of epochs to train in each fold',
+      type=int,
+      default=5
+    )
+    parser.add_argument(
+      '--steps-per-epoch',
+      help='Number of batches in each epoch, defaults to a full pass over the training windows',
+      type=int
+    )
+    parser.add_argument(
+      '--cold-start',
+      help='Train each fold from scratch instead of from the previous fold, so the folds can run in parallel',
+      action='store_true'
+    )
+    parser.add_argument(
+      '--workers',
+      help='Number of worker processes for --cold-start, defaults to the number of CPUs divided by --threads-per-worker',
+      type=int
+    )
+    parser.add_argument(
+      '--threads-per-worker',
+      help='Number of TF threads of each worker for --cold-start',
+      type=int,
+      default=1
+    )
+    parser.add_argument(
+      '--cache-dir',
+      help='The dir caching the parsed datasets'
+    )
+    parser.add_argument(
+      '--cache-max-size',
+      help='Evict the least recently used cached datasets when the cache grows over this size in MB',
+      type=int
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    data_path: str = args.data
+    output_dir_path: str = args.output_dir
+    initial_train: timedelta = args.initial_train
+    test: timedelta = args.test
+    step: Optional[timedelta] = args.step
+    max_folds: Optional[int] = args.max_folds
+    epochs: int = args.epochs
+    steps_per_epoch: Optional[int] = args.steps_per_epoch
+    cold_start: bool = args.cold_start
+    workers: Optional[int] = args.workers
+    threads_per_worker: int = args.threads_per_worker
+    cache_dir_path: Optional[str] = args.cache_dir
+    cache_max_size: Optional[int] = args.cache_max_size
+    no_cache: bool = args.no_cache
+
+    from .backtest import backtest
+    backtest(
+      data_path=str(Path(data_path)),
+      output_dir_path=str(Path(output_dir_path)),
+      initial_train=initial_train,
+      test=test,
+      step=step,
+      max_folds=max_folds,
+      epochs=epochs,
+      steps_per_epoch=steps_per_epoch,
+      cold_start=cold_start,
+      workers=workers,
+      threads_per_worker=threads_per_worker,
+      cache_dir_path=None if cache_dir_path is None else str(Path(cache_dir_path)),
+      cache_max_size=None if cache_max_size is None else cache_max_size * 1024 * 1024,
+      no_cache=no_cache
+    )
+
+class HistoryForecastSweepCli(Cli):
+  name: Final[str] = 'sweep'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--spec',
+      help='Path to the search spec json, listing the values of each hyperparam to try',
+      required=True
+    )
+    parser.add_argument(
+      '--output-dir',
+      help='The dir storing the checkpoints of each trial and the sweep.json ranking',
+      required=True
+    )
+    parser.add_argument(
+      '--epochs',
+      help='Number of epochs to train in each trial',
+      type=int,
+      default=20
+    )
+    parser.add_argument(
+      '--steps-per-epoch',
+      help='Number of batches in each epoch, defaults to a full pass over the training windows',
+      type=int
+    )
+    parser.add_argument(
+      '--workers',
+      help='Number of trials to run in parallel, defaults to the number of CPUs divided by --threads-per-worker',
+      type=int
+    )
+    parser.add_argument(
+      '--threads-per-worker',
+      help='Number of TF threads of each worker',
+      type=int,
+      default=1
+    )
+    parser.add_argument(
+      '--cache-dir',
+      help='The dir caching the parsed datasets'
+    )
+    parser.add_argument(
+      '--cache-max-size',
+      help='Evict the least recently used cached datasets when the cache grows over this size in MB',
+      type=int
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    data_path: str = args.data
+    spec_path: str = args.spec
+    output_dir_path: str = args.output_dir
+    epochs: int = args.epochs
+    steps_per_epoch: Optional[int] = args.steps_per_epoch
+    workers: Optional[int] = args.workers
+    threads_per_worker: int = args.threads_per_worker
+    cache_dir_path: Optional[str] = args.cache_dir
+    cache_max_size: Optional[int] = args.cache_max_size
+    no_cache: bool = args.no_cache
+
+    from .model import sweep_model
+    sweep_model(
+      data_path=str(Path(data_path)),
+      spec_path=str(Path(spec_path)),
+      output_dir_path=str(Path(output_dir_path)),
+      epochs=epochs,
+      steps_per_epoch=steps_per_epoch,
+      workers=workers,
+      threads_per_worker=threads_per_worker,
+      cache_dir_path=None if cache_dir_path is None else str(Path(cache_dir_path)),
+      cache_max_size=None if cache_max_size is None else cache_max_size * 1024 * 1024,
+      no_cache=no_cache
+    )
+
+class HistoryForecastModelUpdateCli(Cli):
+  name: Final[str] = 'update'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--checkpoint-dir',
+      help='The dir storing the checkpoints of a trained model',
+      required=True
+    )
+    parser.add_argument(
+      '--data',
+      help='Path to a json, or the .npy written by the convert action, holding only the rows after the data trained on so far',
+      required=True
+    )
+    parser.add_argument(
+      '--epochs',
+      help='Number of epochs to fine-tune, defaults to 5',
+      type=int
+    )
+    parser.add_argument(
+      '--replay-ratio',
+      help='Number of older windows replayed per new window, defaults to 1',
+      type=float
+    )
+    parser.add_argument(
+      '--log-dir',
+      help='The dir storing the log for TensorBoard'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    checkpoint_dir_path: str = args.checkpoint_dir
+    data_path: str = args.data
+    epochs: Optional[int] = args.epochs
+    replay_ratio: Optional[float] = args.replay_ratio
+    log_dir_path: Optional[str] = args.log_dir
+
+    from .model import update_model
+    update_model(
+      checkpoint_dir_path=str(Path(checkpoint_dir_path)),
+      data_path=str(Path(data_path)),
+      epochs=epochs,
+      replay_ratio=replay_ratio,
+      log_dir_path=None if log_dir_path is None else str(Path(log_dir_path))
+    )
+
+class HistoryForecastModelExportCli(Cli):
+  name: Final[str] = 'export'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--checkpoint-dir',
+      help='The dir storing the checkpoints of a trained model, or the models written by the train-groups action',
+      required=True
+    )
+    parser.add_argument(
+      '--output',
+      help='Path to the .npz loaded by the NumPy backend of the server, defaults to model.npz in the checkpoint dir'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    checkpoint_dir_path: str = args.checkpoint_dir
+    output_path: Optional[str] = args.output
+
+    from .model import export_model
+    export_model(
+      checkpoint_dir_path=str(Path(checkpoint_dir_path)),
+      export_path=None if output_path is None else str(Path(output_path))
+    )
+
+class HistoryForecastGroupTrainingCli(Cli):
+  name: Final[str] = 'train-groups'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--checkpoint-dir',
+      help='The dir storing a sub dir of checkpoints per model',
+      required=True
+    )
+    parser.add_argument(
+      '--training-data',
+      help='Path to the training data json, or the .npy written by the convert action',
+      required=True
+    )
+    parser.add_argument(
+      '--clusters',
+      help='Path to a json mapping cluster names to the groups sharing a model, other groups get a model each'
+    )
+    parser.add_argument(
+      '--epochs',
+      help='Maximum number of epochs to train, defaults to 100',
+      type=int
+    )
+    parser.add_argument(
+      '--patience',
+      help='Stop training after this many epochs without improving the validation loss, defaults to 5',
+      type=int
+    )
+    parser.add_argument(
+      '--workers',
+      help='Number of models to train in parallel, defaults to the number of CPUs divided by --threads-per-worker',
+      type=int
+    )
+    parser.add_argument(
+      '--threads-per-worker',
+      help='Number of TF threads of each worker',
+      type=int,
+      default=1
+    )
+    parser.add_argument(
+      '--cache-dir',
+      help='The dir caching the parsed datasets'
+    )
+    parser.add_argument(
+      '--cache-max-size',
+      help='Evict the least recently used cached datasets when the cache grows over this size in MB',
+      type=int
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    checkpoint_dir_path: str = args.checkpoint_dir
+    training_data_path: str = args.training_data
+    clusters_path: Optional[str] = args.clusters
+    epochs: Optional[int] = args.epochs
+    patience: Optional[int] = args.patience
+    workers: Optional[int] = args.workers
+    threads_per_worker: int = args.threads_per_worker
+    cache_dir_path: Optional[str] = args.cache_dir
+    cache_max_size: Optional[int] = args.cache_max_size
+    no_cache: bool = args.no_cache
+
+    from .group_training import train_group_models
+    train_group_models(
+      data_path=str(Path(training_data_path)),
+      checkpoint_dir_path=str(Path(checkpoint_dir_path)),
+      clusters_path=None if clusters_path is None else str(Path(clusters_path)),
+      epochs=epochs,
+      patience=patience,
+      workers=workers,
+      threads_per_worker=threads_per_worker,
+      cache_dir_path=None if cache_dir_path is None else str(Path(cache_dir_path)),
+      cache_max_size=None if cache_max_size is None else cache_max_size * 1024 * 1024,
+      no_cache=no_cache
     )
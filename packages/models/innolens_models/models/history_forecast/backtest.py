@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from functools import partial
+from typing import Any, Iterable, MutableSequence, NamedTuple, Optional
+from pathlib import Path
+import json
+import logging
+from pprint import pprint
+import shutil
+
+import numpy as np
+
+from ..utils.forecast_errors import ForecastErrors
+from ..utils.series_matrix import SeriesMatrix
+from ..utils.spawned_pool import run_in_spawned_pool
+
+
+class Fold(NamedTuple):
+  fold_index: int
+  cutoff: int # Train on [0, cutoff), test the forecasts in [cutoff, test_end)
+  test_end: int
+  checkpoint_dir_path: str
+  warm_start_dir_path: Optional[str]
+
+
+def backtest(
+  *,
+  data_path: str,
+  output_dir_path: str,
+  initial_train: timedelta,
+  test: timedelta,
+  step: Optional[timedelta] = None,
+  max_folds: Optional[int] = None,
+  epochs: int = 5,
+  steps_per_epoch: Optional[int] = None,
+  cold_start: bool = False,
+  workers: Optional[int] = None,
+  threads_per_worker: int = 1,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> None:
+  '''
+  Walk a train/test cutoff forward through the data. Each fold trains on everything
+  before its cutoff and scores every forecast in the test period after it.
+
+  By default each fold continues training from the checkpoint of the previous fold,
+  so the folds run one after another. With cold_start, each fold trains from scratch
+  and the folds run in parallel processes, each pinned to threads_per_worker TF
+  threads.
+  '''
+  logging.getLogger().setLevel(logging.INFO)
+
+  series = SeriesMatrix.load_cached(
+    data_path,
+    names_key='groups',
+    no_cache=no_cache,
+    cache_dir_path=cache_dir_path,
+    cache_max_size=cache_max_size
+  )
+  folds = list(plan_folds(
+    series,
+    output_dir_path=output_dir_path,
+    initial_train=initial_train,
+    test=test,
+    step=test if step is None else step,
+    max_folds=max_folds,
+    cold_start=cold_start
+  ))
+  if len(folds) == 0:
+    raise ValueError('The data is too short for a single fold')
+  logging.info(f'Backtesting {len(folds)} folds')
+
+  run = partial(
+    run_fold,
+    data_path=data_path,
+    epochs=epochs,
+    steps_per_epoch=steps_per_epoch,
+    cache_dir_path=cache_dir_path,
+    cache_max_size=cache_max_size,
+    no_cache=no_cache
+  )
+  fold_errors: MutableSequence[ForecastErrors] = []
+  if cold_start:
+    for fold_result in run_in_spawned_pool(run, folds, workers=workers, threads_per_worker=threads_per_worker):
+      # Every fold is needed for the total errors
+      if isinstance(fold_result, Exception):
+        raise fold_result
+      fold_errors.append(fold_result)
+  else:
+    fold_errors = [run(fold) for fold in folds]
+
+  total_errors = ForecastErrors(forecast_size=fold_errors[0].forecast_size, series_names=series.names)
+  fold_reports: MutableSequence[Any] = []
+  for fold, errors in zip(folds, fold_errors):
+    total_errors.merge(errors)
+    report = errors.report()
+    fold_reports.append({
+      'fold': fold.fold_index,
+      'trainEndTime': format_time(series, fold.cutoff),
+      'testEndTime': format_time(series, fold.test_end),
+      'sampleCount': report['sampleCount'],
+      'mae': report['mae'],
+      'mse': report['mse'],
+      'rmse': report['rmse'],
+      'maePerStep': report['maePerStep']
+    })
+
+  result = {
+    'folds': fold_reports,
+    'total': total_errors.report()
+  }
+  output_dir_path_obj = Path(output_dir_path).resolve(strict=False)
+  output_dir_path_obj.mkdir(parents=True, exist_ok=True)
+  with open(str(output_dir_path_obj / 'backtest.json'), 'w') as file:
+    json.dump(result, file, indent=2)
+
+  pprint([
+    (fold_report['fold'], fold_report['trainEndTime'], fold_report['mae'], fold_report['rmse'])
+    for fold_report in fold_reports
+  ])
+
+
+def plan_folds(
+  series: SeriesMatrix,
+  *,
+  output_dir_path: str,
+  initial_train: timedelta,
+  test: timedelta,
+  step: timedelta,
+  max_folds: Optional[int],
+  cold_start: bool
+) -> Iterable[Fold]:
+  time_step = series_time_step(series)
+  cutoff = initial_train // time_step
+  test_size = test // time_step
+  step_size = step // time_step
+  assert test_size > 0 and step_size > 0
+
+  fold_index = 0
+  previous_dir_path: Optional[str] = None
+  while cutoff + test_size <= series.values.shape[0] and (max_folds is None or fold_index < max_folds):
+    checkpoint_dir_path = str(Path(output_dir_path) / f'fold-{fold_index:03d}')
+    yield Fold(
+      fold_index=fold_index,
+      cutoff=cutoff,
+      test_end=cutoff + test_size,
+      checkpoint_dir_path=checkpoint_dir_path,
+      warm_start_dir_path=None if cold_start else previous_dir_path
+    )
+    previous_dir_path = checkpoint_dir_path
+    cutoff += step_size
+    fold_index += 1
+
+
+def run_fold(
+  fold: Fold,
+  *,
+  data_path: str,
+  epochs: int,
+  steps_per_epoch: Optional[int],
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> ForecastErrors:
+  logging.getLogger().setLevel(logging.INFO)
+
+  from ..utils.checkpoints import forget_checkpoint_metrics
+  from .model import HistoryForecastModel
+
+  # Every fold tests the same number of steps, so the first fold fails before training
+  if fold.test_end - fold.cutoff < HistoryForecastModel.forecast_size:
+    raise ValueError(
+      f'The test period of {fold.test_end - fold.cutoff} steps is shorter than a forecast '
+      f'of {HistoryForecastModel.forecast_size} steps, so no forecast can be scored'
+    )
+
+  series = SeriesMatrix.load_cached(
+    data_path,
+    names_key='groups',
+    no_cache=no_cache,
+    cache_dir_path=cache_dir_path,
+    cache_max_size=cache_max_size
+  )
+
+  if fold.warm_start_dir_path is not None and not Path(fold.checkpoint_dir_path).exists():
+    shutil.copytree(fold.warm_start_dir_path, fold.checkpoint_dir_path)
+    # The validation data differs, so the previous fold's metrics are not comparable
+    forget_checkpoint_metrics(fold.checkpoint_dir_path)
+
+  logging.info(f'Fold {fold.fold_index}: train on [0, {fold.cutoff}), test on [{fold.cutoff}, {fold.test_end})')
+  model = HistoryForecastModel(checkpoint_dir_path=fold.checkpoint_dir_path)
+  model.train_series(series.slice(0, fold.cutoff), epochs=epochs, steps_per_epoch=steps_per_epoch)
+  return model.score(series.slice(0, fold.test_end), forecast_start=fold.cutoff)
+
+
+def series_time_step(series: SeriesMatrix) -> timedelta:
+  if series.start_times is None or series.end_times is None or series.values.shape[0] == 0:
+    return timedelta(minutes=30)
+  return timedelta(microseconds=int((series.end_times[0] - series.start_times[0]) / np.timedelta64(1, 'us')))
+
+
+def format_time(series: SeriesMatrix, end: int) -> Optional[str]:
+  '''
+  Format the end time of the time steps before end.
+  '''
+  if series.end_times is None or end == 0:
+    return None
+  return f'{np.datetime_as_string(series.end_times[end - 1], unit="m")}Z'
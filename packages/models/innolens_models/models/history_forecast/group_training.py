@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from functools import partial
+import hashlib
+from typing import Any, Mapping, MutableSequence, NamedTuple, Optional, Sequence
+from pathlib import Path
+import json
+import logging
+from pprint import pprint
+import re
+
+import numpy as np
+
+from ..utils.series_matrix import SeriesMatrix
+from ..utils.spawned_pool import run_in_spawned_pool
+
+
+class GroupTask(NamedTuple):
+  name: str
+  groups: Sequence[str]
+  checkpoint_dir_path: str
+
+
+def train_group_models(
+  *,
+  data_path: str,
+  checkpoint_dir_path: str,
+  clusters_path: Optional[str] = None,
+  epochs: Optional[int] = None,
+  patience: Optional[int] = None,
+  workers: Optional[int] = None,
+  threads_per_worker: int = 1,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> None:
+  '''
+  Train one model per group, or per cluster of groups if clusters_path is given,
+  each standardized with the mean and stddev of its own groups. The models are
+  trained in parallel worker processes into sub dirs of checkpoint_dir_path, which
+  are listed in groups.json for HistoryForecastModelGroup to load.
+  '''
+  logging.getLogger().setLevel(logging.INFO)
+
+  series = SeriesMatrix.load_cached(
+    data_path,
+    names_key='groups',
+    no_cache=no_cache,
+    cache_dir_path=cache_dir_path,
+    cache_max_size=cache_max_size
+  )
+
+  clusters: Mapping[str, Sequence[str]] = {}
+  if clusters_path is not None:
+    with open(clusters_path) as file:
+      clusters = json.load(file)
+  unknown_groups = set(group for groups in clusters.values() for group in groups) - set(series.names)
+  if len(unknown_groups) > 0:
+    unknown_groups_str = ', '.join(sorted(unknown_groups))
+    raise ValueError(f'Unknown groups in clusters: {unknown_groups_str}')
+
+  clustered_groups = set(group for groups in clusters.values() for group in groups)
+  named_groups = set(clusters.keys()) & (set(series.names) - clustered_groups)
+  if len(named_groups) > 0:
+    named_groups_str = ', '.join(sorted(named_groups))
+    raise ValueError(f'Clusters named after unclustered groups: {named_groups_str}')
+  tasks = [
+    GroupTask(name, groups, str(Path(checkpoint_dir_path) / 'groups' / to_dir_name(name)))
+    for name, groups in [
+      *clusters.items(),
+      *((group, [group]) for group in series.names if group not in clustered_groups)
+    ]
+  ]
+  logging.info(f'Training {len(tasks)} models')
+
+  run = partial(
+    train_group_model,
+    data_path=data_path,
+    epochs=epochs,
+    patience=patience,
+    cache_dir_path=cache_dir_path,
+    cache_max_size=cache_max_size,
+    no_cache=no_cache
+  )
+  task_results = run_in_spawned_pool(run, tasks, workers=workers, threads_per_worker=threads_per_worker)
+
+  results: MutableSequence[Any] = []
+  models: MutableSequence[Any] = []
+  for task, task_result in zip(tasks, task_results):
+    if isinstance(task_result, Exception):
+      results.append((task.name, str(task_result)))
+      continue
+    results.append((task.name, task_result.get('val_loss')))
+    models.append({
+      'name': task.name,
+      'groups': list(task.groups),
+      'checkpointDir': str(Path(task.checkpoint_dir_path).relative_to(checkpoint_dir_path))
+    })
+
+  manifest_path = Path(checkpoint_dir_path) / 'groups.json'
+  manifest_path.parent.mkdir(parents=True, exist_ok=True)
+  with open(str(manifest_path), 'w') as file:
+    json.dump({ 'models': models }, file, indent=2)
+
+  pprint(results)
+
+
+def train_group_model(
+  task: GroupTask,
+  *,
+  data_path: str,
+  epochs: Optional[int] = None,
+  patience: Optional[int] = None,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> Mapping[str, float]:
+  logging.getLogger().setLevel(logging.INFO)
+
+  from .model import HistoryForecastModel
+
+  series = SeriesMatrix.load_cached(
+    data_path,
+    names_key='groups',
+    no_cache=no_cache,
+    cache_dir_path=cache_dir_path,
+    cache_max_size=cache_max_size
+  )
+  model = HistoryForecastModel(checkpoint_dir_path=task.checkpoint_dir_path)
+  history = model.train_series(series.select(task.groups), epochs=epochs, patience=patience)
+  return {
+    name: float(np.min(values))
+    for name, values in history.items()
+  }
+
+
+def to_dir_name(name: str) -> str:
+  # The hash tells apart the names sanitized or case folded to the same dir name
+  name_hash = hashlib.sha256(name.encode()).hexdigest()[:8]
+  return f'{re.sub(r"[^0-9A-Za-z_.-]", "_", name)}-{name_hash}'
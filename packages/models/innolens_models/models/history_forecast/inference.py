@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from typing import AbstractSet, Any, Callable, Iterable, Mapping, Optional, Sequence
+from typing_extensions import Final
+from pathlib import Path
+import json
+
+import numpy as np
+
+from ..utils.dense_stack import DenseStack
+
+
+class UnknownGroupException(Exception):
+  def __init__(self, groups: Iterable[str]):
+    groups_str = ', '.join(groups)
+    super().__init__(f'Unknown groups: {groups_str}')
+
+
+class HistoryForecastNumpyModel:
+  '''
+  The history forecast model loaded from the .npz written by the export action,
+  which serves without TensorFlow.
+  '''
+
+  stack: Final[DenseStack]
+
+  def __init__(self, *, export_path: str):
+    super().__init__()
+    self.stack = DenseStack.load(export_path)
+
+  def predict(self, X_batch: Any) -> Any:
+    return self.stack.predict(X_batch)
+
+
+class HistoryForecastModelGroup:
+  '''
+  The per group models written by the train-groups action, each forecasting the
+  groups it was trained on. load_model loads the model in a sub dir, defaults to
+  the TensorFlow model.
+  '''
+
+  models: Final[Sequence[Any]]
+  __model_idxs: Final[Mapping[str, int]]
+
+  def __init__(
+    self,
+    *,
+    checkpoint_dir_path: str,
+    load_model: Optional[Callable[[str], Any]] = None
+  ):
+    super().__init__()
+    if load_model is None:
+      from .model import HistoryForecastModel
+      load_model = lambda path: HistoryForecastModel(checkpoint_dir_path=path)
+
+    with open(str(Path(checkpoint_dir_path) / 'groups.json')) as file:
+      manifest = json.load(file)
+    self.models = [
+      load_model(str(Path(checkpoint_dir_path) / entry['checkpointDir']))
+      for entry in manifest['models']
+    ]
+    self.__model_idxs = {
+      group: i
+      for i, entry in enumerate(manifest['models'])
+      for group in entry['groups']
+    }
+
+  @property
+  def groups(self) -> AbstractSet[str]:
+    '''
+    The groups forecast by any of the models.
+    '''
+    return self.__model_idxs.keys()
+
+  def check_groups(self, groups: Iterable[str]) -> None:
+    unknown_groups = set(groups) - self.groups
+    if len(unknown_groups) > 0:
+      raise UnknownGroupException(unknown_groups)
+
+  @staticmethod
+  def is_group_dir(checkpoint_dir_path: str) -> bool:
+    return (Path(checkpoint_dir_path) / 'groups.json').exists()
+
+  @staticmethod
+  def checkpoint_dir_paths(checkpoint_dir_path: str) -> Sequence[str]:
+    with open(str(Path(checkpoint_dir_path) / 'groups.json')) as file:
+      manifest = json.load(file)
+    return [
+      str(Path(checkpoint_dir_path) / entry['checkpointDir'])
+      for entry in manifest['models']
+    ]
+
+  def predict(self, X_batch: Any, groups: Sequence[str]) -> Any:
+    '''
+    Forecast each row of X_batch with the model of its group, one batch per model.
+    '''
+    self.check_groups(groups)
+
+    if len(groups) == 0:
+      # Any of the models gives the shape of an empty forecast
+      return self.models[0].predict(X_batch[:0])
+
+    model_idxs = np.array([self.__model_idxs[group] for group in groups])
+    predictions: Optional[np.ndarray] = None
+    for model_idx in np.unique(model_idxs):
+      rows = np.flatnonzero(model_idxs == model_idx)
+      model_predictions = self.models[model_idx].predict(X_batch[rows])
+      if predictions is None:
+        predictions = np.empty((len(groups), *model_predictions.shape[1:]), dtype=model_predictions.dtype)
+      predictions[rows] = model_predictions
+    return predictions
@@ -1,79 +1,282 @@
 from __future__ import annotations
 
 from datetime import timedelta, timezone
-from typing import Any, Optional, Sequence
+from functools import partial
+from math import ceil
+from typing import Any, Mapping, NamedTuple, Optional, Sequence, Tuple
 from typing_extensions import Final
 from pathlib import Path
+import json
 import logging
 from pprint import pprint
-import os.path
-import re
-import json
 
-import matplotlib.pyplot as plt
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
-import pandas as pd
+
+from ..utils.checkpoints import TopKCheckpoint, find_checkpoint, replace_checkpoints
+from ..utils.dataset_cache import DatasetCache, create_dataset_cache
+from ..utils.dense_stack import DenseStack
+from ..utils.forecast_errors import ForecastErrors
+from ..utils.hyperparams import load_hyperparams, parse_hyperparams, save_hyperparams
+from ..utils.input_benchmark import benchmark_input
+from ..utils.running_moments import RunningMoments
+from ..utils.series_matrix import SeriesMatrix
+from ..utils.serving import compile_serving_predict
+from ..utils.sweep import Trial, load_search_spec, plan_trials, run_sweep
+from ..utils.windowing import SlidingWindows, benchmark_windowing
+from .inference import HistoryForecastModelGroup
 
 
 hk_timezone: Final = timezone(timedelta(hours=8))
 
 
+class HistoryForecastHyperparams(NamedTuple):
+  input_size: int = 24 * 2 * 14 # 2 week
+  hidden_units: Sequence[int] = ()
+  learning_rate: float = 0.001
+  batch_size: int = 128
+
+
 def train_model(
   *,
   checkpoint_dir_path: str,
   training_data_path: Optional[str] = None,
   evaluation_data_path: Optional[str] = None,
   log_dir_path: Optional[str] = None,
-  show_ui: bool = False
+  show_ui: bool = False,
+  epochs: Optional[int] = None,
+  patience: Optional[int] = None,
+  keep_checkpoints: Optional[int] = None,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False,
+  full_evaluation: bool = False,
+  evaluation_report_path: Optional[str] = None
 ) -> None:
   logging.getLogger().setLevel(logging.INFO)
   tf.get_logger().setLevel(logging.INFO)
 
   model = HistoryForecastModel(
     checkpoint_dir_path=checkpoint_dir_path,
-    log_dir_path=log_dir_path
+    log_dir_path=log_dir_path,
+    dataset_cache=create_dataset_cache(
+      no_cache=no_cache,
+      cache_dir_path=cache_dir_path,
+      cache_max_size=cache_max_size
+    )
   )
 
   if training_data_path is not None:
-    model.train(training_data_path, show_ui=show_ui)
+    model.train(
+      training_data_path,
+      epochs=epochs,
+      patience=patience,
+      keep_checkpoints=keep_checkpoints,
+      show_ui=show_ui
+    )
 
   if evaluation_data_path is not None:
-    result = model.evaluate(evaluation_data_path, show_ui=show_ui)
+    if full_evaluation or evaluation_report_path is not None:
+      result = model.evaluate_full(evaluation_data_path, report_path=evaluation_report_path)
+    else:
+      result = model.evaluate(evaluation_data_path, show_ui=show_ui)
     pprint(result)
 
+def update_model(
+  *,
+  checkpoint_dir_path: str,
+  data_path: str,
+  epochs: Optional[int] = None,
+  replay_ratio: Optional[float] = None,
+  log_dir_path: Optional[str] = None
+) -> None:
+  logging.getLogger().setLevel(logging.INFO)
+  tf.get_logger().setLevel(logging.INFO)
+
+  model = HistoryForecastModel(
+    checkpoint_dir_path=checkpoint_dir_path,
+    log_dir_path=log_dir_path,
+    dataset_cache=None
+  )
+  history = model.update(data_path, epochs=epochs, replay_ratio=replay_ratio)
+  pprint({ name: values[-1] for name, values in history.items() })
+
+def export_model(
+  *,
+  checkpoint_dir_path: str,
+  export_path: Optional[str] = None
+) -> None:
+  '''
+  Export the model, or each model of a group dir into model.npz in its own dir.
+  '''
+  logging.getLogger().setLevel(logging.INFO)
+
+  if HistoryForecastModelGroup.is_group_dir(checkpoint_dir_path):
+    if export_path is not None:
+      raise ValueError('The models of a group dir are exported into their own dirs')
+    pprint({
+      path: HistoryForecastModel(checkpoint_dir_path=path).export(str(Path(path) / 'model.npz'))
+      for path in HistoryForecastModelGroup.checkpoint_dir_paths(checkpoint_dir_path)
+    })
+    return
+
+  if export_path is None:
+    export_path = str(Path(checkpoint_dir_path) / 'model.npz')
+  model = HistoryForecastModel(checkpoint_dir_path=checkpoint_dir_path)
+  pprint({ 'exportPath': export_path, 'maxAbsDiff': model.export(export_path) })
+
+def benchmark_model_windowing(
+  *,
+  data_path: str,
+  steps: int = 50
+) -> None:
+  series = SeriesMatrix.load(
+    data_path,
+    names_key='groups',
+    dataset_cache=create_dataset_cache()
+  )
+  pprint(HistoryForecastModel.benchmark_windowing(series, steps=steps))
+
+def benchmark_model_input(
+  *,
+  checkpoint_dir_path: str,
+  data_path: str,
+  steps: int = 100,
+  log_dir_path: Optional[str] = None,
+  no_cache: bool = False
+) -> None:
+  logging.getLogger().setLevel(logging.INFO)
+
+  model = HistoryForecastModel(
+    checkpoint_dir_path=checkpoint_dir_path,
+    dataset_cache=create_dataset_cache(no_cache=no_cache)
+  )
+  pprint(model.benchmark_input(data_path, steps=steps, log_dir_path=log_dir_path))
+
+def sweep_model(
+  *,
+  data_path: str,
+  spec_path: str,
+  output_dir_path: str,
+  epochs: int = 20,
+  steps_per_epoch: Optional[int] = None,
+  workers: Optional[int] = None,
+  threads_per_worker: int = 1,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> None:
+  logging.getLogger().setLevel(logging.INFO)
+
+  trials = plan_trials(load_search_spec(spec_path), output_dir_path=output_dir_path)
+  for trial in trials:
+    parse_hyperparams(HistoryForecastHyperparams(), trial.params)
+
+  if not no_cache:
+    SeriesMatrix.load_cached(data_path, names_key='groups', cache_dir_path=cache_dir_path, cache_max_size=cache_max_size)
+
+  run_sweep(
+    trials,
+    partial(
+      run_sweep_trial,
+      data_path=data_path,
+      epochs=epochs,
+      steps_per_epoch=steps_per_epoch,
+      cache_dir_path=cache_dir_path,
+      cache_max_size=cache_max_size,
+      no_cache=no_cache
+    ),
+    output_dir_path=output_dir_path,
+    metric='val_loss',
+    workers=workers,
+    threads_per_worker=threads_per_worker
+  )
+
+def run_sweep_trial(
+  trial: Trial,
+  *,
+  data_path: str,
+  epochs: int,
+  steps_per_epoch: Optional[int],
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> Mapping[str, float]:
+  logging.getLogger().setLevel(logging.INFO)
+
+  model = HistoryForecastModel(
+    checkpoint_dir_path=trial.checkpoint_dir_path,
+    hyperparams=parse_hyperparams(HistoryForecastHyperparams(), trial.params),
+    dataset_cache=create_dataset_cache(
+      no_cache=no_cache,
+      cache_dir_path=cache_dir_path,
+      cache_max_size=cache_max_size
+    )
+  )
+  history = model.train(data_path, epochs=epochs, steps_per_epoch=steps_per_epoch)
+  return {
+    name: float(np.min(values))
+    for name, values in history.items()
+  }
+
 class HistoryForecastModel:
   __checkpoint_dir_path: Final[str]
   __log_dir_path: Final[Optional[str]]
+  __dataset_cache: Final[Optional[DatasetCache]]
+
+  hyperparams: Final[HistoryForecastHyperparams]
+  forecast_size: Final = 2 * 24 * 2 # 2 days
 
   __model: Final[Any]
-  __input_size: Final = 24 * 2 * 14 # 2 week
+  __compiled_predict: Final[Any]
   __input_shift: Final = 1 # 30 minutes
-  __predict_size: Final = 2 * 24 * 2 # 2 days
+  __validation_size: Final = 30 * 24 * 2 # First 30 days of samples
+  __replay_size: Final = 60 * 24 * 2 # Last 60 days of rows kept for update
+  __evaluation_batch_size: Final = 4096
   __mean: float
   __stddev: float
   __last_epoch: int
+  __serving_predict: Optional[Any]
+  __serving_params: Optional[Tuple[float, float]]
+  __serving_xla: bool
 
   def __init__(
     self,
     *,
     checkpoint_dir_path: str,
-    log_dir_path: Optional[str] = None
+    log_dir_path: Optional[str] = None,
+    dataset_cache: Optional[DatasetCache] = None,
+    hyperparams: Optional[HistoryForecastHyperparams] = None
   ):
     super().__init__()
 
     self.__checkpoint_dir_path = checkpoint_dir_path
     self.__log_dir_path = log_dir_path
+    self.__dataset_cache = dataset_cache
+    # The hyperparams saved with the checkpoints decide the architecture, unless overridden
+    self.hyperparams = (
+      load_hyperparams(checkpoint_dir_path, HistoryForecastHyperparams())
+      if hyperparams is None
+      else hyperparams
+    )
 
     model = keras.models.Sequential([
-      # keras.layers.Dense(256, activation=tf.nn.relu),
-      keras.layers.Dense(self.__predict_size)
+      *(
+        keras.layers.Dense(units, activation=tf.nn.relu)
+        for units in self.hyperparams.hidden_units
+      ),
+      keras.layers.Dense(self.forecast_size)
     ])
     self.__model = model
+    self.__compiled_predict = tf.function(
+      lambda X: model(X, training=False),
+      input_signature=[tf.TensorSpec(shape=(None, self.hyperparams.input_size), dtype=tf.float32)]
+    )
 
     model.compile(
       optimizer=keras.optimizers.Adam(
+        learning_rate=self.hyperparams.learning_rate
         # clipvalue=1.0
       ),
       loss='mae',
@@ -83,20 +286,21 @@ class HistoryForecastModel:
     self.__mean = 0.0
     self.__stddev = 1.0
     self.__last_epoch = 0
+    self.__serving_predict = None
+    self.__serving_params = None
+    self.__serving_xla = False
 
-    latest_ckpt = tf.train.latest_checkpoint(self.__checkpoint_dir_path)
-    if latest_ckpt is not None:
-      match = re.search(r'\d+', Path(latest_ckpt).name)
-      if match is not None:
-        self.__last_epoch = int(match[0])
+    checkpoint = find_checkpoint(self.__checkpoint_dir_path)
+    if checkpoint is not None:
+      ckpt_path, self.__last_epoch = checkpoint
 
-        model.load_weights(latest_ckpt)
-        logging.info(f'Load checkpoint from {latest_ckpt}')
+      model.load_weights(ckpt_path)
+      logging.info(f'Load checkpoint from {ckpt_path}')
 
-        std_path = Path(self.__checkpoint_dir_path) / 'standardize_params.npz'
-        arrs = np.load(std_path)
-        self.__mean = np.float64(arrs['mean'])
-        self.__stddev = np.float64(arrs['stddev'])
+      std_path = Path(self.__checkpoint_dir_path) / 'standardize_params.npz'
+      arrs = np.load(std_path)
+      self.__mean = np.float64(arrs['mean'])
+      self.__stddev = np.float64(arrs['stddev'])
 
   def train(
     self,
@@ -105,38 +309,62 @@ class HistoryForecastModel:
     epochs: Optional[int] = None,
     steps_per_epoch: Optional[int] = None,
     validation_steps: Optional[int] = None,
+    patience: Optional[int] = None,
+    keep_checkpoints: Optional[int] = None,
     show_ui: bool = False
-  ) -> None:
+  ) -> Mapping[str, Sequence[float]]:
+    return self.train_series(
+      self.__load_series(path),
+      epochs=epochs,
+      steps_per_epoch=steps_per_epoch,
+      validation_steps=validation_steps,
+      patience=patience,
+      keep_checkpoints=keep_checkpoints,
+      show_ui=show_ui
+    )
+
+  def train_series(
+    self,
+    series: SeriesMatrix,
+    *,
+    epochs: Optional[int] = None,
+    steps_per_epoch: Optional[int] = None,
+    validation_steps: Optional[int] = None,
+    patience: Optional[int] = None,
+    keep_checkpoints: Optional[int] = None,
+    show_ui: bool = False
+  ) -> Mapping[str, Sequence[float]]:
+    '''
+    Train on the series and return the metrics of each epoch.
+    '''
     if epochs is None:
-      epochs = 20
-    if steps_per_epoch is None:
-      steps_per_epoch = 20
-    if validation_steps is None:
-      validation_steps = 10
+      epochs = 100
+    if patience is None:
+      patience = 5
+    if keep_checkpoints is None:
+      keep_checkpoints = 3
 
     if self.__last_epoch == 0:
-      df = self.__load_dataframe(path)
-      self.__mean = df.values.mean()
-      self.__stddev = df.values.std()
-      std_path = Path(self.__checkpoint_dir_path) / 'standardize_params.npz'
-      std_path.parent.mkdir(parents=True, exist_ok=True)
-      np.savez(
-        std_path,
-        mean=self.__mean,
-        stddev=self.__stddev
-      )
-
-    ds = self.__load_dataset(path)
-    train_ds = ds.skip(30 * 24 * 2).shuffle(10000).batch(128).repeat()
-    val_ds = ds.take(30 * 24 * 2).batch(128).repeat()
-    example_ds = val_ds.unbatch().shuffle(1000).take(24)
+      moments = RunningMoments.of(series.values)
+      self.__mean = np.float64(moments.mean)
+      self.__stddev = np.float64(moments.stddev)
+      moments.save(str(Path(self.__checkpoint_dir_path) / 'standardize_params.npz'))
+      save_hyperparams(self.__checkpoint_dir_path, self.hyperparams)
+    self.__save_replay(series)
+
+    windows = self.__create_windows(series)
+    train_ds = self.__create_training_dataset(windows)
+    val_ds = self.__create_validation_dataset(windows)
+    # Go through every sample once per epoch by default
+    batch_size = self.hyperparams.batch_size
+    if steps_per_epoch is None:
+      steps_per_epoch = max(1, ceil((len(windows) - self.__validation_size) / batch_size))
+    if validation_steps is None:
+      validation_steps = max(1, ceil(min(len(windows), self.__validation_size) / batch_size))
 
     callbacks = []
-    callbacks.append(keras.callbacks.ModelCheckpoint(
-      filepath=os.path.join(self.__checkpoint_dir_path, 'checkpoint-{epoch:04d}'),
-      verbose=1,
-      save_weights_only=True
-    ))
+    callbacks.append(TopKCheckpoint(self.__checkpoint_dir_path, k=keep_checkpoints))
+    callbacks.append(keras.callbacks.EarlyStopping(patience=patience, restore_best_weights=True))
     if self.__log_dir_path is not None:
       callbacks.append(keras.callbacks.TensorBoard(self.__log_dir_path))
 
@@ -149,16 +377,84 @@ class HistoryForecastModel:
       validation_steps=validation_steps,
       callbacks=callbacks
     )
-    self.last_epoch = training_history.epoch[-1]
+    self.__last_epoch = training_history.epoch[-1] + 1
 
     if show_ui:
-      examples = list(example_ds.as_numpy_iterator())
-      self.__visualize_examples(examples, 'Validation')
+      self.__visualize_examples(self.__sample_examples(windows, 24, stop=self.__validation_size), 'Validation')
+
+    return training_history.history
+
+  def update(
+    self,
+    path: str,
+    *,
+    epochs: Optional[int] = None,
+    replay_ratio: Optional[float] = None
+  ) -> Mapping[str, Sequence[float]]:
+    '''
+    Fine-tune on data holding only the rows appended after the data trained on so
+    far. The windows reaching into the new rows are mixed with a random replay of
+    replay_ratio times as many older windows, so the older patterns are not
+    forgotten. The older windows are drawn from the last rows trained on, which
+    are kept in the checkpoint dir instead of all of them. The standardization
+    params are updated with the running moments instead of being recomputed over
+    all the data.
+    '''
+    if epochs is None:
+      epochs = 5
+    if replay_ratio is None:
+      replay_ratio = 1.0
+
+    replay_path = Path(self.__checkpoint_dir_path) / 'replay.npy'
+    std_path = Path(self.__checkpoint_dir_path) / 'standardize_params.npz'
+    moments = RunningMoments.load(str(std_path))
+    if self.__last_epoch == 0 or not replay_path.exists() or moments is None:
+      raise ValueError('Train the model before updating it')
+
+    old_series = SeriesMatrix.load_npy(str(replay_path))
+    new_series = self.__load_series(path)
+    series = old_series.append(new_series)
+
+    moments.update(series.values[old_series.values.shape[0]:])
+    self.__mean = np.float64(moments.mean)
+    self.__stddev = np.float64(moments.stddev)
+
+    windows = self.__create_windows(series)
+    window_size = self.hyperparams.input_size + self.forecast_size
+    first_new_window = max(0, (old_series.values.shape[0] - window_size) // self.__input_shift + 1)
+    if first_new_window >= windows.window_count:
+      raise ValueError('Not enough new rows for a window')
+    new_windows = np.arange(first_new_window, windows.window_count)
+    replay_windows = np.random.default_rng().choice(
+      first_new_window,
+      size=min(first_new_window, int(new_windows.shape[0] * replay_ratio)),
+      replace=False
+    )
+    idxs = windows.sample_idxs(np.concatenate([replay_windows, new_windows]))
+    logging.info(f'Update with {new_windows.shape[0]} new and {replay_windows.shape[0]} replayed windows')
+
+    batch_size = self.hyperparams.batch_size
+    callbacks = []
+    if self.__log_dir_path is not None:
+      callbacks.append(keras.callbacks.TensorBoard(self.__log_dir_path))
+
+    training_history = self.__model.fit(
+      windows.dataset(batch_size=batch_size, idxs=idxs, shuffle=True, repeat=True),
+      initial_epoch=self.__last_epoch,
+      epochs=self.__last_epoch + epochs,
+      steps_per_epoch=max(1, ceil(idxs.shape[0] / batch_size)),
+      callbacks=callbacks
+    )
+    self.__last_epoch = training_history.epoch[-1] + 1
+
+    replace_checkpoints(self.__model, self.__checkpoint_dir_path, epoch=self.__last_epoch)
+    moments.save(str(std_path))
+    self.__save_replay(series)
+    return training_history.history
 
   def evaluate(self, path: str, *, show_ui: bool = False) -> Any:
-    ds = self.__load_dataset(path)
-    eval_ds = ds.shuffle(1000).batch(128).repeat().take(10)
-    exmaple_ds = ds.shuffle(1000).take(12)
+    windows = self.__create_windows(self.__load_series(path))
+    eval_ds = windows.dataset(batch_size=self.hyperparams.batch_size, shuffle=True, repeat=True).take(10)
 
     callbacks = []
     if self.__log_dir_path is not None:
@@ -170,48 +466,103 @@ class HistoryForecastModel:
     )
 
     if show_ui:
-      examples = list(exmaple_ds.as_numpy_iterator())
-      self.__visualize_examples(examples, 'Evaluation')
+      self.__visualize_examples(self.__sample_examples(windows, 12), 'Evaluation')
 
     return result
 
-  def __load_dataframe(self, path: str) -> pd.DataFrame:
-    with open(path) as file:
-      data = json.load(file)
-    df = pd.DataFrame({
-      group: pd.Series(data['values'][g], dtype=np.int32)
-      for g, group in enumerate(data['groups'])
-    })
-    assert df.notna().all(None)
-    return df
+  def evaluate_full(self, path: str, *, report_path: Optional[str] = None) -> Any:
+    '''
+    Score every window of the data, in order and in large batches, with the MAE and
+    MSE per forecast step and per group in the original unit. Unlike evaluate, the
+    result is reproducible.
+    '''
+    report = self.score(self.__load_series(path)).report()
+    if report_path is not None:
+      report_path_obj = Path(report_path).resolve(strict=False)
+      report_path_obj.parent.mkdir(parents=True, exist_ok=True)
+      with open(str(report_path_obj), 'w') as file:
+        json.dump(report, file, indent=2)
+    return report
+
+  def score(self, series: SeriesMatrix, *, forecast_start: int = 0) -> ForecastErrors:
+    '''
+    Accumulate the errors of every window whose forecast starts at or after
+    forecast_start, the history before it is only used as input.
+    '''
+    series = series.slice(max(0, forecast_start - self.hyperparams.input_size), None)
+    windows = self.__create_windows(series)
+    errors = ForecastErrors(forecast_size=self.forecast_size, series_names=series.names)
+
+    offset = 0
+    for X, Y in windows.dataset(batch_size=self.__evaluation_batch_size):
+      predictions = self.__compiled_predict(X).numpy()
+      errors.update(
+        Y.numpy() * self.__stddev + self.__mean,
+        predictions * self.__stddev + self.__mean,
+        np.arange(offset, offset + X.shape[0]) % windows.series_count
+      )
+      offset += X.shape[0]
+    return errors
+
+  def benchmark_input(self, path: str, *, steps: int = 100, log_dir_path: Optional[str] = None) -> Any:
+    return benchmark_input(
+      load_series=lambda: self.__load_series(path),
+      create_windows=self.__create_windows,
+      create_dataset=self.__create_training_dataset,
+      forward=self.__model.predict_on_batch,
+      batch_size=self.hyperparams.batch_size,
+      start=self.__validation_size,
+      steps=steps,
+      log_dir_path=log_dir_path
+    )
 
-  def __load_dataset(self, path: str) -> Any:
-    df = self.__load_dataframe(path)
+  def __load_series(self, path: str) -> SeriesMatrix:
+    series = SeriesMatrix.load(path, names_key='groups', dataset_cache=self.__dataset_cache)
+    assert np.isfinite(series.values).all()
+    return series
+
+  def __save_replay(self, series: SeriesMatrix) -> None:
+    # Enough rows for the windows across the appended rows, and recent windows to replay
+    replay_size = max(self.__replay_size, self.hyperparams.input_size + self.forecast_size - 1)
+    replay_series = series.slice(max(0, series.values.shape[0] - replay_size), None)
+    replay_series.save_npy(str(Path(self.__checkpoint_dir_path) / 'replay.npy'))
+
+  def __create_windows(self, series: SeriesMatrix) -> SlidingWindows:
+    return SlidingWindows(
+      series.values,
+      history_size=self.hyperparams.input_size,
+      forecast_size=self.forecast_size,
+      shift=self.__input_shift,
+      per_series=True,
+      mean=self.__mean,
+      stddev=self.__stddev
+    )
 
-    ds = tf.data.Dataset.from_tensor_slices({
-      name: series.to_numpy()
-      for name, series in df.items()
-    })
-    ds = ds.map(lambda xs: {
-      name: (x - self.__mean) / self.__stddev
-      for name, x in xs.items()
-    })
-    ds = ds.window(size=self.__input_size + self.__predict_size, shift=self.__input_shift, drop_remainder=True)
-    ds = ds.flat_map(lambda dsd: tf.data.Dataset.zip({
-      name: sub_vals.batch(self.__input_size + self.__predict_size).map(lambda x: tf.reshape(x, [self.__input_size + self.__predict_size]))
-      for name, sub_vals in dsd.items()
-    }))
-    ds = ds.map(lambda xs: {
-      name: (x[:-self.__predict_size], x[-self.__predict_size:])
-      for name, x in xs.items()
-    })
-    ds = ds.flat_map(lambda xs: tf.data.Dataset.from_tensor_slices((
-      [xy[0] for xy in xs.values()],
-      [xy[1] for xy in xs.values()]
-    )))
-    return ds
+  def __create_training_dataset(self, windows: SlidingWindows) -> Any:
+    return windows.dataset(batch_size=self.hyperparams.batch_size, start=self.__validation_size, shuffle=True, repeat=True)
+
+  def __create_validation_dataset(self, windows: SlidingWindows) -> Any:
+    return windows.dataset(batch_size=self.hyperparams.batch_size, stop=self.__validation_size, repeat=True, cache=True)
+
+  def __sample_examples(self, windows: SlidingWindows, count: int, *, stop: Optional[int] = None) -> Sequence[Any]:
+    stop = len(windows) if stop is None else min(stop, len(windows))
+    X, Y = windows.batch(np.random.default_rng().choice(stop, size=min(count, stop), replace=False))
+    return list(zip(X, Y))
+
+  @staticmethod
+  def benchmark_windowing(series: SeriesMatrix, *, steps: int = 50) -> Any:
+    return benchmark_windowing(
+      series.values,
+      history_size=HistoryForecastHyperparams().input_size,
+      forecast_size=HistoryForecastModel.forecast_size,
+      per_series=True,
+      steps=steps
+    )
 
   def __visualize_examples(self, examples: Sequence[Any], title: str) -> None:
+    # Imported here so serving does not load matplotlib
+    import matplotlib.pyplot as plt
+
     for i in range(0, len(examples), 6):
       fig = plt.figure()
       axs = fig.subplots(3, 2).flatten()
@@ -226,6 +577,50 @@ class HistoryForecastModel:
       fig.tight_layout()
       plt.show()
 
+  def compile_predict(self, *, xla: Optional[bool] = None, warmup: bool = True) -> None:
+    '''
+    Trace the predict used for serving, optionally compiled with XLA, and warm it up.
+    '''
+    if xla is not None:
+      self.__serving_xla = xla
+    self.__serving_predict = compile_serving_predict(
+      self.__model,
+      input_size=self.hyperparams.input_size,
+      mean=self.__mean,
+      stddev=self.__stddev,
+      xla=self.__serving_xla,
+      warmup=warmup
+    )
+    self.__serving_params = (self.__mean, self.__stddev)
+
   def predict(self, X_batch: Any) -> Any:
-    predictions = self.__model.predict((X_batch - self.__mean) / self.__stddev)
-    return predictions * self.__stddev + self.__mean
+    # The standardization params are baked into the graph, so retrace after they change
+    if self.__serving_predict is None or self.__serving_params != (self.__mean, self.__stddev):
+      self.compile_predict(warmup=False)
+    serving_predict = self.__serving_predict
+    assert serving_predict is not None
+    return serving_predict(np.asarray(X_batch, dtype=np.float64)).numpy()
+
+  def export(self, export_path: str) -> float:
+    '''
+    Write the weights and standardization params to an .npz for
+    HistoryForecastNumpyModel, after checking the NumPy forward pass matches this
+    model. Returns the max abs difference between the two on random histories.
+    '''
+    input_size = self.hyperparams.input_size
+    # Build the model, which restores the weights deferred by load_weights
+    self.__model(np.zeros((1, input_size), dtype=np.float32))
+    stack = DenseStack.from_keras(
+      self.__model,
+      mean=self.__mean,
+      stddev=self.__stddev,
+      meta={ 'inputSize': input_size }
+    )
+    X_batch = np.random.default_rng(0).normal(self.__mean, self.__stddev, size=(256, input_size))
+    expected = self.predict(X_batch)
+    actual = stack.predict(X_batch)
+    if not np.allclose(actual, expected, rtol=1e-4, atol=1e-4 * self.__stddev):
+      raise ValueError('The NumPy forward pass does not match the model')
+    stack.save(export_path)
+    logging.info(f'Export the model to {export_path}')
+    return float(np.max(np.abs(actual - expected)))
@@ -1,19 +1,31 @@
 from __future__ import annotations
 
-from typing import Any
+from typing import Any, Callable, Optional
 
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.cluster import hierarchy as sch
 
 
 class MemberClusterModel:
 
-  def cluster(self, histories: np.ndarray, *, show_ui: bool = False) -> np.ndarray:
+  def cluster(
+    self,
+    histories: np.ndarray,
+    *,
+    show_ui: bool = False,
+    progress: Optional[Callable[[float], None]] = None
+  ) -> np.ndarray:
+    '''
+    progress is called with the fraction of the distances computed.
+    '''
+    n = histories.shape[0]
+    pair_count = max(n * (n - 1) // 2, 1)
     dists = []
-    for i in range(histories.shape[0]):
-      for j in range(i+1, histories.shape[0]):
+    for i in range(n):
+      for j in range(i+1, n):
         dists.append(self.history_similarity(histories[i], histories[j]))
+      if progress is not None:
+        progress(len(dists) / pair_count)
     dists = np.array(dists)
 
     result = sch.linkage(
@@ -22,6 +34,9 @@ class MemberClusterModel:
     )
 
     if show_ui:
+      # Imported here so serving does not load matplotlib
+      import matplotlib.pyplot as plt
+
       fig = plt.figure()
       ax = fig.add_subplot()
       sch.dendrogram(result, ax=ax)
@@ -32,7 +47,12 @@ class MemberClusterModel:
   def history_similarity(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
     return np.linalg.norm(x - y, axis=1).sum()
 
-  def cluster_json(self, histories_json: Any, *, show_ui: bool = False) -> np.ndarray:
+  def cluster_json(self, histories_json: Any, *, show_ui: bool = False) -> Any:
+    X = self.matrix_from_json(histories_json)
+    Z = self.cluster(X, show_ui=show_ui)
+    return self.clusters_to_json(histories_json, Z)
+
+  def matrix_from_json(self, histories_json: Any) -> np.ndarray:
     X = np.zeros((
       len(histories_json['memberIds']),
       len(histories_json['timeSpans']),
@@ -41,9 +61,10 @@ class MemberClusterModel:
     for history_idx, history_id in enumerate(histories_json['memberIds']):
       for feature_idx, feature_id in enumerate(histories_json['features']):
         X[history_idx, :, feature_idx] = histories_json['values'][history_idx][feature_idx]
+    return X
 
-    Z = self.cluster(X, show_ui=show_ui)
-
+  def clusters_to_json(self, histories_json: Any, Z: np.ndarray) -> Any:
+    member_count = len(histories_json['memberIds'])
     return {
       'data': [
         *[
@@ -54,11 +75,11 @@ class MemberClusterModel:
             'distance': 0.0,
             'size': 1
           }
-          for i in range(X.shape[0])
+          for i in range(member_count)
         ],
         *[
           {
-            'clusterId': X.shape[0] + i,
+            'clusterId': member_count + i,
             'memberId': None,
             'childClusterIds': [int(child_cluster_id_1), int(child_cluster_id_2)],
             'distance': distance,
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Sequence, TypeVar
+from typing_extensions import Final
+from pathlib import Path
+
+from ...cli import Cli
+
+
+class SimulationResultCli(Cli):
+  name: Final[str] = 'simulation_result'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    subparsers = parser.add_subparsers(
+      title='actions',
+      required=True,
+      dest='action'
+    )
+    for sub_cli in (
+      SimulationResultPreprocessorCli(),
+    ):
+      subparser = subparsers.add_parser(name=sub_cli.name)
+      sub_cli.configure_parser(subparser)
+      subparser.set_defaults(_SimulationResultCli__handler=sub_cli.handle)
+
+  def handle(self, args: Namespace) -> None:
+    args._SimulationResultCli__handler(args)
+
+class SimulationResultPreprocessorCli(Cli):
+  name: Final[str] = 'preprocess'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    T = TypeVar('T', bound=Callable[..., Any])
+    def rename(name: str, f: T) -> T:
+      f.__name__ = name
+      return f
+
+    parser.add_argument(
+      '--input',
+      help='The dir holding the simulation result',
+      required=True
+    )
+    parser.add_argument(
+      '--output',
+      help='Path to the output json, in the format of the access causality and history forecast training data',
+      required=True
+    )
+    parser.add_argument(
+      '--start-time',
+      help='Start time',
+      type=rename('datetime', lambda s: datetime.fromisoformat(s)),
+      required=True
+    )
+    parser.add_argument(
+      '--end-time',
+      help='End time',
+      type=rename('datetime', lambda s: datetime.fromisoformat(s)),
+      required=True
+    )
+    parser.add_argument(
+      '--time-step',
+      help='Time step',
+      type=rename('timedelta', lambda s: timedelta(**eval(f'dict({s})'))),
+      required=True
+    )
+    parser.add_argument(
+      '--kinds',
+      help='The kinds of access records to include',
+      nargs='+',
+      choices=('space', 'machine', 'reusable_inventory', 'expendable_inventory')
+    )
+    parser.add_argument(
+      '--workers',
+      help='Number of worker processes, defaults to the number of CPUs',
+      type=int
+    )
+    parser.add_argument(
+      '--chunk-size',
+      help='Stream each access record file this many rows at a time',
+      type=int
+    )
+    parser.add_argument(
+      '--cache-dir',
+      help='The dir caching the parsed datasets'
+    )
+    parser.add_argument(
+      '--cache-max-size',
+      help='Evict the least recently used cached datasets when the cache grows over this size in MB',
+      type=int
+    )
+    parser.add_argument(
+      '--no-cache',
+      help='Do not read or write the dataset cache',
+      action='store_true'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    input_path: str = args.input
+    output_path: str = args.output
+    start_time: datetime = args.start_time
+    end_time: datetime = args.end_time
+    time_step: timedelta = args.time_step
+    kinds: Optional[Sequence[str]] = args.kinds
+    workers: Optional[int] = args.workers
+    chunk_size: Optional[int] = args.chunk_size
+    cache_dir_path: Optional[str] = args.cache_dir
+    cache_max_size: Optional[int] = args.cache_max_size
+    no_cache: bool = args.no_cache
+
+    from .preprocessor import preprocess
+    preprocess(
+      input_path=str(Path(input_path)),
+      output_path=str(Path(output_path)),
+      start_time=start_time,
+      end_time=end_time,
+      time_step=time_step,
+      kinds=kinds,
+      workers=workers,
+      chunk_size=chunk_size,
+      cache_dir_path=None if cache_dir_path is None else str(Path(cache_dir_path)),
+      cache_max_size=None if cache_max_size is None else cache_max_size * 1024 * 1024,
+      no_cache=no_cache
+    )
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Iterable, MutableSequence, NamedTuple, Optional, Sequence
+from typing_extensions import Final
+from pathlib import Path
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from ..utils.access_record_stream import read_access_record_chunks, iterate_periods
+from ..utils.dataset_cache import CacheEntry, create_dataset_cache
+
+
+hk_timezone: Final = timezone(timedelta(hours=8))
+
+all_kinds: Final[Sequence[str]] = ('space', 'machine', 'reusable_inventory', 'expendable_inventory')
+
+
+class FeatureSource(NamedTuple):
+  feature: str
+  kind: str
+  path: str
+
+
+def preprocess(
+  *,
+  input_path: str,
+  output_path: str,
+  start_time: datetime,
+  end_time: datetime,
+  time_step: timedelta,
+  kinds: Optional[Sequence[str]] = None,
+  workers: Optional[int] = None,
+  chunk_size: Optional[int] = None,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None,
+  no_cache: bool = False
+) -> None:
+  '''
+  Convert all access records in a simulation result into one wide table of member
+  counts, with one feature per space, machine and inventory on the same time axis.
+  '''
+  logging.getLogger().setLevel(logging.INFO)
+
+  if kinds is None:
+    kinds = all_kinds
+
+  sources = discover_sources(input_path, kinds)
+  if len(sources) == 0:
+    raise ValueError(f'No access records of the kinds {", ".join(kinds)} in {input_path}')
+  logging.info(f'Preprocessing {len(sources)} access record files')
+
+  def count() -> CacheEntry:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      values = list(executor.map(
+        partial(
+          count_members,
+          start_time=start_time,
+          end_time=end_time,
+          time_step=time_step,
+          chunk_size=chunk_size
+        ),
+        sources
+      ))
+    return { 'values': np.stack(values) }, None
+
+  dataset_cache = create_dataset_cache(
+    no_cache=no_cache,
+    cache_dir_path=cache_dir_path,
+    cache_max_size=cache_max_size
+  )
+  if dataset_cache is None:
+    arrays, _ = count()
+  else:
+    arrays, _ = dataset_cache.get_or_create(
+      [source.path for source in sources],
+      {
+        'loader': 'simulation_result',
+        'features': [source.feature for source in sources],
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'time_step': time_step.total_seconds()
+      },
+      count
+    )
+  values = arrays['values']
+
+  period_count = (end_time - start_time) // time_step
+
+  start_times = [
+    (start_time + time_step * i).astimezone(hk_timezone).isoformat()
+    for i in range(period_count)
+  ]
+  end_times = [
+    (start_time + time_step * (i + 1)).astimezone(hk_timezone).isoformat()
+    for i in range(period_count)
+  ]
+  features = [source.feature for source in sources]
+
+  # Write the keys read by both the access causality and the history forecast models
+  data = {
+    'startTimes': start_times,
+    'endTimes': end_times,
+    'timeSpans': [list(time_span) for time_span in zip(start_times, end_times)],
+    'features': features,
+    'groups': features,
+    'values': [feature_values.tolist() for feature_values in values]
+  }
+
+  output_path_obj = Path(output_path).resolve(strict=False)
+  output_path_obj.parent.mkdir(parents=True, exist_ok=True)
+  with open(str(output_path_obj), 'w') as file:
+    json.dump(data, file)
+
+
+def discover_sources(input_path: str, kinds: Sequence[str]) -> Sequence[FeatureSource]:
+  root = Path(input_path)
+  sources: MutableSequence[FeatureSource] = []
+  if 'space' in kinds:
+    for path in sorted((root / 'space_access_records').glob('*.csv')):
+      sources.append(FeatureSource(path.stem, 'space', str(path)))
+  for kind in ('machine', 'reusable_inventory'):
+    if kind in kinds:
+      for path in sorted((root / f'{kind}_access_records').glob('*/*.csv')):
+        sources.append(FeatureSource(f'{kind}/{path.parent.name}/{path.stem}', kind, str(path)))
+  if 'expendable_inventory' in kinds:
+    for path in sorted((root / 'expendable_inventory_access_records').glob('*.csv')):
+      sources.append(FeatureSource(f'expendable_inventory/{path.stem}', 'expendable_inventory', str(path)))
+  return sources
+
+
+def count_members(
+  source: FeatureSource,
+  *,
+  start_time: datetime,
+  end_time: datetime,
+  time_step: timedelta,
+  chunk_size: Optional[int] = None
+) -> np.ndarray:
+  '''
+  Count the unique members staying in (or using) the source in each period. For
+  expendable inventories, which are taken rather than used, sum the taken quantity.
+  '''
+  period_count = (end_time - start_time) // time_step
+
+  if source.kind == 'expendable_inventory':
+    counts = np.zeros(period_count, dtype=np.int32)
+    chunks: Iterable[pd.DataFrame]
+    if chunk_size is None:
+      chunks = [pd.read_csv(source.path, usecols=['action', 'time', 'take_quantity'], parse_dates=['time'])]
+    else:
+      chunks = pd.read_csv(source.path, usecols=['action', 'time', 'take_quantity'], parse_dates=['time'], chunksize=chunk_size)
+    for df in chunks:
+      df = df[df['action'] == 'take']
+      period_idxs = ((df['time'] - pd.Timestamp(start_time)) // pd.Timedelta(time_step)).to_numpy()
+      in_range = (period_idxs >= 0) & (period_idxs < period_count)
+      np.add.at(counts, period_idxs[in_range], df['take_quantity'].to_numpy()[in_range])
+    return counts
+
+  is_space = source.kind == 'space'
+  records = read_access_record_chunks(
+    [source.path],
+    dtype={
+      'member_id': str,
+      'action': (
+        pd.CategoricalDtype(['enter', 'exit'])
+        if is_space
+        else pd.CategoricalDtype(['acquire', 'release'])
+      )
+    },
+    chunk_size=chunk_size
+  )
+  periods = iterate_periods(
+    records,
+    start_time=start_time,
+    end_time=end_time,
+    time_step=time_step,
+    enter_actions=('enter', 'acquire'),
+    exit_actions=('exit', 'release')
+  )
+  return np.array([
+    len(set(span['member_id'] for span in spans))
+    for _, _, spans in periods
+  ], dtype=np.int32)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from argparse import ArgumentParser, Namespace
 from datetime import datetime, timedelta, timezone
-from typing import MutableSequence, Iterator, Mapping, Any, Optional, Sequence, Callable, TypeVar
+from typing import MutableSequence, MutableSet, Iterator, Mapping, Any, Optional, Sequence, Callable, TypeVar, Tuple
 from typing_extensions import Final
 from pathlib import Path
 from logging import INFO
@@ -15,6 +15,7 @@ import pandas as pd
 
 from ..cli import Cli
 from .utils.estimator_metrics import to_estimator_metrics
+from .utils.access_record_stream import read_access_record_chunks, iterate_periods, CsvChunkWriter
 
 
 hk_timezone: Final = timezone(timedelta(hours=8))
@@ -52,7 +53,8 @@ class UserCountPreprocessorCli(Cli):
 
     parser.add_argument(
       '--input',
-      help='Path to the input data csv',
+      help='Path to the input data csv. Multiple paths are read as consecutive time partitions',
+      nargs='+',
       required=True
     )
     parser.add_argument(
@@ -103,9 +105,19 @@ class UserCountPreprocessorCli(Cli):
       help='Fraction of data to be the evaluation data',
       type=float
     )
+    parser.add_argument(
+      '--chunk-size',
+      help='Stream the time-ordered input this many rows at a time instead of loading it into memory',
+      type=int
+    )
+    parser.add_argument(
+      '--max-stay',
+      help='Drop stays that are still open after this long, which bounds the memory used with --chunk-size',
+      type=rename('timedelta', lambda s: timedelta(**eval(f'dict({s})')))
+    )
 
   def handle(self, args: Namespace) -> None:
-    input_path: str = args.input
+    input_paths: Sequence[str] = args.input
     is_space: bool = args.is_space
     member_data_path: str = args.member_data
     training_data_path: str = args.training_data
@@ -115,9 +127,11 @@ class UserCountPreprocessorCli(Cli):
     end_time: datetime = args.end_time
     time_step: timedelta = args.time_step
     evaluation_fraction: Optional[float] = args.evaluation_fraction
+    chunk_size: Optional[int] = args.chunk_size
+    max_stay: Optional[timedelta] = args.max_stay
 
     preprocess(
-      input_path=input_path,
+      input_paths=input_paths,
       is_space=is_space,
       member_data_path=member_data_path,
       training_data_path=training_data_path,
@@ -126,7 +140,9 @@ class UserCountPreprocessorCli(Cli):
       start_time=start_time,
       end_time=end_time,
       time_step=time_step,
-      evaluation_fraction=evaluation_fraction
+      evaluation_fraction=evaluation_fraction,
+      chunk_size=chunk_size,
+      max_stay=max_stay
     )
 
 class UserCountModelTrainingCli(Cli):
@@ -246,7 +262,7 @@ class UserCountModelEvaluationCli(Cli):
 
 
 def preprocess(
-  input_path: str,
+  input_paths: Sequence[str],
   is_space: bool,
   member_data_path:str,
   training_data_path: str,
@@ -255,7 +271,9 @@ def preprocess(
   start_time: datetime,
   end_time: datetime,
   time_step: timedelta,
-  evaluation_fraction: Optional[float] = None
+  evaluation_fraction: Optional[float] = None,
+  chunk_size: Optional[int] = None,
+  max_stay: Optional[timedelta] = None
 ) -> None:
   departments: MutableSequence[str] = []
   types_of_study = [
@@ -313,67 +331,38 @@ def preprocess(
     ]
     return df
 
-  def load_access_records(path: str) -> pd.DataFrame:
-    df = pd.read_csv(
-      path,
-      parse_dates=['time'],
+  def load_access_records() -> Iterator[pd.DataFrame]:
+    return read_access_record_chunks(
+      input_paths,
       dtype={
         'member_id': str,
         'action': pd.CategoricalDtype(['enter', 'exit'])
-      }
-    )
-    assert df.columns.to_list() == ['time', 'member_id', 'action']
-    return df
-
-  def iterate_spans(
-    df: pd.DataFrame,
-    member_df: pd.DataFrame,
-    start_time: pd.Timestamp,
-    end_time: pd.Timestamp,
-    time_step: pd.Timedelta
-  ) -> Iterator[Mapping[str, Any]]:
-    df = df.sort_values('time')
-    df = pd.merge(df, member_df, on='member_id')
-
-    staying_uids = {}
-    for _, row in df.iterrows():
-      time = row['time']
-      uid = row['member_id']
-      department = row['department']
-      type_of_study = row['type_of_study']
-      study_programme = row['study_programme']
-      year_of_study = row['year_of_study']
-      affiliated_student_interest_group = row['affiliated_student_interest_group']
-      action = row['action']
-
-      if department not in departments:
-        departments.append(department)
-      if affiliated_student_interest_group not in affiliated_student_interest_groups:
-        affiliated_student_interest_groups.append(affiliated_student_interest_group)
-
-      if action == 'enter' or action == 'acquire':
-        staying_uids[uid] = time
-      elif action == 'exit' or action == 'release':
-        enter_time = staying_uids.get(uid)
-        if enter_time is not None:
-          if enter_time < time:
-            yield {
-              'enter_time': enter_time,
-              'exit_time': time,
-              'member_id': uid,
-              'department': department,
-              'type_of_study': type_of_study,
-              'study_programme': study_programme,
-              'year_of_study': year_of_study,
-              'affiliated_student_interest_group': affiliated_student_interest_group
-            }
-          del staying_uids[uid]
+      },
+      chunk_size=chunk_size
+    )
+
+  def collect_categories(member_df: pd.DataFrame) -> None:
+    # The categories must be known before the first row is written, so scan the
+    # members in the access records once up front
+    seen_member_ids: MutableSet[str] = set()
+    for df in load_access_records():
+      member_ids = df['member_id']
+      for member_id in member_ids[member_ids.isin(member_df.index)].drop_duplicates():
+        if member_id in seen_member_ids:
+          continue
+        seen_member_ids.add(member_id)
+        member = member_df.loc[member_id]
+        if member['department'] not in departments:
+          departments.append(member['department'])
+        if member['affiliated_student_interest_group'] not in affiliated_student_interest_groups:
+          affiliated_student_interest_groups.append(member['affiliated_student_interest_group'])
+
+  def iterate_records(member_df: pd.DataFrame) -> Iterator[pd.DataFrame]:
+    for df in load_access_records():
+      yield df.join(member_df, on='member_id', how='inner')
 
   def iterate_rows(
-    spans: Sequence[Mapping[str, Any]],
-    start_time: pd.Timestamp,
-    end_time: pd.Timestamp,
-    time_step: pd.Timedelta
+    periods: Iterator[Tuple[pd.Timestamp, pd.Timestamp, Sequence[Mapping[str, Any]]]]
   ) -> Iterator[Mapping[str, Any]]:
 
     def time_components(prefix: str, time: pd.Timestamp) -> Mapping[str, Any]:
@@ -388,18 +377,8 @@ def preprocess(
         f'{prefix}_minute': time.minute
       }
 
-    period_start_time = start_time
-    period_end_time = period_start_time + time_step
-    i = 0
-    curr_spans: MutableSequence[Mapping[str, Any]] = []
-    while period_end_time <= end_time:
-
-      while i < len(spans) and spans[i]['enter_time'] < period_end_time:
-        if spans[i]['exit_time'] > period_start_time:
-          curr_spans.append(spans[i])
-        i += 1
-
-      groups = generate_member_groups()
+    groups = generate_member_groups()
+    for period_start_time, period_end_time, curr_spans in periods:
       for _, row in groups.iterrows():
         department = row['department']
         type_of_study = row['type_of_study']
@@ -454,14 +433,6 @@ def preprocess(
           'unique_stay_count': unique_stay_count
         }
 
-      curr_spans = [
-        span
-        for span in curr_spans
-        if span['exit_time'] > period_end_time
-      ]
-      period_start_time = period_end_time
-      period_end_time = period_start_time + time_step
-
   def to_data_frame(rows: Sequence[Mapping[str, Any]]) -> pd.DataFrame:
 
     def time_columns(prefix: str) -> Mapping[str, Any]:
@@ -497,37 +468,51 @@ def preprocess(
       }.items()
     })
 
-  member_df = load_member_data(member_data_path)
-  input_df = load_access_records(input_path)
-  spans = list(iterate_spans(
-    df=input_df,
-    member_df=member_df,
-    start_time=start_time,
-    end_time=end_time,
-    time_step=time_step
-  ))
-  rows = list(iterate_rows(
-    spans=spans,
+  member_df = load_member_data(member_data_path).drop(columns=['name']).set_index('member_id')
+  collect_categories(member_df)
+  periods = iterate_periods(
+    iterate_records(member_df),
     start_time=start_time,
     end_time=end_time,
-    time_step=time_step
-  ))
-  df = to_data_frame(rows)
-  assert df.notna().all(axis=None)
-
-  evaluation_start_idx = floor(df.shape[0] * (1 - evaluation_fraction))
-  training_df = df.iloc[:evaluation_start_idx]
-  evaluation_df = df.iloc[evaluation_start_idx:]
-  category_length_df = pd.DataFrame({'feature': ['department', 'affiliated_student_interest_group'], 'category_length': [len(departments), len(affiliated_student_interest_groups)]})
+    time_step=time_step,
+    enter_actions=('enter', 'acquire'),
+    exit_actions=('exit', 'release'),
+    max_stay=max_stay
+  )
+
+  group_count = generate_member_groups().shape[0]
+  period_count = (end_time - start_time) // time_step
+  evaluation_start_idx = floor(period_count * group_count * (1 - evaluation_fraction))
+  write_size = 1000 if chunk_size is None else chunk_size
 
-  for output_path, output_df in {
-    training_data_path: training_df,
-    evaluation_data_path: evaluation_df,
-    category_length_path: category_length_df
-  }.items():
-    output_path_obj = Path(output_path).resolve(strict=False)
-    output_path_obj.parent.mkdir(parents=True, exist_ok=True)
-    output_df.to_csv(str(output_path_obj), index=False)
+  with CsvChunkWriter(training_data_path) as training_writer, \
+      CsvChunkWriter(evaluation_data_path) as evaluation_writer:
+    rows: MutableSequence[Mapping[str, Any]] = []
+
+    def write_rows(writer: CsvChunkWriter) -> None:
+      df = to_data_frame(rows)
+      assert df.notna().all(axis=None)
+      writer.write(df)
+      rows.clear()
+
+    for i, row in enumerate(iterate_rows(periods)):
+      if i == evaluation_start_idx and len(rows) > 0:
+        write_rows(training_writer)
+      rows.append(row)
+      if len(rows) >= write_size:
+        write_rows(training_writer if i < evaluation_start_idx else evaluation_writer)
+
+    if len(rows) > 0:
+      write_rows(evaluation_writer if period_count * group_count > evaluation_start_idx else training_writer)
+
+    # Write the header of a split even if it has no rows
+    training_writer.write(to_data_frame([]))
+    evaluation_writer.write(to_data_frame([]))
+
+  category_length_df = pd.DataFrame({'feature': ['department', 'affiliated_student_interest_group'], 'category_length': [len(departments), len(affiliated_student_interest_groups)]})
+  category_length_path_obj = Path(category_length_path).resolve(strict=False)
+  category_length_path_obj.parent.mkdir(parents=True, exist_ok=True)
+  category_length_df.to_csv(str(category_length_path_obj), index=False)
 
 def train_or_evaluate_model(
   *,
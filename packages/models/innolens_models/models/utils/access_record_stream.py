@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from heapq import heappush, heappop
+from typing import Any, Collection, Iterable, Iterator, List, Mapping, MutableMapping, MutableSequence, Optional, Sequence, Tuple, IO
+from pathlib import Path
+
+import pandas as pd
+
+
+def read_access_record_chunks(
+  paths: Sequence[str],
+  *,
+  dtype: Mapping[str, Any],
+  chunk_size: Optional[int] = None,
+  columns: Sequence[str] = ('time', 'member_id', 'action')
+) -> Iterator[pd.DataFrame]:
+  '''
+  Yield the access records in time order.
+
+  If chunk_size is None, each file is loaded and sorted in memory. Otherwise the files
+  must already be sorted by time and are read chunk_size rows at a time. Multiple paths
+  are treated as consecutive partitions of the same history.
+  '''
+  last_time: Optional[pd.Timestamp] = None
+  for path in paths:
+    if chunk_size is None:
+      df = pd.read_csv(path, parse_dates=['time'], dtype=dtype)
+      chunks: Iterable[pd.DataFrame] = [df.sort_values('time', kind='mergesort')]
+    else:
+      chunks = pd.read_csv(path, parse_dates=['time'], dtype=dtype, chunksize=chunk_size)
+
+    for df in chunks:
+      assert df.columns.to_list() == list(columns)
+      if df.shape[0] == 0:
+        continue
+      if (
+        not df['time'].is_monotonic_increasing
+        or (last_time is not None and df['time'].iloc[0] < last_time)
+      ):
+        raise ValueError(f'Access records in {path} are not sorted by time, read them without chunking')
+      last_time = df['time'].iloc[-1]
+      yield df
+
+
+def iterate_periods(
+  records: Iterable[pd.DataFrame],
+  *,
+  start_time: datetime,
+  end_time: datetime,
+  time_step: timedelta,
+  enter_actions: Collection[str],
+  exit_actions: Collection[str],
+  max_stay: Optional[timedelta] = None
+) -> Iterator[Tuple[pd.Timestamp, pd.Timestamp, Sequence[Mapping[str, Any]]]]:
+  '''
+  Pair up the enter and exit records of each member into spans, and yield each period
+  between start_time and end_time together with the spans overlapping it.
+
+  A period is yielded as soon as no later record can add a span to it, so only the
+  members still staying and the periods they overlap are kept in memory. Stays that
+  are never closed are dropped. If max_stay is given, stays open for longer than it
+  are dropped early, which bounds the memory even if some exit records are missing.
+  '''
+  start_ts = pd.Timestamp(start_time)
+  step = pd.Timedelta(time_step)
+  period_count = (pd.Timestamp(end_time) - start_ts) // step
+
+  staying: MutableMapping[Any, Mapping[str, Any]] = {}
+  staying_heap: List[Tuple[pd.Timestamp, int, Any]] = []
+  pending: MutableMapping[int, MutableSequence[Mapping[str, Any]]] = {}
+  next_period = 0
+  seq = 0
+
+  def flush(limit: Optional[pd.Timestamp]) -> Iterator[Tuple[pd.Timestamp, pd.Timestamp, Sequence[Mapping[str, Any]]]]:
+    nonlocal next_period
+    while next_period < period_count:
+      period_start_time = start_ts + step * next_period
+      period_end_time = period_start_time + step
+      if limit is not None and period_end_time > limit:
+        break
+      yield period_start_time, period_end_time, pending.pop(next_period, [])
+      next_period += 1
+
+  for df in records:
+    columns = df.columns.to_list()
+    for values in zip(*(df[column].to_list() for column in columns)):
+      record = dict(zip(columns, values))
+      time = record['time']
+      uid = record['member_id']
+      action = record['action']
+      if action in enter_actions:
+        staying[uid] = record
+        heappush(staying_heap, (time, seq, uid))
+        seq += 1
+      elif action in exit_actions:
+        enter_record = staying.pop(uid, None)
+        if enter_record is None or not enter_record['time'] < time:
+          continue
+        span = {
+          **{
+            name: value
+            for name, value in enter_record.items()
+            if name not in ('time', 'action')
+          },
+          'enter_time': enter_record['time'],
+          'exit_time': time
+        }
+        first_period = max(next_period, (enter_record['time'] - start_ts) // step)
+        last_period = min(period_count, -((start_ts - time) // step))
+        for period in range(first_period, last_period):
+          pending.setdefault(period, []).append(span)
+
+    now = df['time'].iloc[-1]
+
+    # Drop the heap entries of closed (or re-entered) stays and the stays exceeding max_stay
+    while len(staying_heap) > 0:
+      enter_time, _, uid = staying_heap[0]
+      staying_record = staying.get(uid)
+      if staying_record is None or staying_record['time'] != enter_time:
+        heappop(staying_heap)
+      elif max_stay is not None and enter_time < now - max_stay:
+        heappop(staying_heap)
+        del staying[uid]
+      else:
+        break
+
+    limit = now if len(staying_heap) == 0 else min(now, staying_heap[0][0])
+    yield from flush(limit)
+
+  yield from flush(None)
+
+
+class CsvChunkWriter:
+  '''
+  Write data frames to a csv file one chunk at a time, with a single header row.
+  '''
+
+  __file: Optional[IO[str]]
+  __has_header: bool
+
+  def __init__(self, path: str):
+    super().__init__()
+    path_obj = Path(path).resolve(strict=False)
+    path_obj.parent.mkdir(parents=True, exist_ok=True)
+    self.__file = open(str(path_obj), 'w', newline='')
+    self.__has_header = False
+
+  def __enter__(self) -> CsvChunkWriter:
+    return self
+
+  def __exit__(self, *exc_info: Any) -> None:
+    self.close()
+
+  def write(self, df: pd.DataFrame) -> None:
+    assert self.__file is not None
+    df.to_csv(self.__file, header=not self.__has_header, index=False)
+    self.__has_header = True
+
+  def close(self) -> None:
+    if self.__file is not None:
+      self.__file.close()
+      self.__file = None
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from typing import Any, List, Mapping, Optional, Tuple
+from typing_extensions import Final
+from pathlib import Path
+import json
+import logging
+import os
+import re
+
+import tensorflow as tf
+from tensorflow import keras
+
+
+def load_checkpoint_state(checkpoint_dir_path: str) -> Mapping[str, Any]:
+  path = Path(checkpoint_dir_path) / 'checkpoints.json'
+  if not path.exists():
+    return { 'best': None, 'kept': [], 'lastEpoch': 0 }
+  with open(str(path)) as file:
+    return json.load(file)
+
+def save_checkpoint_state(checkpoint_dir_path: str, state: Mapping[str, Any]) -> None:
+  path = Path(checkpoint_dir_path) / 'checkpoints.json'
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = path.with_name(f'.{path.name}.tmp')
+  with open(str(tmp_path), 'w') as file:
+    json.dump(state, file, indent=2)
+  os.replace(str(tmp_path), str(path))
+
+def find_checkpoint(checkpoint_dir_path: str) -> Optional[Tuple[str, int]]:
+  '''
+  Find the checkpoint to load and the number of epochs trained so far. The best
+  checkpoint is preferred, dirs written before it was tracked fall back to the
+  checkpoint of the highest epoch.
+  '''
+  state = load_checkpoint_state(checkpoint_dir_path)
+  if state['best'] is not None:
+    return str(Path(checkpoint_dir_path) / state['best']['name']), state['lastEpoch']
+
+  latest_ckpt = tf.train.latest_checkpoint(checkpoint_dir_path)
+  if latest_ckpt is None:
+    return None
+  match = re.search(r'\d+', Path(latest_ckpt).name)
+  if match is None:
+    return None
+  return latest_ckpt, int(match[0])
+
+def replace_checkpoints(model: Any, checkpoint_dir_path: str, *, epoch: int) -> None:
+  '''
+  Save the weights as the only kept and best checkpoint, for weights whose metrics
+  are not comparable with the kept ones, e.g. after training on different data.
+  '''
+  name = f'checkpoint-{epoch:04d}'
+  model.save_weights(str(Path(checkpoint_dir_path) / name))
+  for entry in load_checkpoint_state(checkpoint_dir_path)['kept']:
+    if entry['name'] != name:
+      for path in Path(checkpoint_dir_path).glob(f'{entry["name"]}.*'):
+        path.unlink()
+  entry = { 'name': name, 'epoch': epoch, 'value': None }
+  save_checkpoint_state(checkpoint_dir_path, {
+    'monitor': None,
+    'best': entry,
+    'kept': [entry],
+    'lastEpoch': epoch
+  })
+
+def forget_checkpoint_metrics(checkpoint_dir_path: str) -> None:
+  '''
+  Keep only the best checkpoint, without its metric, so training on different
+  data, e.g. in a copy warm starting the next backtest fold, continues from it
+  without comparing against the metrics of the old data.
+  '''
+  state = load_checkpoint_state(checkpoint_dir_path)
+  if state['best'] is None:
+    return
+  entry = { **state['best'], 'value': None }
+  for kept_entry in state['kept']:
+    if kept_entry['name'] != entry['name']:
+      for path in Path(checkpoint_dir_path).glob(f'{kept_entry["name"]}.*'):
+        path.unlink()
+  save_checkpoint_state(checkpoint_dir_path, {
+    'monitor': None,
+    'best': entry,
+    'kept': [entry],
+    'lastEpoch': state['lastEpoch']
+  })
+
+
+class TopKCheckpoint(keras.callbacks.Callback):
+  '''
+  Save the weights after an epoch only if they are among the k best by the
+  monitored metric, delete the checkpoints falling out of the k best, and point
+  checkpoints.json at the best one.
+  '''
+
+  __checkpoint_dir_path: Final[str]
+  __k: Final[int]
+  __monitor: Final[str]
+  __kept: List[Mapping[str, Any]]
+
+  def __init__(self, checkpoint_dir_path: str, *, k: int = 3, monitor: str = 'val_loss'):
+    super().__init__()
+    self.__checkpoint_dir_path = checkpoint_dir_path
+    self.__k = k
+    self.__monitor = monitor
+    self.__kept = list(load_checkpoint_state(checkpoint_dir_path)['kept'])
+
+  def on_epoch_end(self, epoch: int, logs: Optional[Mapping[str, Any]] = None) -> None:
+    # Name the checkpoints by the number of epochs trained, like ModelCheckpoint
+    epoch += 1
+    value = None if logs is None else logs.get(self.__monitor)
+    if value is not None and (
+      len(self.__kept) < self.__k
+      or value < max(entry_value(entry) for entry in self.__kept)
+    ):
+      name = f'checkpoint-{epoch:04d}'
+      self.model.save_weights(str(Path(self.__checkpoint_dir_path) / name))
+      logging.info(f'Save {name} with {self.__monitor} {value}')
+      self.__kept.append({ 'name': name, 'epoch': epoch, 'value': float(value) })
+      self.__kept.sort(key=entry_value)
+      for entry in self.__kept[self.__k:]:
+        for path in Path(self.__checkpoint_dir_path).glob(f'{entry["name"]}.*'):
+          path.unlink()
+      del self.__kept[self.__k:]
+
+    save_checkpoint_state(self.__checkpoint_dir_path, {
+      'monitor': self.__monitor,
+      'best': self.__kept[0] if len(self.__kept) > 0 else None,
+      'kept': self.__kept,
+      'lastEpoch': epoch
+    })
+
+
+def entry_value(entry: Mapping[str, Any]) -> float:
+  # Checkpoints saved without a metric are replaced first
+  return float('inf') if entry['value'] is None else entry['value']
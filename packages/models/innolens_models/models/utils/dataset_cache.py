@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Mapping, MutableMapping, Optional, Sequence, Tuple
+from typing_extensions import Final
+from pathlib import Path
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+
+default_cache_dir_path: Final = Path(__file__).parent.parent.parent.parent / 'cache'
+default_cache_max_size: Final = 1024 * 1024 * 1024 # 1 GiB
+
+CacheEntry = Tuple[Mapping[str, np.ndarray], Any]
+
+
+class DatasetCache:
+  '''
+  Cache of preprocessed datasets, keyed by the content of the input files and the
+  preprocessing parameters.
+
+  Each entry is a dir of .npy files, which are loaded memory-mapped, plus a json
+  file of metadata. The least recently used entries are evicted when the total size
+  grows over max_size.
+
+  Several processes may share the cache. An entry is written to a tmp dir and
+  renamed into place, so it is never seen half written, and an entry in place is
+  never overwritten, as a process may be reading it.
+  '''
+
+  __format_version: Final = 1
+
+  dir_path: Final[Path]
+  max_size: Final[Optional[int]]
+  __file_hashes: Final[MutableMapping[Tuple[str, int, int], str]]
+
+  def __init__(self, dir_path: str, *, max_size: Optional[int] = default_cache_max_size):
+    super().__init__()
+    self.dir_path = Path(dir_path)
+    self.max_size = max_size
+    self.__file_hashes = {}
+
+  def key(self, input_paths: Sequence[str], params: Mapping[str, Any]) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps({
+      'version': self.__format_version,
+      'inputs': [self.__hash_file(path) for path in input_paths],
+      'params': params
+    }, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+  def load(self, key: str) -> Optional[CacheEntry]:
+    entry_path = self.dir_path / key
+    meta_path = entry_path / 'meta.json'
+    try:
+      with open(str(meta_path)) as file:
+        entry_json = json.load(file)
+      arrays = {
+        name: np.load(str(entry_path / f'{name}.npy'), mmap_mode='r')
+        for name in entry_json['arrays']
+      }
+      # Mark the entry as recently used
+      os.utime(str(meta_path))
+    except FileNotFoundError:
+      # Missing, or evicted by another process while loading
+      return None
+    return arrays, entry_json['meta']
+
+  def save(self, key: str, arrays: Mapping[str, np.ndarray], meta: Any) -> None:
+    self.dir_path.mkdir(parents=True, exist_ok=True)
+    tmp_path = self.dir_path / f'.tmp-{uuid.uuid4().hex}'
+    tmp_path.mkdir()
+    try:
+      for name, array in arrays.items():
+        np.save(str(tmp_path / f'{name}.npy'), np.ascontiguousarray(array))
+      with open(str(tmp_path / 'meta.json'), 'w') as file:
+        json.dump({ 'arrays': list(arrays.keys()), 'meta': meta }, file)
+      entry_path = self.dir_path / key
+      try:
+        os.replace(str(tmp_path), str(entry_path))
+      except OSError as err:
+        if err.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+          raise
+        # Another process saved the same entry first, keep it
+        logging.info(f'Keep cached dataset {key} saved by another process')
+    finally:
+      if tmp_path.exists():
+        shutil.rmtree(str(tmp_path))
+    self.__evict(keep=key)
+
+  def get_or_create(
+    self,
+    input_paths: Sequence[str],
+    params: Mapping[str, Any],
+    create: Callable[[], CacheEntry]
+  ) -> CacheEntry:
+    key = self.key(input_paths, params)
+    entry = self.load(key)
+    if entry is not None:
+      logging.info(f'Load cached dataset {key}')
+      return entry
+    arrays, meta = create()
+    self.save(key, arrays, meta)
+    loaded_entry = self.load(key)
+    if loaded_entry is None:
+      # Evicted by another process right away, use the arrays in memory
+      return arrays, meta
+    return loaded_entry
+
+  def __hash_file(self, path: str) -> str:
+    stat = os.stat(path)
+    stat_key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    file_hash = self.__file_hashes.get(stat_key)
+    if file_hash is None:
+      hasher = hashlib.sha256()
+      with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+          hasher.update(block)
+      file_hash = hasher.hexdigest()
+      self.__file_hashes[stat_key] = file_hash
+    return file_hash
+
+  def __evict(self, *, keep: str) -> None:
+    if self.max_size is None:
+      return
+    entries = []
+    for entry_path in self.dir_path.iterdir():
+      # Skip the tmp dirs being written
+      if entry_path.name.startswith('.'):
+        continue
+      try:
+        size = sum(file_path.stat().st_size for file_path in entry_path.iterdir())
+        entries.append(((entry_path / 'meta.json').stat().st_mtime, size, entry_path))
+      except FileNotFoundError:
+        # Evicted by another process
+        continue
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+      if total_size <= self.max_size:
+        break
+      if entry_path.name == keep:
+        continue
+      logging.info(f'Evict cached dataset {entry_path.name}')
+      shutil.rmtree(str(entry_path), ignore_errors=True)
+      total_size -= size
+
+
+def create_dataset_cache(
+  *,
+  no_cache: bool = False,
+  cache_dir_path: Optional[str] = None,
+  cache_max_size: Optional[int] = None
+) -> Optional[DatasetCache]:
+  if no_cache:
+    return None
+  return DatasetCache(
+    str(default_cache_dir_path) if cache_dir_path is None else cache_dir_path,
+    max_size=default_cache_max_size if cache_max_size is None else cache_max_size
+  )
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Mapping, MutableMapping, Sequence
+from typing_extensions import Final
+from pathlib import Path
+import json
+
+import numpy as np
+
+
+activation_fns: Final[Mapping[str, Callable[[np.ndarray], np.ndarray]]] = {
+  'linear': lambda x: x,
+  'relu': lambda x: np.maximum(x, 0)
+}
+
+
+class DenseStack:
+  '''
+  NumPy forward pass of a stack of Keras Dense layers with the standardization
+  params around it, so a model can be served without TensorFlow.
+
+  The .npz format holds kernel_{i}, bias_{i} and activation_{i} of each layer,
+  mean, stddev, and a json string of metadata about the model.
+  '''
+
+  kernels: Final[Sequence[np.ndarray]]
+  biases: Final[Sequence[np.ndarray]]
+  activations: Final[Sequence[str]]
+  mean: Final[float]
+  stddev: Final[float]
+  meta: Final[Mapping[str, Any]]
+
+  def __init__(
+    self,
+    kernels: Sequence[np.ndarray],
+    biases: Sequence[np.ndarray],
+    activations: Sequence[str],
+    *,
+    mean: float,
+    stddev: float,
+    meta: Mapping[str, Any]
+  ):
+    super().__init__()
+    assert len(kernels) == len(biases) == len(activations)
+    for activation in activations:
+      if activation not in activation_fns:
+        raise ValueError(f'Unsupported activation: {activation}')
+    self.kernels = [np.asarray(kernel, dtype=np.float32) for kernel in kernels]
+    self.biases = [np.asarray(bias, dtype=np.float32) for bias in biases]
+    self.activations = activations
+    self.mean = float(mean)
+    self.stddev = float(stddev)
+    self.meta = meta
+
+  @staticmethod
+  def from_keras(model: Any, *, mean: float, stddev: float, meta: Mapping[str, Any]) -> DenseStack:
+    '''
+    Copy the weights of a built Keras Sequential model of Dense layers.
+    '''
+    kernels = []
+    biases = []
+    activations = []
+    for layer in model.layers:
+      if type(layer).__name__ == 'InputLayer':
+        continue
+      if type(layer).__name__ != 'Dense':
+        raise ValueError(f'Unsupported layer: {type(layer).__name__}')
+      kernel, bias = layer.get_weights()
+      kernels.append(kernel)
+      biases.append(bias)
+      activations.append(layer.activation.__name__)
+    return DenseStack(kernels, biases, activations, mean=mean, stddev=stddev, meta=meta)
+
+  @staticmethod
+  def load(path: str) -> DenseStack:
+    with np.load(path) as arrs:
+      layer_count = sum(1 for name in arrs.files if name.startswith('kernel_'))
+      return DenseStack(
+        [arrs[f'kernel_{i}'] for i in range(layer_count)],
+        [arrs[f'bias_{i}'] for i in range(layer_count)],
+        [str(arrs[f'activation_{i}']) for i in range(layer_count)],
+        mean=float(arrs['mean']),
+        stddev=float(arrs['stddev']),
+        meta=json.loads(str(arrs['meta']))
+      )
+
+  def save(self, path: str) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    arrays: MutableMapping[str, Any] = {
+      'mean': self.mean,
+      'stddev': self.stddev,
+      'meta': np.array(json.dumps(self.meta))
+    }
+    for i, (kernel, bias, activation) in enumerate(zip(self.kernels, self.biases, self.activations)):
+      arrays[f'kernel_{i}'] = kernel
+      arrays[f'bias_{i}'] = bias
+      arrays[f'activation_{i}'] = np.array(activation)
+    np.savez(path, **arrays)
+
+  def predict(self, X_batch: Any) -> np.ndarray:
+    '''
+    Forecast a batch in the original unit, standardizing it on the way in and back
+    on the way out, as the Keras models do.
+    '''
+    Y = ((np.asarray(X_batch) - self.mean) / self.stddev).astype(np.float32)
+    for kernel, bias, activation in zip(self.kernels, self.biases, self.activations):
+      Y = activation_fns[activation](Y @ kernel + bias)
+    return Y * self.stddev + self.mean
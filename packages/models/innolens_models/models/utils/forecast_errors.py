@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from typing import Any, Mapping, Sequence
+from typing_extensions import Final
+
+import numpy as np
+
+
+class ForecastErrors:
+  '''
+  Running sums of the absolute and squared forecast errors, per forecast step and
+  per series, so any number of batches can be scored in constant memory.
+  '''
+
+  forecast_size: Final[int]
+  series_names: Final[Sequence[str]]
+  __abs_step_sums: Final[np.ndarray]
+  __sq_step_sums: Final[np.ndarray]
+  __abs_series_sums: Final[np.ndarray]
+  __sq_series_sums: Final[np.ndarray]
+  __series_counts: Final[np.ndarray]
+
+  def __init__(self, *, forecast_size: int, series_names: Sequence[str]):
+    super().__init__()
+    self.forecast_size = forecast_size
+    self.series_names = series_names
+    self.__abs_step_sums = np.zeros(forecast_size, dtype=np.float64)
+    self.__sq_step_sums = np.zeros(forecast_size, dtype=np.float64)
+    self.__abs_series_sums = np.zeros(len(series_names), dtype=np.float64)
+    self.__sq_series_sums = np.zeros(len(series_names), dtype=np.float64)
+    self.__series_counts = np.zeros(len(series_names), dtype=np.int64)
+
+  @property
+  def sample_count(self) -> int:
+    return int(self.__series_counts.sum())
+
+  def update(self, Y_true: np.ndarray, Y_pred: np.ndarray, series_idxs: np.ndarray) -> None:
+    '''
+    Add a batch of (sample, forecast step) labels and predictions, where
+    series_idxs is the series of each sample.
+    '''
+    errors = Y_pred.astype(np.float64) - Y_true
+    abs_errors = np.abs(errors)
+    sq_errors = np.square(errors)
+    np.add(self.__abs_step_sums, abs_errors.sum(axis=0), out=self.__abs_step_sums)
+    np.add(self.__sq_step_sums, sq_errors.sum(axis=0), out=self.__sq_step_sums)
+    np.add.at(self.__abs_series_sums, series_idxs, abs_errors.mean(axis=1))
+    np.add.at(self.__sq_series_sums, series_idxs, sq_errors.mean(axis=1))
+    np.add.at(self.__series_counts, series_idxs, 1)
+
+  def merge(self, other: ForecastErrors) -> None:
+    np.add(self.__abs_step_sums, other.__abs_step_sums, out=self.__abs_step_sums)
+    np.add(self.__sq_step_sums, other.__sq_step_sums, out=self.__sq_step_sums)
+    np.add(self.__abs_series_sums, other.__abs_series_sums, out=self.__abs_series_sums)
+    np.add(self.__sq_series_sums, other.__sq_series_sums, out=self.__sq_series_sums)
+    np.add(self.__series_counts, other.__series_counts, out=self.__series_counts)
+
+  def report(self) -> Mapping[str, Any]:
+    sample_count = max(self.sample_count, 1)
+    series_counts = np.maximum(self.__series_counts, 1)
+    mae_per_step = self.__abs_step_sums / sample_count
+    mse_per_step = self.__sq_step_sums / sample_count
+    mae_per_series = self.__abs_series_sums / series_counts
+    mse_per_series = self.__sq_series_sums / series_counts
+    return {
+      'sampleCount': self.sample_count,
+      'mae': float(mae_per_step.mean()),
+      'mse': float(mse_per_step.mean()),
+      'rmse': float(np.sqrt(mse_per_step.mean())),
+      'maePerStep': mae_per_step.tolist(),
+      'msePerStep': mse_per_step.tolist(),
+      'perSeries': {
+        name: {
+          'sampleCount': int(self.__series_counts[s]),
+          'mae': float(mae_per_series[s]),
+          'mse': float(mse_per_series[s])
+        }
+        for s, name in enumerate(self.series_names)
+      }
+    }
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from typing import Any, Mapping, TypeVar
+from pathlib import Path
+import json
+
+
+H = TypeVar('H')
+
+
+def parse_hyperparams(default: H, params: Mapping[str, Any]) -> H:
+  '''
+  Override the fields of default, a NamedTuple of hyperparams, with params.
+  '''
+  fields = getattr(default, '_fields')
+  unknown_names = set(params.keys()) - set(fields)
+  if len(unknown_names) > 0:
+    unknown_names_str = ', '.join(sorted(unknown_names))
+    raise ValueError(f'Unknown hyperparams: {unknown_names_str}')
+  return getattr(default, '_replace')(**{
+    name: tuple(value) if isinstance(value, list) else value
+    for name, value in params.items()
+  })
+
+def load_hyperparams(checkpoint_dir_path: str, default: H) -> H:
+  path = Path(checkpoint_dir_path) / 'hyperparams.json'
+  if not path.exists():
+    return default
+  with open(str(path)) as file:
+    return parse_hyperparams(default, json.load(file))
+
+def save_hyperparams(checkpoint_dir_path: str, hyperparams: Any) -> None:
+  path = Path(checkpoint_dir_path) / 'hyperparams.json'
+  path.parent.mkdir(parents=True, exist_ok=True)
+  with open(str(path), 'w') as file:
+    json.dump(hyperparams._asdict(), file, indent=2)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+from time import perf_counter
+from typing import Any, Callable, Mapping, MutableMapping, MutableSequence, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from .series_matrix import SeriesMatrix
+from .windowing import SlidingWindows
+
+
+def benchmark_input(
+  *,
+  load_series: Callable[[], SeriesMatrix],
+  create_windows: Callable[[SeriesMatrix], SlidingWindows],
+  create_dataset: Callable[[SlidingWindows], Any],
+  forward: Optional[Callable[[np.ndarray], Any]] = None,
+  batch_size: int,
+  start: int = 0,
+  steps: int = 100,
+  log_dir_path: Optional[str] = None
+) -> Mapping[str, Any]:
+  '''
+  Time each stage of a training input pipeline without training: loading the
+  series, building the windows, gathering the batches in numpy and iterating the
+  tf.data pipeline. If forward is given, a forward pass of one batch is timed too,
+  so the input time per batch can be compared with the compute time per batch.
+
+  If log_dir_path is given, a TF profiler trace of the pipeline iteration is
+  written to it for TensorBoard.
+  '''
+  if steps < 1:
+    raise ValueError(f'steps must be at least 1, got {steps}')
+
+  start_time = perf_counter()
+  series = load_series()
+  load_sec = perf_counter() - start_time
+
+  start_time = perf_counter()
+  windows = create_windows(series)
+  window_sec = perf_counter() - start_time
+
+  batches = windows.iterate_batches(batch_size=batch_size, start=start, shuffle=True)
+  start_time = perf_counter()
+  gather_count = 0
+  for _, (X, _) in zip(range(steps), batches):
+    gather_count += 1
+  gather_ms = (perf_counter() - start_time) * 1000 / max(gather_count, 1)
+
+  ds = create_dataset(windows)
+  if log_dir_path is not None:
+    writer = tf.summary.create_file_writer(log_dir_path)
+    tf.summary.trace_on(graph=False, profiler=True)
+
+  it = iter(ds)
+  start_time = perf_counter()
+  X, _ = next(it)
+  first_batch_ms = (perf_counter() - start_time) * 1000
+
+  latencies: MutableSequence[float] = []
+  sample_count = 0
+  start_time = perf_counter()
+  batch_start_time = start_time
+  for _, (X, _) in zip(range(steps), it):
+    batch_end_time = perf_counter()
+    latencies.append((batch_end_time - batch_start_time) * 1000)
+    sample_count += X.shape[0]
+    batch_start_time = batch_end_time
+  total_sec = perf_counter() - start_time
+
+  if log_dir_path is not None:
+    with writer.as_default():
+      tf.summary.trace_export(name='input_pipeline', step=0, profiler_outdir=log_dir_path)
+
+  stages: MutableMapping[str, float] = {
+    'load_sec': load_sec,
+    'window_sec': window_sec,
+    'first_batch_ms': first_batch_ms,
+    'gather_ms_per_batch': gather_ms,
+    'pipeline_ms_per_batch': total_sec * 1000 / len(latencies)
+  }
+
+  if forward is not None:
+    X = X.numpy()
+    forward(X) # Warm up
+    start_time = perf_counter()
+    for _ in range(steps):
+      forward(X)
+    stages['forward_ms_per_batch'] = (perf_counter() - start_time) * 1000 / steps
+
+  return {
+    'samples_per_sec': sample_count / total_sec,
+    'batch_latency_ms': {
+      'p50': float(np.percentile(latencies, 50)),
+      'p90': float(np.percentile(latencies, 90)),
+      'p99': float(np.percentile(latencies, 99)),
+      'max': float(np.max(latencies))
+    },
+    'stages': stages
+  }
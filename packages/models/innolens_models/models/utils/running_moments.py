@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from typing import Optional
+from pathlib import Path
+
+import numpy as np
+
+
+class RunningMoments:
+  '''
+  Count, mean and sum of squared deviations of all values seen so far, merged batch
+  by batch with the parallel form of Welford's algorithm, so the standardization
+  params can follow appended data without revisiting the old data.
+  '''
+
+  count: int
+  mean: float
+  m2: float
+
+  def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+    super().__init__()
+    self.count = count
+    self.mean = mean
+    self.m2 = m2
+
+  @staticmethod
+  def of(values: np.ndarray) -> RunningMoments:
+    if values.size == 0:
+      return RunningMoments()
+    mean = float(values.mean(dtype=np.float64))
+    m2 = float(np.square(values - mean, dtype=np.float64).sum())
+    return RunningMoments(int(values.size), mean, m2)
+
+  @property
+  def stddev(self) -> float:
+    return float(np.sqrt(self.m2 / self.count)) if self.count > 0 else 1.0
+
+  def update(self, values: np.ndarray) -> None:
+    other = RunningMoments.of(values)
+    if other.count == 0:
+      return
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta * other.count / count
+    self.m2 += other.m2 + delta * delta * self.count * other.count / count
+    self.count = count
+
+  @staticmethod
+  def load(path: str) -> Optional[RunningMoments]:
+    '''
+    Load the moments saved with the standardization params, or None if they were
+    saved before the moments were tracked.
+    '''
+    if not Path(path).exists():
+      return None
+    arrs = np.load(path)
+    if 'count' not in arrs:
+      return None
+    return RunningMoments(int(arrs['count']), float(arrs['mean']), float(arrs['m2']))
+
+  def save(self, path: str) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    np.savez(
+      path,
+      mean=self.mean,
+      stddev=self.stddev,
+      count=self.count,
+      m2=self.m2
+    )
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from typing import Any, Optional, Sequence
+from typing_extensions import Final
+from pathlib import Path
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .dataset_cache import CacheEntry, DatasetCache, create_dataset_cache
+
+
+class SeriesMatrix:
+  '''
+  Time series sharing the same time axis, stored as a (time, series) float32 matrix.
+
+  The binary format is a .npy file of the matrix, which can be memory-mapped, plus an
+  .index.json file next to it holding the series names and the time spans.
+  '''
+
+  names: Final[Sequence[str]]
+  values: Final[np.ndarray]
+  start_times: Final[Optional[np.ndarray]] # datetime64[ns] in UTC
+  end_times: Final[Optional[np.ndarray]]
+
+  def __init__(
+    self,
+    names: Sequence[str],
+    values: np.ndarray,
+    *,
+    start_times: Optional[np.ndarray] = None,
+    end_times: Optional[np.ndarray] = None
+  ):
+    super().__init__()
+    assert values.ndim == 2 and values.shape[1] == len(names)
+    assert start_times is None or start_times.shape == (values.shape[0],)
+    assert end_times is None or end_times.shape == (values.shape[0],)
+    self.names = names
+    self.values = values
+    self.start_times = start_times
+    self.end_times = end_times
+
+  @staticmethod
+  def load(path: str, *, names_key: str, dataset_cache: Optional[DatasetCache] = None) -> SeriesMatrix:
+    '''
+    Load either the binary format or the json training data, in which names_key is the
+    key of the series names.
+    '''
+    if path.endswith('.npy'):
+      return SeriesMatrix.load_npy(path)
+
+    def parse() -> CacheEntry:
+      with open(path) as file:
+        data = json.load(file)
+      series = SeriesMatrix.from_json(data, names_key=names_key)
+      arrays = { 'values': series.values }
+      if series.start_times is not None and series.end_times is not None:
+        arrays['start_times'] = series.start_times
+        arrays['end_times'] = series.end_times
+      return arrays, { 'names': series.names }
+
+    if dataset_cache is None:
+      arrays, meta = parse()
+    else:
+      arrays, meta = dataset_cache.get_or_create([path], { 'loader': 'series_matrix', 'names_key': names_key }, parse)
+    return SeriesMatrix(
+      meta['names'],
+      arrays['values'],
+      start_times=arrays.get('start_times'),
+      end_times=arrays.get('end_times')
+    )
+
+  @staticmethod
+  def load_cached(
+    path: str,
+    *,
+    names_key: str,
+    no_cache: bool = False,
+    cache_dir_path: Optional[str] = None,
+    cache_max_size: Optional[int] = None
+  ) -> SeriesMatrix:
+    '''
+    Load with the dataset cache of the cache args, see create_dataset_cache. Loading
+    the json training data once before starting the worker processes parses it into
+    the cache, so the workers memory-map the cached matrix instead of each parsing it.
+    '''
+    return SeriesMatrix.load(
+      path,
+      names_key=names_key,
+      dataset_cache=create_dataset_cache(
+        no_cache=no_cache,
+        cache_dir_path=cache_dir_path,
+        cache_max_size=cache_max_size
+      )
+    )
+
+  @staticmethod
+  def from_json(data: Any, *, names_key: str) -> SeriesMatrix:
+    '''
+    Convert the json training data, in which values is a (series, time) nested list.
+    The time spans are read from either startTimes and endTimes or timeSpans.
+    '''
+    names = data[names_key]
+    values = np.array(data['values'], dtype=np.float32).reshape((len(names), -1)).T
+    if 'startTimes' in data and 'endTimes' in data:
+      start_times = parse_times(data['startTimes'])
+      end_times = parse_times(data['endTimes'])
+    elif 'timeSpans' in data:
+      start_times = parse_times([time_span[0] for time_span in data['timeSpans']])
+      end_times = parse_times([time_span[1] for time_span in data['timeSpans']])
+    else:
+      start_times = None
+      end_times = None
+    return SeriesMatrix(names, np.ascontiguousarray(values), start_times=start_times, end_times=end_times)
+
+  @staticmethod
+  def load_npy(path: str) -> SeriesMatrix:
+    with open(str(index_path(path))) as file:
+      index = json.load(file)
+    values = np.load(path, mmap_mode='r')
+    start_times = None if index.get('startTimes') is None else parse_times(index['startTimes'])
+    end_times = None if index.get('endTimes') is None else parse_times(index['endTimes'])
+    return SeriesMatrix(index['names'], values, start_times=start_times, end_times=end_times)
+
+  def save_npy(self, path: str) -> None:
+    '''
+    Write the binary format. The files are replaced atomically, so the matrix being
+    saved may be memory-mapped from the same path.
+    '''
+    path_obj = Path(path).resolve(strict=False)
+    path_obj.parent.mkdir(parents=True, exist_ok=True)
+    idx_path_obj = index_path(str(path_obj))
+    tmp_path_obj = path_obj.with_name(f'.{path_obj.name}.tmp')
+    tmp_idx_path_obj = idx_path_obj.with_name(f'.{idx_path_obj.name}.tmp')
+    with open(str(tmp_path_obj), 'wb') as file:
+      np.save(file, np.ascontiguousarray(self.values, dtype=np.float32))
+    with open(str(tmp_idx_path_obj), 'w') as file:
+      json.dump({
+        'names': list(self.names),
+        'startTimes': None if self.start_times is None else to_epoch_ms(self.start_times).tolist(),
+        'endTimes': None if self.end_times is None else to_epoch_ms(self.end_times).tolist()
+      }, file)
+    os.replace(str(tmp_path_obj), str(path_obj))
+    os.replace(str(tmp_idx_path_obj), str(idx_path_obj))
+
+  def append(self, other: SeriesMatrix) -> SeriesMatrix:
+    '''
+    Append the time steps of other, which must have the same series and start after
+    the last time step.
+    '''
+    other = other.select(self.names)
+    if (
+      self.end_times is not None and other.start_times is not None
+      and self.end_times.shape[0] > 0 and other.start_times.shape[0] > 0
+      and other.start_times[0] < self.end_times[-1]
+    ):
+      raise ValueError('The appended time steps overlap the existing ones')
+    has_times = all(times is not None for times in (self.start_times, self.end_times, other.start_times, other.end_times))
+    return SeriesMatrix(
+      self.names,
+      np.concatenate([self.values, other.values]),
+      start_times=np.concatenate([self.start_times, other.start_times]) if has_times else None,
+      end_times=np.concatenate([self.end_times, other.end_times]) if has_times else None
+    )
+
+  def slice(self, start: Optional[int], stop: Optional[int]) -> SeriesMatrix:
+    '''
+    Take the time steps in [start, stop) without copying the values.
+    '''
+    return SeriesMatrix(
+      self.names,
+      self.values[start:stop],
+      start_times=None if self.start_times is None else self.start_times[start:stop],
+      end_times=None if self.end_times is None else self.end_times[start:stop]
+    )
+
+  def select(self, names: Sequence[str]) -> SeriesMatrix:
+    name_idxs = { name: i for i, name in enumerate(self.names) }
+    return SeriesMatrix(
+      names,
+      self.values[:, [name_idxs[name] for name in names]],
+      start_times=self.start_times,
+      end_times=self.end_times
+    )
+
+
+def index_path(path: str) -> Path:
+  path_obj = Path(path)
+  return path_obj.with_name(f'{path_obj.stem}.index.json')
+
+def parse_times(times: Sequence[Any]) -> np.ndarray:
+  '''
+  Parse ISO 8601 strings with time zone offsets, or epoch milliseconds, into naive
+  datetime64[ns] in UTC.
+  '''
+  if len(times) > 0 and isinstance(times[0], (int, float, np.number)):
+    return np.array(times, dtype=np.int64).astype('datetime64[ms]').astype('datetime64[ns]')
+  return pd.to_datetime(pd.Series(times), utc=True).dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+
+def to_epoch_ms(times: np.ndarray) -> np.ndarray:
+  return times.astype('datetime64[ms]').astype(np.int64)
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+from typing import Callable, MutableSequence, Optional, Sequence, TypeVar, Union
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def run_in_spawned_pool(
+  fn: Callable[[T], R],
+  items: Sequence[T],
+  *,
+  workers: Optional[int] = None,
+  threads_per_worker: int = 1
+) -> Sequence[Union[R, Exception]]:
+  '''
+  Run fn on each item in worker processes, which are spawned as TensorFlow does not
+  survive a fork. Each worker is pinned to threads_per_worker TF threads, and there
+  are as many workers as the CPUs fit by default, so the workers do not fight over
+  the cores. fn must be picklable, i.e. defined at the top level of a module.
+
+  Returns the result of each item, or the exception it failed with, which is logged.
+  '''
+  if workers is None:
+    workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+  with ProcessPoolExecutor(
+    max_workers=workers,
+    mp_context=multiprocessing.get_context('spawn'),
+    initializer=pin_threads,
+    initargs=(threads_per_worker,)
+  ) as executor:
+    futures = [executor.submit(fn, item) for item in items]
+
+  results: MutableSequence[Union[R, Exception]] = []
+  for item, future in zip(items, futures):
+    try:
+      results.append(future.result())
+    except Exception as err:
+      logging.error(f'Running {item} failed', exc_info=err)
+      results.append(err)
+  return results
+
+def pin_threads(threads: int) -> None:
+  os.environ['OMP_NUM_THREADS'] = str(threads)
+  import tensorflow as tf
+  tf.config.threading.set_intra_op_parallelism_threads(threads)
+  tf.config.threading.set_inter_op_parallelism_threads(1)
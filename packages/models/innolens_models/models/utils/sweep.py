@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import itertools
+from pprint import pprint
+from typing import Any, Callable, Mapping, MutableSequence, NamedTuple, Optional, Sequence
+from pathlib import Path
+import json
+
+import numpy as np
+
+from .spawned_pool import run_in_spawned_pool
+
+
+class Trial(NamedTuple):
+  trial_index: int
+  params: Mapping[str, Any]
+  checkpoint_dir_path: str
+
+
+def load_search_spec(path: str) -> Mapping[str, Any]:
+  '''
+  Load a json search spec, for example:
+
+    {
+      "search": "random",
+      "trials": 20,
+      "seed": 0,
+      "params": {
+        "hidden_units": [[], [64], [256]],
+        "learning_rate": { "min": 0.0001, "max": 0.01, "log": true },
+        "batch_size": [64, 128, 256]
+      }
+    }
+
+  search is either "grid", which tries every combination of the listed values, or
+  "random", which samples trials combinations. Random search also takes ranges.
+  '''
+  with open(path) as file:
+    spec = json.load(file)
+  if spec.get('search', 'grid') not in ('grid', 'random'):
+    raise ValueError(f'Unknown search: {spec["search"]}')
+  return spec
+
+def plan_trials(spec: Mapping[str, Any], *, output_dir_path: str) -> Sequence[Trial]:
+  space: Mapping[str, Any] = spec['params']
+  names = list(space.keys())
+
+  param_sets: Sequence[Mapping[str, Any]]
+  if spec.get('search', 'grid') == 'grid':
+    for name in names:
+      if not isinstance(space[name], list):
+        raise ValueError(f'Grid search needs a list of values for {name}')
+    param_sets = [
+      dict(zip(names, values))
+      for values in itertools.product(*(space[name] for name in names))
+    ]
+  else:
+    rng = np.random.default_rng(spec.get('seed'))
+    param_sets = [
+      { name: sample_param(rng, space[name]) for name in names }
+      for _ in range(spec['trials'])
+    ]
+
+  return [
+    Trial(i, params, str(Path(output_dir_path) / f'trial-{i:03d}'))
+    for i, params in enumerate(param_sets)
+  ]
+
+def sample_param(rng: Any, values: Any) -> Any:
+  if isinstance(values, list):
+    return values[rng.integers(len(values))]
+  low, high = values['min'], values['max']
+  if values.get('log', False):
+    value = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+  else:
+    value = float(rng.uniform(low, high))
+  return int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+
+
+def run_sweep(
+  trials: Sequence[Trial],
+  run_trial: Callable[[Trial], Mapping[str, float]],
+  *,
+  output_dir_path: str,
+  metric: str,
+  workers: Optional[int] = None,
+  threads_per_worker: int = 1
+) -> None:
+  '''
+  Run the trials in parallel by run_in_spawned_pool, then rank the trials by metric
+  (lower is better) into sweep.json in output_dir_path.
+  '''
+  trial_results = run_in_spawned_pool(run_trial, trials, workers=workers, threads_per_worker=threads_per_worker)
+
+  results: MutableSequence[Mapping[str, Any]] = []
+  for trial, trial_result in zip(trials, trial_results):
+    result: Mapping[str, Any] = {
+      'trial': trial.trial_index,
+      'params': trial.params,
+      'checkpointDir': trial.checkpoint_dir_path
+    }
+    if isinstance(trial_result, Exception):
+      result = { **result, 'error': str(trial_result) }
+    else:
+      result = { **result, 'metrics': trial_result }
+    results.append(result)
+
+  def sort_key(result: Mapping[str, Any]) -> float:
+    return result['metrics'][metric] if 'metrics' in result else float('inf')
+  ranked = sorted(results, key=sort_key)
+
+  output_dir_path_obj = Path(output_dir_path).resolve(strict=False)
+  output_dir_path_obj.mkdir(parents=True, exist_ok=True)
+  with open(str(output_dir_path_obj / 'sweep.json'), 'w') as file:
+    json.dump({ 'metric': metric, 'trials': ranked }, file, indent=2)
+
+  pprint([
+    (result['trial'], result['metrics'][metric] if 'metrics' in result else None, result['params'])
+    for result in ranked
+  ])
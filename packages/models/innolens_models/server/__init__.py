@@ -1,13 +1,19 @@
 from __future__ import annotations
 
 from argparse import ArgumentParser, Namespace
+from functools import partial
+import json
+from pprint import pprint
+import sys
+from typing import Mapping, Optional, Sequence, Tuple
 from typing_extensions import Final
 from pathlib import Path
 
 from ..cli import Cli
 
 
-checkpoints_path: Final = Path(__file__).parent.parent.parent / 'checkpoints'
+package_path: Final = Path(__file__).parent.parent.parent
+checkpoints_path: Final = package_path / 'checkpoints'
 
 class ServerCli(Cli):
   name: Final[str] = 'serve'
@@ -23,12 +29,130 @@ class ServerCli(Cli):
       help='The dir storing the access causality model checkpoints',
       default=str(checkpoints_path / 'access_causality')
     )
+    parser.add_argument(
+      '--backend',
+      choices=('auto', 'tensorflow', 'numpy'),
+      default='auto',
+      help='Serve the checkpoints with TensorFlow, or the model.npz written by the export actions with NumPy only, defaults to numpy if TensorFlow is not installed'
+    )
+    parser.add_argument(
+      '--xla',
+      action='store_true',
+      help='Compile the predict of the models with XLA, only for the tensorflow backend'
+    )
+    parser.add_argument(
+      '--max-batch-size',
+      type=int,
+      default=64,
+      help='Maximum number of rows forecast in one batch of concurrent requests, 0 to disable batching'
+    )
+    parser.add_argument(
+      '--max-batch-delay',
+      type=float,
+      default=2,
+      help='Milliseconds to wait for concurrent requests to batch with, 0 to disable batching'
+    )
+    parser.add_argument(
+      '--cpu-workers',
+      type=int,
+      default=2,
+      help='Number of processes running the clustering and correlation, 0 to run them on the request threads, defaults to 2'
+    )
+    parser.add_argument(
+      '--cpu-max-pending',
+      type=int,
+      default=8,
+      help='Maximum number of clustering and correlation requests queued or running before answering 503, defaults to 8'
+    )
+    parser.add_argument(
+      '--cpu-timeout',
+      type=float,
+      default=30,
+      help='Seconds before answering a clustering or correlation request 504, defaults to 30'
+    )
+    parser.add_argument(
+      '--job-workers',
+      type=int,
+      default=1,
+      help='Number of processes running the jobs, defaults to 1'
+    )
+    parser.add_argument(
+      '--max-jobs',
+      type=int,
+      default=16,
+      help='Maximum number of jobs queued or running in a server worker before answering 503, defaults to 16'
+    )
+    parser.add_argument(
+      '--job-ttl',
+      type=float,
+      default=3600,
+      help='Seconds to keep the result of a job after it finished, defaults to 3600'
+    )
+    parser.add_argument(
+      '--max-job-waiters',
+      type=int,
+      default=2,
+      help='Maximum number of job polls waiting for their job in a server worker before answering 503, defaults to 2'
+    )
+    parser.add_argument(
+      '--jobs-dir',
+      help='The dir storing the jobs, shared by the server workers, defaults to a dir in the temp dir'
+    )
+    parser.add_argument(
+      '--max-concurrency',
+      type=int,
+      default=8,
+      help='Maximum number of requests of a model endpoint run at a time, 0 to admit all, defaults to 8'
+    )
+    parser.add_argument(
+      '--max-queue',
+      type=int,
+      default=16,
+      help='Maximum number of requests of a model endpoint waiting to run before answering 503, defaults to 16'
+    )
+    parser.add_argument(
+      '--route-limit',
+      action='append',
+      default=[],
+      help='The max concurrency and queue of a model endpoint as ROUTE=CONCURRENCY:QUEUE, e.g. /cluster-members=2:4, can be repeated'
+    )
+    parser.add_argument(
+      '--request-timeout',
+      type=float,
+      help='Milliseconds before a request without the X-Request-Timeout-Ms header is dropped if its work has not started'
+    )
     parser.add_argument(
       '--port',
       type=int,
       default=5000,
       help='The port the server listens to'
     )
+    parser.add_argument(
+      '--workers',
+      type=int,
+      help='Serve with this many Gunicorn worker processes instead of the Flask development server'
+    )
+    parser.add_argument(
+      '--threads',
+      type=int,
+      default=4,
+      help='Number of request threads per worker, defaults to 4'
+    )
+    parser.add_argument(
+      '--keep-alive',
+      type=int,
+      default=5,
+      help='Seconds to keep an idle connection open for the next request, defaults to 5'
+    )
+    parser.add_argument(
+      '--allow-profiling',
+      action='store_true',
+      help='Profile the requests with the X-Profile header or the profile query parameter'
+    )
+    parser.add_argument(
+      '--profile-dir',
+      help='Also write the .prof of each profiled request into this dir, implies --allow-profiling'
+    )
     parser.add_argument(
       '--debug',
       action='store_true',
@@ -38,12 +162,286 @@ class ServerCli(Cli):
   def handle(self, args: Namespace) -> None:
     history_forecast_checkpoint_dir_path: str = args.history_forecast_checkpoint_dir
     access_causality_checkpoint_dir_path: str = args.access_causality_checkpoint_dir
+    backend: str = args.backend
+    xla: bool = args.xla
+    max_batch_size: int = args.max_batch_size
+    max_batch_delay_ms: float = args.max_batch_delay
+    cpu_workers: int = args.cpu_workers
+    cpu_max_pending: int = args.cpu_max_pending
+    cpu_timeout: float = args.cpu_timeout
+    job_workers: int = args.job_workers
+    max_jobs: int = args.max_jobs
+    job_ttl: float = args.job_ttl
+    max_job_waiters: int = args.max_job_waiters
+    jobs_dir_path: Optional[str] = args.jobs_dir
+    max_concurrency: int = args.max_concurrency
+    max_queue: int = args.max_queue
+    route_limit_strs: Sequence[str] = args.route_limit
+    request_timeout_ms: Optional[float] = args.request_timeout
     port: int = args.port
+    workers: Optional[int] = args.workers
+    threads: int = args.threads
+    keep_alive: int = args.keep_alive
+    allow_profiling: bool = args.allow_profiling
+    profile_dir_path: Optional[str] = args.profile_dir
     debug: bool = args.debug
 
-    from .app import create_app
-    app = create_app(
+    from .app import create_app, resolve_backend
+    backend = resolve_backend(backend)
+    create = partial(
+      create_app,
       history_forecast_chkpt_dir_path=history_forecast_checkpoint_dir_path,
-      access_causality_chkpt_dir_path=access_causality_checkpoint_dir_path
+      access_causality_chkpt_dir_path=access_causality_checkpoint_dir_path,
+      backend=backend,
+      xla=xla,
+      max_batch_size=max_batch_size,
+      max_batch_delay=max_batch_delay_ms / 1000,
+      profiling=allow_profiling or profile_dir_path is not None,
+      profile_dir_path=profile_dir_path,
+      cpu_workers=cpu_workers,
+      cpu_max_pending=cpu_max_pending,
+      cpu_timeout=cpu_timeout,
+      job_workers=job_workers,
+      max_jobs=max_jobs,
+      job_ttl=job_ttl,
+      max_job_waiters=max_job_waiters,
+      jobs_dir_path=jobs_dir_path,
+      max_concurrency=max_concurrency,
+      max_queue=max_queue,
+      route_limits=parse_route_limits(route_limit_strs),
+      default_timeout=None if request_timeout_ms is None else request_timeout_ms / 1000
+    )
+
+    if workers is None:
+      create().run(host='0.0.0.0', port=port, debug=debug)
+      return
+
+    from .wsgi import ServerApplication
+    # TensorFlow does not survive a fork, so its models are loaded by each worker
+    preload = backend == 'numpy'
+    ServerApplication(partial(create, load_in_background=not preload), options={
+      'bind': f'0.0.0.0:{port}',
+      'workers': workers,
+      'worker_class': 'gthread',
+      'threads': threads,
+      'keepalive': keep_alive,
+      'preload_app': preload,
+      'graceful_timeout': 30
+    }).run()
+
+def parse_route_limits(route_limit_strs: Sequence[str]) -> Mapping[str, Tuple[int, int]]:
+  route_limits = {}
+  for route_limit_str in route_limit_strs:
+    route, _, limit_str = route_limit_str.partition('=')
+    concurrency_str, _, queue_str = limit_str.partition(':')
+    route_limits[route] = (int(concurrency_str), int(queue_str))
+  return route_limits
+
+class ServerStartupBenchmarkCli(Cli):
+  name: Final[str] = 'bench-startup'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--history-forecast-checkpoint-dir',
+      help='The dir storing the history forecast model checkpoints',
+      default=str(checkpoints_path / 'history_forecast')
+    )
+    parser.add_argument(
+      '--access-causality-checkpoint-dir',
+      help='The dir storing the access causality model checkpoints',
+      default=str(checkpoints_path / 'access_causality')
+    )
+    parser.add_argument(
+      '--backend',
+      choices=('auto', 'tensorflow', 'numpy'),
+      default='auto',
+      help='The backend to start the server with, see serve'
+    )
+    parser.add_argument(
+      '--xla',
+      action='store_true',
+      help='Compile the predict of the models with XLA, only for the tensorflow backend'
+    )
+    parser.add_argument(
+      '--runs',
+      type=int,
+      default=3,
+      help='Number of cold starts to measure, defaults to 3'
+    )
+    parser.add_argument(
+      '--max-ready-sec',
+      type=float,
+      help='Fail if the median time until all models are ready is longer'
+    )
+    parser.add_argument(
+      '--max-rss-mb',
+      type=float,
+      help='Fail if the peak RSS of a start is larger'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    history_forecast_checkpoint_dir_path: str = args.history_forecast_checkpoint_dir
+    access_causality_checkpoint_dir_path: str = args.access_causality_checkpoint_dir
+    backend: str = args.backend
+    xla: bool = args.xla
+    runs: int = args.runs
+    max_ready_sec: Optional[float] = args.max_ready_sec
+    max_rss_mb: Optional[float] = args.max_rss_mb
+
+    from .startup_benchmark import benchmark_startup
+    report = benchmark_startup(
+      runs=runs,
+      max_ready_sec=max_ready_sec,
+      max_rss_mb=max_rss_mb,
+      history_forecast_chkpt_dir_path=history_forecast_checkpoint_dir_path,
+      access_causality_chkpt_dir_path=access_causality_checkpoint_dir_path,
+      backend=backend,
+      xla=xla
+    )
+    pprint(report)
+    if len(report['violations']) > 0:
+      sys.exit('\n'.join(report['violations']))
+
+class ServerBenchmarkCli(Cli):
+  name: Final[str] = 'bench-server'
+
+  def configure_parser(self, parser: ArgumentParser) -> None:
+    parser.add_argument(
+      '--url',
+      help='The server to send the requests to, e.g. http://localhost:5000, defaults to an app in this process'
+    )
+    parser.add_argument(
+      '--history-forecast-checkpoint-dir',
+      help='The dir storing the history forecast model checkpoints, for the app in this process',
+      default=str(checkpoints_path / 'history_forecast')
+    )
+    parser.add_argument(
+      '--access-causality-checkpoint-dir',
+      help='The dir storing the access causality model checkpoints, for the app in this process',
+      default=str(checkpoints_path / 'access_causality')
+    )
+    parser.add_argument(
+      '--backend',
+      choices=('auto', 'tensorflow', 'numpy'),
+      default='auto',
+      help='The backend of the app in this process, see serve'
+    )
+    parser.add_argument(
+      '--max-batch-size',
+      type=int,
+      default=64,
+      help='The max batch size of the app in this process, see serve'
+    )
+    parser.add_argument(
+      '--max-batch-delay',
+      type=float,
+      default=2,
+      help='The max batch delay in milliseconds of the app in this process, see serve'
+    )
+    parser.add_argument(
+      '--access-causality-data',
+      help='The access causality training data to build the requests from, e.g. a simulation result',
+      default=str(package_path / 'access_causality_sample_train.json')
+    )
+    parser.add_argument(
+      '--history-forecast-data',
+      help='The history forecast training data to build the requests from, e.g. a simulation result',
+      default=str(package_path / 'history_forecast_sample_train.json')
+    )
+    parser.add_argument(
+      '--forecast-input-size',
+      type=int,
+      default=24 * 2 * 14,
+      help='The number of time steps in a history of the history forecast model, defaults to 2 weeks of 30 minutes'
+    )
+    parser.add_argument(
+      '--forecast-rows',
+      type=int,
+      default=1,
+      help='The number of histories in a forecast request, defaults to 1'
+    )
+    parser.add_argument(
+      '--mix',
+      default='forecast=6,access-causality=2,cluster-members=1,correlate=1',
+      help='The weight of each endpoint, defaults to forecast=6,access-causality=2,cluster-members=1,correlate=1'
+    )
+    parser.add_argument(
+      '--concurrency',
+      type=int,
+      default=8,
+      help='Number of concurrent clients, defaults to 8'
+    )
+    parser.add_argument(
+      '--requests',
+      type=int,
+      default=1000,
+      help='Number of measured requests, defaults to 1000'
+    )
+    parser.add_argument(
+      '--warmup-requests',
+      type=int,
+      default=20,
+      help='Number of requests sent before measuring, defaults to 20'
+    )
+    parser.add_argument(
+      '--seed',
+      type=int,
+      default=0,
+      help='The seed of the requests'
+    )
+    parser.add_argument(
+      '--output',
+      help='Write the JSON report to this file instead of stdout'
+    )
+
+  def handle(self, args: Namespace) -> None:
+    url: Optional[str] = args.url
+    history_forecast_checkpoint_dir_path: str = args.history_forecast_checkpoint_dir
+    access_causality_checkpoint_dir_path: str = args.access_causality_checkpoint_dir
+    backend: str = args.backend
+    max_batch_size: int = args.max_batch_size
+    max_batch_delay_ms: float = args.max_batch_delay
+    access_causality_data_path: str = args.access_causality_data
+    history_forecast_data_path: str = args.history_forecast_data
+    forecast_input_size: int = args.forecast_input_size
+    forecast_rows: int = args.forecast_rows
+    mix_str: str = args.mix
+    concurrency: int = args.concurrency
+    requests: int = args.requests
+    warmup_requests: int = args.warmup_requests
+    seed: int = args.seed
+    output_path: Optional[str] = args.output
+
+    from .server_benchmark import benchmark_server, http_client, in_process_client, parse_mix
+    if url is not None:
+      create_client = http_client(url)
+    else:
+      from .app import create_app
+      create_client = in_process_client(create_app(
+        history_forecast_chkpt_dir_path=history_forecast_checkpoint_dir_path,
+        access_causality_chkpt_dir_path=access_causality_checkpoint_dir_path,
+        backend=backend,
+        max_batch_size=max_batch_size,
+        max_batch_delay=max_batch_delay_ms / 1000,
+        load_in_background=False
+      ))
+
+    report = benchmark_server(
+      create_client=create_client,
+      mix=parse_mix(mix_str),
+      concurrency=concurrency,
+      requests=requests,
+      warmup_requests=warmup_requests,
+      seed=seed,
+      access_causality_data_path=access_causality_data_path,
+      history_forecast_data_path=history_forecast_data_path,
+      forecast_input_size=forecast_input_size,
+      forecast_rows=forecast_rows
     )
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    report = { **report, 'target': url if url is not None else f'in-process ({backend})' }
+    report_str = json.dumps(report, indent=2)
+    if output_path is None:
+      print(report_str)
+    else:
+      with open(output_path, 'w') as file:
+        file.write(report_str)
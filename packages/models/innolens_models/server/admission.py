@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from typing import Optional
+from typing_extensions import Final
+
+from werkzeug.exceptions import GatewayTimeout, ServiceUnavailable
+
+
+class DeadlineExceeded(GatewayTimeout):
+  '''
+  The deadline of a request expired before its work started, so it is dropped.
+  '''
+
+
+class Overloaded(ServiceUnavailable):
+  '''
+  A request rejected as too many are waiting, with the seconds to retry after.
+  '''
+
+  # Not retry_after, which newer Werkzeug versions declare as Optional
+  retry_after_sec: Final[int]
+
+  def __init__(self, description: str, *, retry_after: int):
+    super().__init__(description)
+    self.retry_after_sec = retry_after
+
+
+def check_deadline(deadline: Optional[float], what: str = 'the work started') -> None:
+  '''
+  Raise DeadlineExceeded if the time.monotonic deadline has passed.
+  '''
+  if deadline is not None and time.monotonic() >= deadline:
+    raise DeadlineExceeded(f'The deadline expired before {what}')
+
+
+class RouteLimiter:
+  '''
+  Admit at most max_concurrency requests of a route at a time, and queue at most
+  max_queue more. Requests beyond that are rejected as Overloaded right away, with
+  a Retry-After estimated from the mean time of the recent requests, rather than
+  waiting and timing out. A queued request whose deadline expires is dropped
+  before it starts.
+  '''
+
+  name: Final[str]
+  __max_concurrency: Final[int]
+  __max_queue: Final[int]
+  __condition: Final[threading.Condition]
+  __running: int
+  __waiting: int
+  __mean_sec: Optional[float]
+
+  def __init__(self, *, max_concurrency: int, max_queue: int, name: str):
+    super().__init__()
+    self.name = name
+    self.__max_concurrency = max_concurrency
+    self.__max_queue = max_queue
+    self.__condition = threading.Condition()
+    self.__running = 0
+    self.__waiting = 0
+    self.__mean_sec = None
+
+  @property
+  def queue_depth(self) -> int:
+    return self.__waiting
+
+  def acquire(self, deadline: Optional[float] = None) -> None:
+    with self.__condition:
+      if self.__running < self.__max_concurrency and self.__waiting == 0:
+        self.__running += 1
+        return
+      if self.__waiting >= self.__max_queue:
+        raise Overloaded(f'Too many requests are waiting for {self.name}', retry_after=self.__retry_after())
+
+      self.__waiting += 1
+      try:
+        while self.__running >= self.__max_concurrency:
+          if deadline is None:
+            self.__condition.wait()
+            continue
+          timeout = deadline - time.monotonic()
+          if timeout <= 0:
+            raise DeadlineExceeded(f'The deadline expired while waiting for {self.name}')
+          self.__condition.wait(timeout)
+        self.__running += 1
+      finally:
+        self.__waiting -= 1
+
+  def release(self, duration: float) -> None:
+    with self.__condition:
+      self.__running -= 1
+      # Exponential moving average of the recent requests
+      self.__mean_sec = duration if self.__mean_sec is None else 0.9 * self.__mean_sec + 0.1 * duration
+      self.__condition.notify()
+
+  def __retry_after(self) -> int:
+    # The time for the queue to drain, at least a second
+    mean_sec = self.__mean_sec if self.__mean_sec is not None else 1.0
+    return max(1, math.ceil((self.__waiting + 1) * mean_sec / self.__max_concurrency))
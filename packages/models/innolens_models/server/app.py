@@ -1,30 +1,363 @@
 from __future__ import annotations
 
+from contextlib import nullcontext
+import importlib.util
+from functools import partial
+import json
 import logging
-from typing import Any
+import re
+import time
+from typing import Any, Callable, ContextManager, Mapping, MutableMapping, MutableSequence, Optional, Sequence, Tuple, Union
+from typing_extensions import Final
+from pathlib import Path
 
-from flask import Flask, request
-from werkzeug.exceptions import HTTPException, BadRequest
+from flask import Flask, Response, g, request
+from werkzeug.exceptions import HTTPException, BadRequest, NotFound
 import numpy as np
 
 from ..models.correlation.model import CorrelationModel
 from ..models.member_cluster.model import MemberClusterModel
-from ..models.history_forecast.model import HistoryForecastModel
-from ..models.access_causality.model import AccessCausalityModel, MissingFeautureException, UnknownFeautureException
+from ..models.history_forecast.inference import HistoryForecastModelGroup, HistoryForecastNumpyModel, UnknownGroupException
+from ..models.access_causality.inference import AccessCausalityNumpyModel, MissingFeautureException, UnknownFeautureException
+from .admission import DeadlineExceeded, Overloaded, RouteLimiter, check_deadline
+from .batcher import MicroBatcher
+from .encoding import decode_request, encode_response, to_builtin
+from .executors import ProcessPool
+from .jobs import JobManager, default_jobs_dir_path
+from .loading import LoadingModel
+from .metrics import ServerMetrics
+from .profiling import RequestProfile
 
 
+def resolve_backend(backend: str) -> str:
+  if backend == 'auto':
+    return 'tensorflow' if importlib.util.find_spec('tensorflow') is not None else 'numpy'
+  return backend
+
+def run_cluster_members_job(data: Any, progress: Callable[[float], None]) -> Any:
+  model = MemberClusterModel()
+  X = model.matrix_from_json(data)
+  Z = model.cluster(X, progress=progress)
+  return to_builtin(model.clusters_to_json(data, Z)['data'])
+
+max_job_wait_sec: Final = 30
+
+# The routes doing model work, which are admitted by the route limiters
+limited_routes: Final[Sequence[str]] = (
+  '/correlate',
+  '/cluster-members',
+  '/forecast',
+  '/access-causality',
+  '/jobs/<kind>'
+)
+
+# The kinds of jobs, run in the job worker processes
+job_fns: Final[Mapping[str, Callable[[Any, Callable[[float], None]], Any]]] = {
+  'cluster-members': run_cluster_members_job
+}
+
 def create_app(
   *,
   history_forecast_chkpt_dir_path: str,
-  access_causality_chkpt_dir_path: str
+  access_causality_chkpt_dir_path: str,
+  backend: str = 'auto',
+  xla: bool = False,
+  max_batch_size: int = 64,
+  max_batch_delay: float = 0.002,
+  load_in_background: bool = True,
+  profiling: bool = False,
+  profile_dir_path: Optional[str] = None,
+  cpu_workers: int = 2,
+  cpu_max_pending: int = 8,
+  cpu_timeout: float = 30,
+  job_workers: int = 1,
+  max_jobs: int = 16,
+  job_ttl: float = 3600,
+  max_job_waiters: int = 2,
+  jobs_dir_path: Optional[str] = None,
+  max_concurrency: int = 8,
+  max_queue: int = 16,
+  route_limits: Optional[Mapping[str, Tuple[int, int]]] = None,
+  default_timeout: Optional[float] = None
 ) -> Flask:
+  '''
+  backend is either "tensorflow", which loads the checkpoints, "numpy", which
+  loads the model.npz written by the export action into each checkpoint dir, or
+  "auto", which picks numpy if TensorFlow is not installed. With the tensorflow
+  backend, the predict of each model is traced and warmed up before serving, and
+  compiled with XLA if xla is set.
+
+  The POST endpoints also take and return MessagePack and .npy, see encoding.
+
+  Concurrent /forecast and /access-causality requests are batched into one
+  forward pass for up to max_batch_delay seconds, or until max_batch_size rows
+  are collected. Batching is off if either is 0.
+
+  The CPU heavy /cluster-members and /correlate run in a pool of cpu_workers
+  processes, so they do not stall the inference by holding the GIL. At most
+  cpu_max_pending of them are queued or running, and more are answered 503. They
+  are answered 504 if not done in cpu_timeout seconds. They run on the request
+  thread if cpu_workers is 0.
+
+  Longer analytics are submitted as jobs by POST /jobs/<kind>, and polled by GET
+  /jobs/<id>, see JobManager. The jobs run in a pool of job_workers processes,
+  apart from the CPU pool. At most max_job_waiters polls wait for their job at a
+  time, as each holds a request thread, and more are answered 503 with Retry-After.
+
+  Each of the limited_routes runs at most max_concurrency requests at a time, and
+  queues at most max_queue more, or the (max_concurrency, max_queue) in
+  route_limits of the route. Further requests are answered 503 with Retry-After
+  right away. Limits of 0 concurrency turn admission off. A request may set its
+  deadline by the X-Request-Timeout-Ms header, otherwise it is default_timeout
+  seconds if given. A request whose deadline expires before its work starts is
+  answered 504 and its work is dropped.
+
+  /metrics exposes the request, codec and inference metrics in the Prometheus text
+  format.
+
+  The models load in parallel on background threads unless load_in_background is
+  unset, and /ready answers 200 once all of them are loaded.
+
+  If profiling is set, a request with the X-Profile header or the profile query
+  parameter is run alone under cProfile. The time of each phase is returned in the
+  Server-Timing header, and a JSON response also gets the phases and the top
+  functions in its profile field. The .prof of each such request is written into
+  profile_dir_path if given.
+  '''
   app = Flask(__name__)
   logger = logging.getLogger(__name__)
 
+  backend = resolve_backend(backend)
+  logger.info(f'Serve the models with the {backend} backend')
+
+  load_history_forecast_model: Callable[[str], Any]
+  load_access_causality_model: Callable[[str], Any]
+  if backend == 'numpy':
+    load_history_forecast_model = lambda path: HistoryForecastNumpyModel(export_path=str(Path(path) / 'model.npz'))
+    load_access_causality_model = lambda path: AccessCausalityNumpyModel(export_path=str(Path(path) / 'model.npz'))
+  elif backend == 'tensorflow':
+    # TensorFlow is imported by the loader threads
+    def load_history_forecast_model(path: str) -> Any:
+      from ..models.history_forecast.model import HistoryForecastModel
+      model = HistoryForecastModel(checkpoint_dir_path=path)
+      model.compile_predict(xla=xla)
+      return model
+
+    def load_access_causality_model(path: str) -> Any:
+      from ..models.access_causality.model import AccessCausalityModel
+      model = AccessCausalityModel(checkpoint_dir_path=path)
+      model.compile_predict(xla=xla)
+      return model
+  else:
+    raise ValueError(f'Unknown backend: {backend}')
+
   correlation_model = CorrelationModel()
   member_cluster_model = MemberClusterModel()
-  history_forecast_model = HistoryForecastModel(checkpoint_dir_path=history_forecast_chkpt_dir_path)
-  access_causality_model = AccessCausalityModel(checkpoint_dir_path=access_causality_chkpt_dir_path)
+  is_group_dir = HistoryForecastModelGroup.is_group_dir(history_forecast_chkpt_dir_path)
+  history_forecast_model = LoadingModel(
+    (
+      partial(
+        HistoryForecastModelGroup,
+        checkpoint_dir_path=history_forecast_chkpt_dir_path,
+        load_model=load_history_forecast_model
+      )
+      if is_group_dir
+      else partial(load_history_forecast_model, history_forecast_chkpt_dir_path)
+    ),
+    name='historyForecast',
+    background=load_in_background
+  )
+  access_causality_model = LoadingModel(
+    partial(load_access_causality_model, access_causality_chkpt_dir_path),
+    name='accessCausality',
+    background=load_in_background
+  )
+  loading_models = (history_forecast_model, access_causality_model)
+
+  metrics = ServerMetrics()
+
+  cpu_pool: Optional[ProcessPool] = None
+  if cpu_workers > 0:
+    pool = ProcessPool(workers=cpu_workers, max_pending=cpu_max_pending, timeout=cpu_timeout, name='cpu')
+    metrics.add_queue_depth('cpu', lambda: pool.queue_depth)
+    cpu_pool = pool
+
+  job_manager = JobManager(
+    dir_path=jobs_dir_path if jobs_dir_path is not None else default_jobs_dir_path,
+    workers=job_workers,
+    max_jobs=max_jobs,
+    ttl=job_ttl,
+    max_waiters=max_job_waiters
+  )
+  metrics.add_queue_depth('jobs', lambda: job_manager.queue_depth)
+
+  def run_forecast_batch(batch: Sequence[Tuple[np.ndarray, Optional[Sequence[str]]]]) -> Sequence[np.ndarray]:
+    X = np.concatenate([X for X, _ in batch])
+    model = history_forecast_model.get()
+    start_time = time.perf_counter()
+    if is_group_dir:
+      groups: MutableSequence[str] = []
+      for _, item_groups in batch:
+        assert item_groups is not None
+        groups.extend(item_groups)
+      Z = model.predict(X, groups)
+    else:
+      Z = model.predict(X)
+    metrics.observe_inference('historyForecast', time.perf_counter() - start_time, len(X))
+    return np.split(Z, np.cumsum([len(X) for X, _ in batch])[:-1])
+
+  def run_access_causality_batch(batch: Sequence[np.ndarray]) -> Sequence[np.ndarray]:
+    model = access_causality_model.get()
+    start_time = time.perf_counter()
+    Z = model.predict_matrix(np.stack(batch))
+    metrics.observe_inference('accessCausality', time.perf_counter() - start_time, len(batch))
+    return list(Z)
+
+  def watch_queue_depth(name: str, queued: Union[RouteLimiter, MicroBatcher[Any, Any]]) -> None:
+    metrics.add_queue_depth(name, lambda: queued.queue_depth)
+
+  unknown_routes = set(route_limits or {}) - set(limited_routes)
+  if len(unknown_routes) > 0:
+    raise ValueError(f'No limits for the routes: {", ".join(unknown_routes)}')
+  route_limiters: MutableMapping[str, RouteLimiter] = {}
+  for route in limited_routes:
+    route_max_concurrency, route_max_queue = (route_limits or {}).get(route, (max_concurrency, max_queue))
+    if route_max_concurrency > 0:
+      limiter = RouteLimiter(max_concurrency=route_max_concurrency, max_queue=route_max_queue, name=route)
+      route_limiters[route] = limiter
+      watch_queue_depth(f'route:{route}', limiter)
+
+  def read_deadline() -> Optional[float]:
+    timeout_ms_str = request.headers.get('X-Request-Timeout-Ms')
+    if timeout_ms_str is not None:
+      try:
+        return time.monotonic() + float(timeout_ms_str) / 1000
+      except ValueError:
+        raise BadRequest(f'Invalid X-Request-Timeout-Ms: {timeout_ms_str}')
+    if default_timeout is not None:
+      return time.monotonic() + default_timeout
+    return None
+
+  def is_profiling() -> bool:
+    return 'profile' in g
+
+  def phase(name: str) -> ContextManager[None]:
+    return g.profile.phase(name) if is_profiling() else nullcontext()
+
+  forecast_batcher: Optional[MicroBatcher[Tuple[np.ndarray, Optional[Sequence[str]]], np.ndarray]] = None
+  access_causality_batcher: Optional[MicroBatcher[np.ndarray, np.ndarray]] = None
+  if max_batch_size > 0 and max_batch_delay > 0:
+    forecast_batcher = MicroBatcher(
+      run_forecast_batch,
+      item_size=lambda item: len(item[0]),
+      max_batch_size=max_batch_size,
+      max_delay=max_batch_delay,
+      name='forecast-batcher'
+    )
+    access_causality_batcher = MicroBatcher(
+      run_access_causality_batch,
+      max_batch_size=max_batch_size,
+      max_delay=max_batch_delay,
+      name='access-causality-batcher'
+    )
+    watch_queue_depth(forecast_batcher.name, forecast_batcher)
+    watch_queue_depth(access_causality_batcher.name, access_causality_batcher)
+
+  def forecast(item: Tuple[np.ndarray, Optional[Sequence[str]]]) -> np.ndarray:
+    # The batches run on the batcher thread, out of sight of the profiler
+    if forecast_batcher is None or is_profiling():
+      check_deadline(g.deadline)
+      return run_forecast_batch([item])[0]
+    return forecast_batcher(item, deadline=g.deadline)
+
+  def access_causality(item: np.ndarray) -> np.ndarray:
+    if access_causality_batcher is None or is_profiling():
+      check_deadline(g.deadline)
+      return run_access_causality_batch([item])[0]
+    return access_causality_batcher(item, deadline=g.deadline)
+
+  def run_cpu(fn: Callable[..., Any], *args: Any) -> Any:
+    # The pool is out of sight of the profiler too
+    if cpu_pool is None or is_profiling():
+      check_deadline(g.deadline)
+      return fn(*args)
+    return cpu_pool(fn, *args, deadline=g.deadline)
+
+  def route_label() -> str:
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+  def decode(**kwargs: Any) -> Any:
+    start_time = time.perf_counter()
+    with phase('decode'):
+      data = decode_request(**kwargs)
+    metrics.observe_codec(g.route, 'decode', time.perf_counter() - start_time)
+    return data
+
+  def encode(data: Any, **kwargs: Any) -> Response:
+    start_time = time.perf_counter()
+    with phase('encode'):
+      response = encode_response(data, **kwargs)
+    metrics.observe_codec(g.route, 'encode', time.perf_counter() - start_time)
+    return response
+
+  @app.before_request
+  def start_request() -> None:
+    g.start_time = time.perf_counter()
+    g.route = route_label()
+    metrics.start_request(g.route)
+    g.deadline = read_deadline()
+
+    limiter = route_limiters.get(g.route)
+    if limiter is not None and request.method == 'POST':
+      limiter.acquire(g.deadline)
+      g.limiter = limiter
+    check_deadline(g.deadline, 'the request was admitted')
+
+    if profiling and ('X-Profile' in request.headers or 'profile' in request.args):
+      g.profile = RequestProfile()
+      g.profile.start()
+
+  @app.after_request
+  def finish_request(response: Response) -> Response:
+    if is_profiling():
+      finish_profile(response)
+    metrics.finish_request(
+      g.route,
+      request.method,
+      response.status_code,
+      time.perf_counter() - g.start_time,
+      request.content_length or 0,
+      response.content_length
+    )
+    return response
+
+  @app.teardown_request
+  def teardown_request(err: Optional[BaseException]) -> None:
+    if 'limiter' in g:
+      g.limiter.release(time.perf_counter() - g.start_time)
+
+  def finish_profile(response: Response) -> None:
+    profile: RequestProfile = g.profile
+    profile.stop()
+    response.headers['Server-Timing'] = profile.server_timing()
+
+    profile_json = {
+      'phases': profile.phase_secs(),
+      'functions': profile.top_functions()
+    }
+    if profile_dir_path is not None:
+      route_slug = re.sub(r'[^a-zA-Z0-9]+', '-', g.route).strip('-')
+      profile_path = Path(profile_dir_path) / f'{int(time.time() * 1000)}-{route_slug}.prof'
+      profile_path.parent.mkdir(parents=True, exist_ok=True)
+      profile.dump(str(profile_path))
+      response.headers['X-Profile-File'] = str(profile_path)
+      profile_json['file'] = str(profile_path)
+
+    if response.is_json:
+      body = response.get_json()
+      if isinstance(body, dict):
+        body['profile'] = profile_json
+        response.set_data(json.dumps(body))
 
   @app.errorhandler(Exception)
   def handle_exception(err: Exception) -> Any:
@@ -40,7 +373,12 @@ def create_app(
     if code is None:
       code = 500
 
-    if 500 <= code < 600:
+    headers = {}
+    if isinstance(err, Overloaded):
+      headers['Retry-After'] = str(err.retry_after_sec)
+
+    # Shedding load is expected under a burst, so it is not logged
+    if 500 <= code < 600 and not isinstance(err, (Overloaded, DeadlineExceeded)):
       logger.error('App encountered exception', exc_info=err)
 
     return (
@@ -49,45 +387,95 @@ def create_app(
         'name': name,
         'description': description
       },
-      code
+      code,
+      headers
     )
 
   @app.route('/')
   def get_index() -> str:
     return 'InnoLens Python Server'
 
+  @app.route('/metrics')
+  def get_metrics() -> Any:
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+  @app.route('/ready')
+  def get_ready() -> Any:
+    '''
+    response body type:
+    {
+      data: {
+        [model: string]: {
+          status: 'loading' | 'ready' | 'failed'
+          loadSec?: number
+          error?: string
+        }
+      }
+    }
+    '''
+    return (
+      {
+        'data': {
+          model.name: model.status()
+          for model in loading_models
+        }
+      },
+      200 if all(model.ready for model in loading_models) else 503
+    )
+
   @app.route('/correlate', methods=('POST',))
   def post_correlation() -> Any:
-    data = request.json
+    # A .npy body stacks the two histories
+    data = decode(npy=lambda arr: arr)
 
-    X = np.array(data[0])
-    Y = np.array(data[1])
+    with phase('arrays'):
+      X = np.asarray(data[0])
+      Y = np.asarray(data[1])
 
-    Z = correlation_model.correlate(X, Y, show_ui='ui' in request.args)
+    with phase('model'):
+      if 'ui' in request.args:
+        Z = correlation_model.correlate(X, Y, show_ui=True)
+      else:
+        Z = run_cpu(correlation_model.correlate, X, Y)
 
-    return {
-      'data': Z
-    }
+    return encode(Z)
 
   @app.route('/cluster-members', methods=('POST',))
   def post_cluster() -> Any:
-    data = request.json
-    return member_cluster_model.cluster_json(data)
+    data = decode()
+    with phase('arrays'):
+      X = member_cluster_model.matrix_from_json(data)
+    with phase('model'):
+      Z = run_cpu(member_cluster_model.cluster, X)
+    with phase('arrays'):
+      result = member_cluster_model.clusters_to_json(data, Z)['data']
+    return encode(result)
 
   @app.route('/forecast', methods=('POST',))
   def post_forecast() -> Any:
-    data = request.json
+    # A .npy body holds the values, with the groups in the query string
+    data = decode(npy=lambda arr: { 'values': arr, 'groups': request.args.getlist('groups') })
 
-    X = np.array(data['values'])
+    with phase('arrays'):
+      X = np.asarray(data['values'])
+    if X.ndim != 2 or len(X) == 0:
+      raise BadRequest('values must hold at least one row of history')
 
-    Z = history_forecast_model.predict(X)
+    groups: Optional[Sequence[str]] = None
+    if is_group_dir:
+      # The per group models need the group of each row
+      if 'groups' not in data or len(data['groups']) != len(X):
+        raise BadRequest('groups of each row is required by the per group history forecast models')
+      groups = data['groups']
+      # Checked before batching, as an unknown group would fail the whole batch
+      try:
+        history_forecast_model.get().check_groups(groups)
+      except UnknownGroupException as err:
+        raise BadRequest(str(err))
+    with phase('model'):
+      Z = forecast((X, groups))
 
-    return {
-      'data': [
-        z.tolist()
-        for z in Z
-      ]
-    }
+    return encode(Z, npy=True)
 
 
   @app.route('/access-causality/settings')
@@ -103,12 +491,13 @@ def create_app(
       }
     }
     '''
+    model = access_causality_model.get()
     return {
       'data': {
-        'features': access_causality_model.features,
-        'historyWindowSize': access_causality_model.history_window_size,
-        'forecastWindowSize': access_causality_model.forecast_window_size,
-        'timeStepMs': access_causality_model.time_step_ms
+        'features': model.features,
+        'historyWindowSize': model.history_window_size,
+        'forecastWindowSize': model.forecast_window_size,
+        'timeStepMs': model.time_step_ms
       }
     }
 
@@ -129,15 +518,56 @@ def create_app(
       }
     }
     '''
-    data_json = request.json
+    data_json = decode()
 
+    model = access_causality_model.get()
     try:
-      result = access_causality_model.predict_json(data_json)
+      with phase('arrays'):
+        history_matrix = model.matrix_from_json(data_json)
     except (MissingFeautureException, UnknownFeautureException) as err:
       raise BadRequest(str(err))
+    with phase('model'):
+      forecast_matrix = access_causality(history_matrix)
+    with phase('arrays'):
+      result = model.matrix_to_json(data_json, forecast_matrix)
 
-    return {
-      'data': result
+    return encode(result)
+
+  @app.route('/jobs/<kind>', methods=('POST',))
+  def post_job(kind: str) -> Any:
+    '''
+    request body type: the request body of the endpoint of the kind, e.g. /cluster-members
+
+    response body type:
+    {
+      data: {
+        id: string
+        kind: string
+        status: 'queued' | 'running' | 'done' | 'failed'
+        progress: number
+        result?: the response data of the endpoint of the kind
+        error?: string
+        updatedTime: number
+      }
     }
+    '''
+    if kind not in job_fns:
+      raise NotFound(f'Unknown job kind: {kind}')
+    data = to_builtin(decode())
+    job = job_manager.submit(kind, job_fns[kind], data)
+    response = encode(job)
+    # A job with the same input may be done already
+    response.status_code = 200 if job['status'] == 'done' else 202
+    response.headers['Location'] = f'/jobs/{job["id"]}'
+    return response
+
+  @app.route('/jobs/<job_id>')
+  def get_job(job_id: str) -> Any:
+    '''
+    Long-poll with the wait query parameter, in seconds up to 30, to wait for the
+    job to finish. The response body type is the same as POST /jobs/<kind>.
+    '''
+    wait = min(request.args.get('wait', 0.0, type=float), max_job_wait_sec)
+    return encode(job_manager.get(job_id, wait=wait))
 
   return app
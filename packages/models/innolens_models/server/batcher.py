@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, TimeoutError
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Generic, MutableSequence, Optional, Sequence, Tuple, TypeVar
+from typing_extensions import Final
+
+from .admission import DeadlineExceeded
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class MicroBatcher(Generic[T, R]):
+  '''
+  Collect the items submitted by concurrent requests for up to max_delay seconds,
+  or until their total size reaches max_batch_size, and run them through run_batch
+  in one call on a worker thread. run_batch returns one result per item. If a batch
+  fails, its items are retried one by one so a bad request only fails itself. Items
+  whose time.monotonic deadline has passed are dropped from the batch.
+
+  The worker thread starts on the first submit of each process, as threads do not
+  survive the fork of a preloaded app into the server workers.
+  '''
+
+  name: Final[str]
+  # Not Final, which cannot depend on the type variables
+  __run_batch: Callable[[Sequence[T]], Sequence[R]]
+  __item_size: Callable[[T], int]
+  __max_batch_size: Final[int]
+  __max_delay: Final[float]
+  __start_lock: Final[threading.Lock]
+  __queue: queue.Queue[Tuple[T, Future[R], Optional[float]]]
+  __pid: Optional[int]
+
+  def __init__(
+    self,
+    run_batch: Callable[[Sequence[T]], Sequence[R]],
+    *,
+    item_size: Callable[[T], int] = lambda item: 1,
+    max_batch_size: int = 64,
+    max_delay: float = 0.002,
+    name: str = 'batcher'
+  ):
+    super().__init__()
+    self.__run_batch = run_batch
+    self.__item_size = item_size
+    self.__max_batch_size = max_batch_size
+    self.__max_delay = max_delay
+    self.name = name
+    self.__start_lock = threading.Lock()
+    self.__queue = queue.Queue()
+    self.__pid = None
+
+  def submit(self, item: T, *, deadline: Optional[float] = None) -> Future[R]:
+    if self.__pid != os.getpid():
+      self.__start()
+    future: Future[R] = Future()
+    self.__queue.put((item, future, deadline))
+    return future
+
+  def __call__(self, item: T, *, deadline: Optional[float] = None) -> R:
+    future = self.submit(item, deadline=deadline)
+    try:
+      return future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+    except TimeoutError:
+      future.cancel()
+      raise DeadlineExceeded('The deadline expired while waiting for the batch')
+
+  @property
+  def queue_depth(self) -> int:
+    '''
+    The number of items waiting for the next batch.
+    '''
+    return self.__queue.qsize()
+
+  def __start(self) -> None:
+    with self.__start_lock:
+      if self.__pid == os.getpid():
+        return
+      self.__queue = queue.Queue()
+      threading.Thread(target=self.__loop, args=(self.__queue,), name=self.name, daemon=True).start()
+      self.__pid = os.getpid()
+
+  def __loop(self, requests: queue.Queue[Tuple[T, Future[R], Optional[float]]]) -> None:
+    while True:
+      entries: MutableSequence[Tuple[T, Future[R], Optional[float]]] = [requests.get()]
+      size = self.__item_size(entries[0][0])
+      deadline = time.monotonic() + self.__max_delay
+      while size < self.__max_batch_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+          break
+        try:
+          entry = requests.get(timeout=timeout)
+        except queue.Empty:
+          break
+        entries.append(entry)
+        size += self.__item_size(entry[0])
+
+      now = time.monotonic()
+      batch: MutableSequence[Tuple[T, Future[R]]] = []
+      for item, future, item_deadline in entries:
+        if not future.set_running_or_notify_cancel():
+          continue
+        if item_deadline is not None and item_deadline <= now:
+          future.set_exception(DeadlineExceeded('The deadline expired before the batch started'))
+          continue
+        batch.append((item, future))
+      if len(batch) > 0:
+        self.__run(batch)
+
+  def __run(self, batch: Sequence[Tuple[T, Future[R]]]) -> None:
+    try:
+      results = self.__run_batch([item for item, _ in batch])
+      assert len(results) == len(batch)
+    except Exception as err:
+      if len(batch) == 1:
+        batch[0][1].set_exception(err)
+        return
+      logging.getLogger(__name__).warning(f'Batch of {len(batch)} failed, retrying one by one', exc_info=err)
+      for entry in batch:
+        self.__run([entry])
+      return
+    for (_, future), result in zip(batch, results):
+      future.set_result(result)
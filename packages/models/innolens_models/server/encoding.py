@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import io
+import json
+from typing import Any, Callable, MutableSequence, Optional
+from typing_extensions import Final
+
+from flask import Response, request
+from werkzeug.exceptions import BadRequest, UnsupportedMediaType
+import numpy as np
+
+
+json_type: Final = 'application/json'
+msgpack_type: Final = 'application/msgpack'
+npy_type: Final = 'application/x-npy'
+
+
+def decode_request(*, npy: Optional[Callable[[np.ndarray], Any]] = None) -> Any:
+  '''
+  Decode the request body by its Content-Type. JSON is the default. In MessagePack,
+  arrays may be sent as maps of dtype (e.g. "<f8"), shape and the raw little-endian
+  data, which are decoded into ndarrays without parsing each number. A .npy body is
+  a single array, turned into the request by npy, and is unsupported if npy is None.
+  '''
+  content_type = request.mimetype
+  if content_type in ('', json_type):
+    return request.get_json(force=True)
+  if content_type in (msgpack_type, 'application/x-msgpack'):
+    msgpack = import_msgpack()
+    try:
+      return msgpack.unpackb(request.get_data(), object_hook=decode_array, raw=False)
+    except ValueError as err:
+      raise BadRequest(f'Invalid MessagePack body: {err}')
+  if content_type == npy_type and npy is not None:
+    try:
+      arr = np.load(io.BytesIO(request.get_data()), allow_pickle=False)
+    except (ValueError, EOFError) as err:
+      raise BadRequest(f'Invalid .npy body: {err}')
+    return npy(arr)
+  raise UnsupportedMediaType(f'Unsupported Content-Type: {content_type}')
+
+def encode_response(data: Any, *, npy: bool = False) -> Response:
+  '''
+  Encode { data } in the type preferred by the Accept header, JSON by default. With
+  npy, an ndarray data may also be returned alone as a .npy.
+  '''
+  offered: MutableSequence[str] = [json_type, msgpack_type]
+  if npy and isinstance(data, np.ndarray):
+    offered.append(npy_type)
+  content_type = request.accept_mimetypes.best_match(offered, default=json_type)
+
+  if content_type == msgpack_type:
+    msgpack = import_msgpack()
+    return Response(msgpack.packb({ 'data': data }, default=encode_array), mimetype=msgpack_type)
+  if content_type == npy_type:
+    buffer = io.BytesIO()
+    np.save(buffer, data, allow_pickle=False)
+    return Response(buffer.getvalue(), mimetype=npy_type)
+  return Response(json.dumps({ 'data': to_builtin(data) }), mimetype=json_type)
+
+
+def import_msgpack() -> Any:
+  try:
+    import msgpack
+  except ImportError:
+    raise UnsupportedMediaType('MessagePack is not supported, msgpack is not installed')
+  return msgpack
+
+def decode_array(obj: Any) -> Any:
+  if obj.keys() == { 'dtype', 'shape', 'data' } and isinstance(obj['data'], bytes):
+    try:
+      return np.frombuffer(obj['data'], dtype=np.dtype(obj['dtype'])).reshape(obj['shape'])
+    except (TypeError, ValueError) as err:
+      raise BadRequest(f'Invalid array: {err}')
+  return obj
+
+def encode_array(obj: Any) -> Any:
+  if isinstance(obj, np.ndarray):
+    arr = np.ascontiguousarray(obj, dtype=obj.dtype.newbyteorder('<'))
+    return { 'dtype': arr.dtype.str, 'shape': list(arr.shape), 'data': arr.tobytes() }
+  if isinstance(obj, np.generic):
+    return obj.item()
+  raise TypeError(f'Cannot encode {type(obj).__name__}')
+
+def to_builtin(obj: Any) -> Any:
+  if isinstance(obj, (np.ndarray, np.generic)):
+    return obj.tolist()
+  if isinstance(obj, dict):
+    return { key: to_builtin(value) for key, value in obj.items() }
+  if isinstance(obj, (list, tuple)):
+    return [to_builtin(value) for value in obj]
+  return obj
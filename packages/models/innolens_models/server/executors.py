@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+from typing_extensions import Final
+
+from werkzeug.exceptions import GatewayTimeout, InternalServerError
+
+from .admission import DeadlineExceeded, Overloaded, check_deadline
+
+
+class ProcessPool:
+  '''
+  Run the CPU heavy work of requests in worker processes, so it does not hold the
+  GIL of the request and inference threads. At most max_pending calls are queued or
+  running, and more are answered 503. A call not done in timeout seconds is
+  answered 504, though a call already running is not interrupted and keeps its
+  worker until it is done. A call is also answered 504 at its time.monotonic
+  deadline, and dropped if it has not started by then.
+
+  The pool starts on the first call of each process, as it does not survive the
+  fork of a preloaded app into the server workers. The workers are spawned, as
+  TensorFlow does not survive a fork either.
+  '''
+
+  name: Final[str]
+  __workers: Final[int]
+  __max_pending: Final[int]
+  __timeout: Final[float]
+  __lock: Final[threading.Lock]
+  __executor: Optional[ProcessPoolExecutor]
+  __pid: Optional[int]
+  __pending: int
+
+  def __init__(self, *, workers: int, max_pending: int, timeout: float, name: str):
+    super().__init__()
+    self.name = name
+    self.__workers = workers
+    self.__max_pending = max_pending
+    self.__timeout = timeout
+    self.__lock = threading.Lock()
+    self.__executor = None
+    self.__pid = None
+    self.__pending = 0
+
+  @property
+  def queue_depth(self) -> int:
+    '''
+    The number of calls queued or running.
+    '''
+    return self.__pending
+
+  def __call__(self, fn: Callable[..., Any], *args: Any, deadline: Optional[float] = None) -> Any:
+    check_deadline(deadline)
+    with self.__lock:
+      if self.__pid != os.getpid():
+        self.__executor = None
+        self.__pending = 0
+        self.__pid = os.getpid()
+      if self.__executor is None:
+        self.__executor = ProcessPoolExecutor(self.__workers, mp_context=multiprocessing.get_context('spawn'))
+      if self.__pending >= self.__max_pending:
+        raise Overloaded(f'Too many requests are waiting for the {self.name} pool', retry_after=1)
+      executor = self.__executor
+      self.__pending += 1
+
+    try:
+      future = executor.submit(fn, *args)
+    except BaseException as err:
+      self.__finish_call()
+      if isinstance(err, BrokenProcessPool):
+        self.__reset(executor)
+        raise InternalServerError(f'A worker of the {self.name} pool died, restarting the pool')
+      raise
+    future.add_done_callback(lambda _: self.__finish_call())
+
+    timeout = self.__timeout
+    is_deadline_first = False
+    if deadline is not None and deadline - time.monotonic() < timeout:
+      timeout = max(0.0, deadline - time.monotonic())
+      is_deadline_first = True
+    try:
+      return future.result(timeout=timeout)
+    except TimeoutError:
+      future.cancel()
+      if is_deadline_first:
+        raise DeadlineExceeded('The deadline expired before the work was done')
+      raise GatewayTimeout(f'Not done in {self.__timeout}s')
+    except BrokenProcessPool:
+      self.__reset(executor)
+      raise InternalServerError(f'A worker of the {self.name} pool died, restarting the pool')
+
+  def __finish_call(self) -> None:
+    with self.__lock:
+      self.__pending -= 1
+
+  def __reset(self, executor: ProcessPoolExecutor) -> None:
+    with self.__lock:
+      if self.__executor is executor:
+        self.__executor = None
+    executor.shutdown(wait=False)
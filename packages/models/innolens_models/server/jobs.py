@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Mapping, MutableSet, Optional
+from typing_extensions import Final
+
+from werkzeug.exceptions import NotFound, ServiceUnavailable
+
+from .admission import Overloaded
+
+
+# A job function takes the input and a progress callback, which takes the fraction
+# done, and returns the result json. It runs in a worker process, so it must be
+# picklable, i.e. defined at the top level of a module.
+JobFn = Callable[[Any, Callable[[float], None]], Any]
+
+default_jobs_dir_path: Final = str(Path(tempfile.gettempdir()) / 'innolens-models-jobs')
+
+
+class JobManager:
+  '''
+  Run long analytics as jobs in a pool of worker processes. A job is identified by
+  the hash of its kind and input, so identical submissions are merged into one job,
+  and the result of a finished job is reused until ttl seconds after it finished.
+  A failed or expired job is run again on the next submission.
+
+  The jobs are stored as json files in jobs_dir_path, so that every server worker
+  answers for the jobs run by any other worker. Each server worker runs at most
+  max_jobs jobs at a time and answers 503 beyond that. The pool starts on the first
+  job of each process, as it does not survive a fork.
+
+  A get waiting for a job to finish holds a request thread, so at most max_waiters
+  gets wait at a time in each server worker, and more are answered 503.
+  '''
+
+  __dir_path: Final[Path]
+  __workers: Final[int]
+  __max_jobs: Final[int]
+  __ttl: Final[float]
+  __max_waiters: Final[int]
+  __lock: Final[threading.Lock]
+  __active_job_ids: Final[MutableSet[str]]
+  __executor: Optional[ProcessPoolExecutor]
+  __pid: Optional[int]
+  __waiters: int
+
+  def __init__(
+    self,
+    *,
+    dir_path: str = default_jobs_dir_path,
+    workers: int = 1,
+    max_jobs: int = 16,
+    ttl: float = 3600,
+    max_waiters: int = 2
+  ):
+    super().__init__()
+    self.__dir_path = Path(dir_path)
+    self.__workers = workers
+    self.__max_jobs = max_jobs
+    self.__ttl = ttl
+    self.__max_waiters = max_waiters
+    self.__lock = threading.Lock()
+    self.__active_job_ids = set()
+    self.__executor = None
+    self.__pid = None
+    self.__waiters = 0
+
+  @property
+  def queue_depth(self) -> int:
+    '''
+    The number of jobs queued or running in this process.
+    '''
+    return len(self.__active_job_ids)
+
+  def submit(self, kind: str, fn: JobFn, data: Any) -> Mapping[str, Any]:
+    job_id = hash_job(kind, data)
+    self.__dir_path.mkdir(parents=True, exist_ok=True)
+    self.__evict_expired()
+
+    existing_job = self.__read(job_id)
+    if existing_job is not None and self.__is_reusable(existing_job):
+      return existing_job
+
+    with self.__lock:
+      if len(self.__active_job_ids) >= self.__max_jobs:
+        raise ServiceUnavailable('Too many jobs are running')
+      executor = self.__get_executor()
+      job: Mapping[str, Any] = { 'id': job_id, 'kind': kind, 'status': 'queued', 'progress': 0.0 }
+      claimed_job = self.__claim(job) if existing_job is None else self.__claim_rerun(job, existing_job)
+      if claimed_job is None:
+        # Submitted by another server worker just now, which runs it
+        current_job = self.__read(job_id)
+        return current_job if current_job is not None and self.__is_reusable(current_job) else job
+      job = claimed_job
+      self.__active_job_ids.add(job_id)
+
+    try:
+      future = executor.submit(run_job, job_id, fn, data)
+    except BrokenProcessPool as err:
+      self.__reset(executor)
+      self.__finish(job, None, err)
+      raise ServiceUnavailable('The job workers died, restarting them')
+    future.add_done_callback(lambda future: self.__on_done(job, executor, future))
+    return job
+
+  def get(self, job_id: str, *, wait: float = 0) -> Mapping[str, Any]:
+    '''
+    Get a job, waiting up to wait seconds for it to finish.
+    '''
+    if re.fullmatch(r'[0-9a-f]{32}', job_id) is None:
+      raise NotFound(f'No job {job_id}')
+    job = self.__read_unexpired(job_id)
+    if job['status'] in ('done', 'failed') or wait <= 0:
+      return job
+
+    with self.__lock:
+      if self.__waiters >= self.__max_waiters:
+        raise Overloaded('Too many requests are waiting for jobs', retry_after=1)
+      self.__waiters += 1
+    try:
+      deadline = time.monotonic() + wait
+      while job['status'] not in ('done', 'failed') and time.monotonic() < deadline:
+        time.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+        job = self.__read_unexpired(job_id)
+      return job
+    finally:
+      with self.__lock:
+        self.__waiters -= 1
+
+  def __read_unexpired(self, job_id: str) -> Mapping[str, Any]:
+    job = self.__read(job_id)
+    if job is None or self.__is_expired(job):
+      raise NotFound(f'No job {job_id}, or it has expired')
+    return job
+
+  def __get_executor(self) -> ProcessPoolExecutor:
+    if self.__pid != os.getpid():
+      self.__executor = None
+      self.__active_job_ids.clear()
+      self.__pid = os.getpid()
+    if self.__executor is None:
+      context = multiprocessing.get_context('spawn')
+      progress_queue = context.Queue()
+      threading.Thread(
+        target=self.__receive_progress,
+        args=(progress_queue,),
+        name='job-progress',
+        daemon=True
+      ).start()
+      self.__executor = ProcessPoolExecutor(
+        self.__workers,
+        mp_context=context,
+        initializer=init_job_worker,
+        initargs=(progress_queue,)
+      )
+    return self.__executor
+
+  def __reset(self, executor: ProcessPoolExecutor) -> None:
+    with self.__lock:
+      if self.__executor is executor:
+        self.__executor = None
+    executor.shutdown(wait=False)
+
+  def __receive_progress(self, progress_queue: Any) -> None:
+    while True:
+      job_id, progress = progress_queue.get()
+      with self.__lock:
+        # The result may arrive before the last progress
+        if job_id not in self.__active_job_ids:
+          continue
+        job = self.__read(job_id)
+        if job is not None:
+          self.__write({ **job, 'status': 'running', 'progress': progress })
+
+  def __on_done(self, job: Mapping[str, Any], executor: ProcessPoolExecutor, future: Future[Any]) -> None:
+    err = future.exception()
+    if isinstance(err, BrokenProcessPool):
+      self.__reset(executor)
+    self.__finish(job, None if err is not None else future.result(), err)
+
+  def __finish(self, job: Mapping[str, Any], result: Any, err: Optional[BaseException]) -> None:
+    if err is not None:
+      logging.getLogger(__name__).error(f'Job {job["id"]} failed', exc_info=err)
+      finished_job = { **job, 'status': 'failed', 'error': str(err) }
+    else:
+      finished_job = { **job, 'status': 'done', 'progress': 1.0, 'result': result }
+    with self.__lock:
+      self.__active_job_ids.discard(job['id'])
+      self.__write(finished_job)
+
+  def __is_expired(self, job: Mapping[str, Any]) -> bool:
+    # Unfinished jobs expire too, in case their server worker died
+    return time.time() * 1000 - job['updatedTime'] > self.__ttl * 1000
+
+  def __is_reusable(self, job: Mapping[str, Any]) -> bool:
+    return job['status'] != 'failed' and not self.__is_expired(job)
+
+  def __evict_expired(self) -> None:
+    for path in self.__dir_path.glob('*.json'):
+      # The file is written with its updatedTime, so only the expired ones are read
+      try:
+        if time.time() - path.stat().st_mtime <= self.__ttl:
+          continue
+      except FileNotFoundError:
+        continue
+      job = self.__read(path.stem)
+      if job is None or not self.__is_expired(job) or job['id'] in self.__active_job_ids:
+        continue
+      # Evicting under the lock keeps a job from being claimed as new while it is rerun
+      if not self.__lock_job(job['id']):
+        continue
+      try:
+        current_job = self.__read(job['id'])
+        if current_job is not None and current_job['updatedTime'] == job['updatedTime']:
+          path.unlink()
+      finally:
+        self.__unlock_job(job['id'])
+
+  def __path(self, job_id: str) -> Path:
+    return self.__dir_path / f'{job_id}.json'
+
+  def __read(self, job_id: str) -> Optional[Mapping[str, Any]]:
+    try:
+      with open(str(self.__path(job_id))) as file:
+        return json.load(file)
+    except (FileNotFoundError, ValueError):
+      return None
+
+  def __claim(self, job: Mapping[str, Any]) -> Optional[Mapping[str, Any]]:
+    '''
+    Create the file of a new job, unless another server worker has.
+    '''
+    try:
+      fd = os.open(str(self.__path(job['id'])), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      return None
+    os.close(fd)
+    return self.__write(job)
+
+  def __claim_rerun(self, job: Mapping[str, Any], existing_job: Mapping[str, Any]) -> Optional[Mapping[str, Any]]:
+    '''
+    Replace a failed or expired job to run it again, unless another server worker
+    has replaced or evicted it since it was read.
+    '''
+    if not self.__lock_job(job['id']):
+      return None
+    try:
+      current_job = self.__read(job['id'])
+      if current_job is None:
+        return self.__claim(job)
+      if current_job['updatedTime'] != existing_job['updatedTime']:
+        return None
+      return self.__write(job)
+    finally:
+      self.__unlock_job(job['id'])
+
+  def __lock_job(self, job_id: str) -> bool:
+    '''
+    Lock a job file across the server workers. The lock is only held for a read and
+    a write, so an older lock was left by a dead server worker and is broken.
+    '''
+    lock_path = self.__path(job_id).with_suffix('.lock')
+    try:
+      fd = os.open(str(lock_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      try:
+        if time.time() - lock_path.stat().st_mtime > 60:
+          lock_path.unlink()
+      except FileNotFoundError:
+        pass
+      return False
+    os.close(fd)
+    return True
+
+  def __unlock_job(self, job_id: str) -> None:
+    self.__path(job_id).with_suffix('.lock').unlink()
+
+  def __write(self, job: Mapping[str, Any]) -> Mapping[str, Any]:
+    path = self.__path(job['id'])
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    written_job = { **job, 'updatedTime': int(time.time() * 1000) }
+    with open(str(tmp_path), 'w') as file:
+      json.dump(written_job, file)
+    os.replace(str(tmp_path), str(path))
+    return written_job
+
+
+def hash_job(kind: str, data: Any) -> str:
+  data_str = json.dumps(data, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(f'{kind}\n{data_str}'.encode()).hexdigest()[:32]
+
+
+job_progress_queue: Optional[Any] = None
+
+def init_job_worker(progress_queue: Any) -> None:
+  global job_progress_queue
+  job_progress_queue = progress_queue
+
+def run_job(job_id: str, fn: JobFn, data: Any) -> Any:
+  last_percent = -1
+
+  def report_progress(progress: float) -> None:
+    nonlocal last_percent
+    # Report each percent once, so the job file is not rewritten too often
+    percent = int(progress * 100)
+    if percent != last_percent and job_progress_queue is not None:
+      last_percent = percent
+      job_progress_queue.put((job_id, progress))
+
+  report_progress(0.0)
+  return fn(data, report_progress)
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+import logging
+import threading
+import time
+from typing import Any, Callable, Mapping, Optional
+from typing_extensions import Final
+
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class LoadingModel:
+  '''
+  A model loaded on a background thread, so the server starts listening and the
+  models load in parallel. get answers 503 until the model is loaded.
+  '''
+
+  name: Final[str]
+  __future: Final[Future[Any]]
+  __load_sec: Optional[float]
+
+  def __init__(self, load: Callable[[], Any], *, name: str, background: bool = True):
+    super().__init__()
+    self.name = name
+    self.__future = Future()
+    self.__load_sec = None
+    if background:
+      threading.Thread(target=self.__load, args=(load,), name=f'{name}-loader', daemon=True).start()
+    else:
+      self.__load(load)
+
+  def __load(self, load: Callable[[], Any]) -> None:
+    start_time = time.perf_counter()
+    try:
+      model = load()
+    except Exception as err:
+      logging.getLogger(__name__).error(f'Loading {self.name} failed', exc_info=err)
+      self.__future.set_exception(err)
+      return
+    self.__load_sec = time.perf_counter() - start_time
+    logging.getLogger(__name__).info(f'Loaded {self.name} in {self.__load_sec:.2f}s')
+    self.__future.set_result(model)
+
+  def get(self) -> Any:
+    if not self.__future.done():
+      raise ServiceUnavailable(f'{self.name} is still loading')
+    return self.__future.result()
+
+  @property
+  def ready(self) -> bool:
+    return self.__future.done() and self.__future.exception() is None
+
+  def status(self) -> Mapping[str, Any]:
+    if not self.__future.done():
+      return { 'status': 'loading' }
+    err = self.__future.exception()
+    if err is not None:
+      return { 'status': 'failed', 'error': str(err) }
+    return { 'status': 'ready', 'loadSec': self.__load_sec }
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+from abc import ABCMeta, abstractmethod
+from bisect import bisect_left
+import os
+import resource
+import threading
+from typing import Callable, Iterable, Mapping, MutableMapping, MutableSequence, Optional, Sequence, Tuple
+from typing_extensions import Final
+
+
+latency_buckets: Final[Sequence[float]] = (
+  0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+size_buckets: Final[Sequence[float]] = tuple(float(4 ** i) for i in range(4, 14)) # 256B to 64MB
+batch_size_buckets: Final[Sequence[float]] = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class Metric(metaclass=ABCMeta):
+  '''
+  A metric of the Prometheus text format, with a series per combination of label
+  values. Metrics do not lock, their owner serializes the updates and renders.
+  '''
+
+  name: Final[str]
+  help: Final[str]
+  type: Final[str]
+  label_names: Final[Sequence[str]]
+
+  def __init__(self, name: str, help: str, type: str, label_names: Sequence[str] = ()):
+    super().__init__()
+    self.name = name
+    self.help = help
+    self.type = type
+    self.label_names = label_names
+
+  def render(self) -> Iterable[str]:
+    yield f'# HELP {self.name} {self.help}'
+    yield f'# TYPE {self.name} {self.type}'
+    yield from self._render_samples()
+
+  @abstractmethod
+  def _render_samples(self) -> Iterable[str]:
+    '''
+    The sample lines of the metric, after its HELP and TYPE lines.
+    '''
+    ...
+
+  def _format_labels(self, label_values: Sequence[str], extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = [*zip(self.label_names, label_values), *extra]
+    if len(pairs) == 0:
+      return ''
+    labels_str = ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs)
+    return f'{{{labels_str}}}'
+
+
+class Counter(Metric):
+  __values: Final[MutableMapping[Tuple[str, ...], float]]
+
+  def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+    super().__init__(name, help, 'counter', label_names)
+    self.__values = {}
+
+  def inc(self, label_values: Tuple[str, ...], value: float = 1.0) -> None:
+    self.__values[label_values] = self.__values.get(label_values, 0.0) + value
+
+  def _render_samples(self) -> Iterable[str]:
+    for label_values, value in self.__values.items():
+      yield f'{self.name}{self._format_labels(label_values)} {value}'
+
+
+class Gauge(Metric):
+  '''
+  A gauge set by the app, or read by collect on each scrape if given, which returns
+  the value of each combination of label values.
+  '''
+
+  __values: Final[MutableMapping[Tuple[str, ...], float]]
+  __collect: Final[Optional[Callable[[], Mapping[Tuple[str, ...], float]]]]
+
+  def __init__(
+    self,
+    name: str,
+    help: str,
+    label_names: Sequence[str] = (),
+    *,
+    collect: Optional[Callable[[], Mapping[Tuple[str, ...], float]]] = None
+  ):
+    super().__init__(name, help, 'gauge', label_names)
+    self.__values = {}
+    self.__collect = collect
+
+  def inc(self, label_values: Tuple[str, ...], value: float = 1.0) -> None:
+    self.__values[label_values] = self.__values.get(label_values, 0.0) + value
+
+  def _render_samples(self) -> Iterable[str]:
+    values = self.__collect() if self.__collect is not None else self.__values
+    for label_values, value in values.items():
+      yield f'{self.name}{self._format_labels(label_values)} {value}'
+
+
+class Histogram(Metric):
+  __buckets: Final[Sequence[float]]
+  __series: Final[MutableMapping[Tuple[str, ...], Tuple[MutableSequence[int], MutableSequence[float]]]]
+
+  def __init__(self, name: str, help: str, label_names: Sequence[str] = (), *, buckets: Sequence[float]):
+    super().__init__(name, help, 'histogram', label_names)
+    self.__buckets = buckets
+    self.__series = {}
+
+  def observe(self, label_values: Tuple[str, ...], value: float) -> None:
+    series = self.__series.get(label_values)
+    if series is None:
+      series = ([0] * (len(self.__buckets) + 1), [0.0])
+      self.__series[label_values] = series
+    # Count in the first bucket whose upper bound is >= value, the last one is +Inf
+    series[0][bisect_left(self.__buckets, value)] += 1
+    series[1][0] += value
+
+  def _render_samples(self) -> Iterable[str]:
+    for label_values, (counts, (total,)) in self.__series.items():
+      cumulative_count = 0
+      for bound, count in zip([*self.__buckets, float('inf')], counts):
+        cumulative_count += count
+        bound_str = '+Inf' if bound == float('inf') else repr(float(bound))
+        yield f'{self.name}_bucket{self._format_labels(label_values, (("le", bound_str),))} {cumulative_count}'
+      yield f'{self.name}_sum{self._format_labels(label_values)} {total}'
+      yield f'{self.name}_count{self._format_labels(label_values)} {cumulative_count}'
+
+
+class ServerMetrics:
+  '''
+  The metrics of the models server, rendered by /metrics. Each server process has its
+  own, so with several workers a scrape sees the worker which answers it. A request
+  takes the lock once as it starts and once as it finishes, which keeps the overhead
+  at a few microseconds.
+  '''
+
+  __lock: Final[threading.Lock]
+  __queue_depths: Final[MutableMapping[str, Callable[[], int]]]
+
+  requests: Final[Counter]
+  request_duration: Final[Histogram]
+  request_size: Final[Histogram]
+  response_size: Final[Histogram]
+  codec_duration: Final[Histogram]
+  inference_duration: Final[Histogram]
+  batch_size: Final[Histogram]
+  in_flight_requests: Final[Gauge]
+  queue_depth: Final[Gauge]
+  resident_memory: Final[Gauge]
+
+  def __init__(self) -> None:
+    super().__init__()
+    self.__lock = threading.Lock()
+    self.__queue_depths = {}
+    self.requests = Counter(
+      'innolens_models_requests_total',
+      'Number of requests answered',
+      ('route', 'method', 'status')
+    )
+    self.request_duration = Histogram(
+      'innolens_models_request_duration_seconds',
+      'Time to answer a request',
+      ('route',),
+      buckets=latency_buckets
+    )
+    self.request_size = Histogram(
+      'innolens_models_request_size_bytes',
+      'Size of the request bodies',
+      ('route',),
+      buckets=size_buckets
+    )
+    self.response_size = Histogram(
+      'innolens_models_response_size_bytes',
+      'Size of the response bodies',
+      ('route',),
+      buckets=size_buckets
+    )
+    self.codec_duration = Histogram(
+      'innolens_models_codec_duration_seconds',
+      'Time to decode request bodies and encode response bodies',
+      ('route', 'stage'),
+      buckets=latency_buckets
+    )
+    self.inference_duration = Histogram(
+      'innolens_models_inference_duration_seconds',
+      'Time of a forward pass over a batch',
+      ('model',),
+      buckets=latency_buckets
+    )
+    self.batch_size = Histogram(
+      'innolens_models_batch_size',
+      'Number of rows in a forward pass',
+      ('model',),
+      buckets=batch_size_buckets
+    )
+    self.in_flight_requests = Gauge(
+      'innolens_models_in_flight_requests',
+      'Number of requests being answered',
+      ('route',)
+    )
+    self.queue_depth = Gauge(
+      'innolens_models_queue_depth',
+      'Number of calls waiting for a batcher, or queued or running in a process pool',
+      ('pool',),
+      collect=lambda: { (name,): float(depth()) for name, depth in self.__queue_depths.items() }
+    )
+    self.resident_memory = Gauge(
+      'process_resident_memory_bytes',
+      'Resident memory size of the process',
+      collect=lambda: { (): read_resident_memory() }
+    )
+
+  def add_queue_depth(self, pool: str, depth: Callable[[], int]) -> None:
+    with self.__lock:
+      self.__queue_depths[pool] = depth
+
+  def start_request(self, route: str) -> None:
+    with self.__lock:
+      self.in_flight_requests.inc((route,))
+
+  def finish_request(
+    self,
+    route: str,
+    method: str,
+    status: int,
+    duration: float,
+    request_size: int,
+    response_size: Optional[int]
+  ) -> None:
+    labels = (route,)
+    with self.__lock:
+      self.in_flight_requests.inc(labels, -1.0)
+      self.requests.inc((route, method, str(status)))
+      self.request_duration.observe(labels, duration)
+      self.request_size.observe(labels, request_size)
+      if response_size is not None:
+        self.response_size.observe(labels, response_size)
+
+  def observe_codec(self, route: str, stage: str, duration: float) -> None:
+    with self.__lock:
+      self.codec_duration.observe((route, stage), duration)
+
+  def observe_inference(self, model: str, duration: float, batch_size: int) -> None:
+    labels = (model,)
+    with self.__lock:
+      self.inference_duration.observe(labels, duration)
+      self.batch_size.observe(labels, batch_size)
+
+  def render(self) -> str:
+    with self.__lock:
+      return self.__render()
+
+  def __render(self) -> str:
+    return ''.join(
+      f'{line}\n'
+      for metric in (
+        self.requests,
+        self.request_duration,
+        self.request_size,
+        self.response_size,
+        self.codec_duration,
+        self.inference_duration,
+        self.batch_size,
+        self.in_flight_requests,
+        self.queue_depth,
+        self.resident_memory
+      )
+      for line in metric.render()
+    )
+
+
+def escape_label_value(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def read_resident_memory() -> float:
+  try:
+    with open('/proc/self/statm') as file:
+      return float(int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))
+  except OSError:
+    # Peak rather than current RSS where /proc is missing
+    return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import cProfile
+from contextlib import contextmanager
+import pstats
+import time
+from typing import Any, Iterator, Mapping, MutableMapping, MutableSequence, Sequence, Tuple
+from typing_extensions import Final
+
+
+class RequestProfile:
+  '''
+  A cProfile of a request with the time of each phase. Only the request thread is
+  profiled, so profiled requests are not batched with others.
+  '''
+
+  __profiler: Final[cProfile.Profile]
+  __phases: Final[MutableSequence[Tuple[str, float]]]
+
+  def __init__(self) -> None:
+    super().__init__()
+    self.__profiler = cProfile.Profile()
+    self.__phases = []
+
+  def start(self) -> None:
+    self.__profiler.enable()
+
+  def stop(self) -> None:
+    self.__profiler.disable()
+
+  @contextmanager
+  def phase(self, name: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.__phases.append((name, time.perf_counter() - start_time))
+
+  def phase_secs(self) -> Mapping[str, float]:
+    '''
+    The total time of each phase, which may be entered more than once.
+    '''
+    secs: MutableMapping[str, float] = {}
+    for name, sec in self.__phases:
+      secs[name] = secs.get(name, 0.0) + sec
+    return secs
+
+  def server_timing(self) -> str:
+    return ', '.join(f'{name};dur={sec * 1000:.3f}' for name, sec in self.__phases)
+
+  def top_functions(self, limit: int = 20) -> Sequence[Mapping[str, Any]]:
+    '''
+    The functions taking the most cumulative time.
+    '''
+    stats = pstats.Stats(self.__profiler)
+    entries = sorted(stats.stats.items(), key=lambda entry: entry[1][3], reverse=True) # type: ignore
+    return [
+      {
+        'function': function,
+        'file': file,
+        'line': line,
+        'calls': calls,
+        'totalSec': total_sec,
+        'cumulativeSec': cumulative_sec
+      }
+      for (file, line, function), (_, calls, total_sec, cumulative_sec, _) in entries[:limit]
+    ]
+
+  def dump(self, path: str) -> None:
+    '''
+    Write the profile as a .prof, readable by pstats or snakeviz.
+    '''
+    self.__profiler.dump_stats(path)
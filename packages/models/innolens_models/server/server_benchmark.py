@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import platform
+import random
+import threading
+import time
+from typing import Any, Callable, Mapping, MutableMapping, MutableSequence, Optional, Sequence, Tuple
+from typing_extensions import Final
+from urllib.parse import urlsplit
+
+import numpy as np
+
+
+endpoint_paths: Final[Mapping[str, str]] = {
+  'forecast': '/forecast',
+  'access-causality': '/access-causality',
+  'cluster-members': '/cluster-members',
+  'correlate': '/correlate'
+}
+
+# A client sends (method, path, body) and gets (status, body)
+Send = Callable[[str, str, Optional[bytes]], Tuple[int, bytes]]
+
+
+def parse_mix(mix_str: str) -> Mapping[str, float]:
+  '''
+  Parse a request mix like "forecast=8,access-causality=2" into the weight of each
+  endpoint.
+  '''
+  mix: MutableMapping[str, float] = {}
+  for part in mix_str.split(','):
+    name, _, weight_str = part.partition('=')
+    name = name.strip()
+    if name not in endpoint_paths:
+      raise ValueError(f'Unknown endpoint in the mix: {name}')
+    mix[name] = float(weight_str) if weight_str != '' else 1.0
+  if sum(mix.values()) <= 0:
+    raise ValueError('The mix has no positive weight')
+  return mix
+
+def build_payloads(
+  *,
+  mix: Mapping[str, float],
+  send: Send,
+  access_causality_data_path: str,
+  history_forecast_data_path: str,
+  forecast_input_size: int,
+  forecast_rows: int = 1,
+  cluster_members: int = 8,
+  window_size: int = 24 * 2 * 7,
+  count: int = 32,
+  seed: int = 0
+) -> Mapping[str, Sequence[bytes]]:
+  '''
+  Build count JSON bodies for each endpoint in the mix, from random windows of the
+  training data, i.e. the sample or simulation result JSON files. The features and
+  history window of /access-causality are read from its settings endpoint.
+  '''
+  rng = np.random.default_rng(seed)
+  payloads: MutableMapping[str, Sequence[bytes]] = {}
+
+  if 'access-causality' in mix:
+    status, body = send('GET', '/access-causality/settings', None)
+    if status != 200:
+      raise RuntimeError(f'Getting the access causality settings failed with {status}: {body[:200]!r}')
+    settings = json.loads(body)['data']
+    with open(access_causality_data_path) as file:
+      data = json.load(file)
+    missing_features = set(settings['features']) - set(data['features'])
+    if len(missing_features) > 0:
+      raise ValueError(f'Features missing from {access_causality_data_path}: {", ".join(missing_features)}')
+    feature_idxs = [data['features'].index(feature) for feature in settings['features']]
+    values = np.asarray(data['values'], dtype=np.float64)[feature_idxs]
+    history_size = settings['historyWindowSize']
+
+    def access_causality_payload() -> Any:
+      t = int(rng.integers(0, values.shape[1] - history_size + 1))
+      return {
+        'startTimes': data['startTimes'][t : t + history_size],
+        'endTimes': data['endTimes'][t : t + history_size],
+        'features': settings['features'],
+        'values': values[:, t : t + history_size].tolist()
+      }
+    payloads['access-causality'] = [json.dumps(access_causality_payload()).encode() for _ in range(count)]
+
+  if mix.keys() & { 'forecast', 'cluster-members', 'correlate' }:
+    with open(history_forecast_data_path) as file:
+      data = json.load(file)
+    groups: Sequence[str] = data['groups']
+    values = np.asarray(data['values'], dtype=np.float64)
+
+    def forecast_payload() -> Any:
+      group_idxs = rng.integers(0, len(groups), size=forecast_rows)
+      ts = rng.integers(0, values.shape[1] - forecast_input_size + 1, size=forecast_rows)
+      return {
+        'values': [values[g, t : t + forecast_input_size].tolist() for g, t in zip(group_idxs, ts)],
+        'groups': [groups[g] for g in group_idxs]
+      }
+
+    def cluster_members_payload() -> Any:
+      group_idxs = rng.choice(len(groups), size=min(cluster_members, len(groups)), replace=False)
+      t = int(rng.integers(0, values.shape[1] - window_size + 1))
+      return {
+        'memberIds': [groups[g] for g in group_idxs],
+        'timeSpans': data['timeSpans'][t : t + window_size],
+        'features': ['count'],
+        'values': [[values[g, t : t + window_size].tolist()] for g in group_idxs]
+      }
+
+    def correlate_payload() -> Any:
+      group_idxs = rng.choice(len(groups), size=2, replace=False)
+      t = int(rng.integers(0, values.shape[1] - window_size + 1))
+      return [values[g, t : t + window_size].tolist() for g in group_idxs]
+
+    for name, build_payload in (
+      ('forecast', forecast_payload),
+      ('cluster-members', cluster_members_payload),
+      ('correlate', correlate_payload)
+    ):
+      if name in mix:
+        payloads[name] = [json.dumps(build_payload()).encode() for _ in range(count)]
+
+  return payloads
+
+def in_process_client(app: Any) -> Callable[[], Send]:
+  '''
+  Send the requests through the Flask test client of the app, which skips the
+  network but shares the GIL with the server.
+  '''
+  def create() -> Send:
+    client = app.test_client()
+    def send(method: str, path: str, body: Optional[bytes]) -> Tuple[int, bytes]:
+      response = client.open(path, method=method, data=body, content_type='application/json')
+      return response.status_code, response.get_data()
+    return send
+  return create
+
+def http_client(url: str, *, timeout: float = 30) -> Callable[[], Send]:
+  '''
+  Send the requests to a running server, over a keep-alive connection per thread.
+  '''
+  parts = urlsplit(url)
+  host = parts.hostname or 'localhost'
+  port = parts.port or 80
+
+  def create() -> Send:
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    def send(method: str, path: str, body: Optional[bytes]) -> Tuple[int, bytes]:
+      nonlocal connection
+      headers = { 'Content-Type': 'application/json' } if body is not None else {}
+      try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+      except (http.client.HTTPException, ConnectionError):
+        # Reconnect once after the server closed the idle connection
+        connection.close()
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+      return response.status, response.read()
+    return send
+  return create
+
+def benchmark_server(
+  *,
+  create_client: Callable[[], Send],
+  mix: Mapping[str, float],
+  concurrency: int = 8,
+  requests: int = 1000,
+  warmup_requests: int = 20,
+  seed: int = 0,
+  **payload_kwargs: Any
+) -> Mapping[str, Any]:
+  '''
+  Send requests requests in the mix from concurrency threads, after warmup_requests
+  which are not measured, and report the throughput, latency percentiles and error
+  rate overall and per endpoint. A request is an error if it fails or does not
+  answer 200.
+  '''
+  payloads = build_payloads(mix=mix, send=create_client(), seed=seed, **payload_kwargs)
+  names = list(mix.keys())
+  weights = [mix[name] for name in names]
+
+  lock = threading.Lock()
+  remaining = warmup_requests + requests
+  results: MutableSequence[Tuple[str, float, int]] = []
+  # The span of the measured requests
+  first_start_time = float('inf')
+  last_end_time = float('-inf')
+
+  def run_thread(thread_idx: int) -> None:
+    nonlocal remaining, first_start_time, last_end_time
+    send = create_client()
+    thread_rng = random.Random(seed * 1000 + thread_idx)
+    while True:
+      with lock:
+        if remaining <= 0:
+          return
+        is_warmup = remaining > requests
+        remaining -= 1
+      name = thread_rng.choices(names, weights)[0]
+      body = thread_rng.choice(payloads[name])
+      start_time = time.perf_counter()
+      try:
+        status, _ = send('POST', endpoint_paths[name], body)
+      except Exception:
+        status = 0
+      end_time = time.perf_counter()
+      if not is_warmup:
+        with lock:
+          results.append((name, end_time - start_time, status))
+          first_start_time = min(first_start_time, start_time)
+          last_end_time = max(last_end_time, end_time)
+
+  with ThreadPoolExecutor(concurrency) as executor:
+    for future in [executor.submit(run_thread, thread_idx) for thread_idx in range(concurrency)]:
+      future.result()
+  duration_sec = max(last_end_time - first_start_time, 0.0)
+
+  return {
+    'config': {
+      'mix': mix,
+      'concurrency': concurrency,
+      'requests': requests,
+      'warmupRequests': warmup_requests,
+      'python': platform.python_version()
+    },
+    'durationSec': duration_sec,
+    **summarize_results(results, duration_sec),
+    'endpoints': {
+      name: summarize_results([result for result in results if result[0] == name], duration_sec)
+      for name in names
+    }
+  }
+
+def summarize_results(results: Sequence[Tuple[str, float, int]], duration_sec: float) -> Mapping[str, Any]:
+  latencies_ms = np.array([latency * 1000 for _, latency, _ in results])
+  statuses: MutableMapping[str, int] = {}
+  for _, _, status in results:
+    statuses[str(status)] = statuses.get(str(status), 0) + 1
+  errors = sum(count for status, count in statuses.items() if status != '200')
+  return {
+    'requests': len(results),
+    'throughput': len(results) / duration_sec if duration_sec > 0 else 0.0,
+    'errors': errors,
+    'errorRate': errors / len(results) if len(results) > 0 else 0.0,
+    'statuses': statuses,
+    'latencyMs': (
+      {
+        'mean': float(latencies_ms.mean()),
+        'p50': float(np.percentile(latencies_ms, 50)),
+        'p95': float(np.percentile(latencies_ms, 95)),
+        'p99': float(np.percentile(latencies_ms, 99)),
+        'max': float(latencies_ms.max())
+      }
+      if len(results) > 0
+      else None
+    )
+  }
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import multiprocessing
+import resource
+import sys
+import time
+from typing import Any, Mapping, MutableSequence, Optional, Sequence
+from typing_extensions import Final
+
+import numpy as np
+
+
+heavy_modules: Final[Sequence[str]] = ('tensorflow', 'matplotlib', 'pandas', 'scipy')
+
+
+def benchmark_startup(
+  *,
+  runs: int = 3,
+  max_ready_sec: Optional[float] = None,
+  max_rss_mb: Optional[float] = None,
+  **app_kwargs: Any
+) -> Mapping[str, Any]:
+  '''
+  Start the app runs times, each in a fresh process so nothing is imported yet, and
+  measure the time until /ready answers 200 and the peak RSS. The report lists
+  violations of max_ready_sec and max_rss_mb, compared with the median ready time
+  and the largest peak RSS.
+  '''
+  probes: MutableSequence[Mapping[str, Any]] = []
+  for _ in range(runs):
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+      probes.append(pool.apply(probe_startup, kwds=app_kwargs))
+
+  ready_sec = float(np.median([probe['readySec'] for probe in probes]))
+  peak_rss_mb = max(probe['maxRssMb'] for probe in probes)
+  violations = []
+  if max_ready_sec is not None and ready_sec > max_ready_sec:
+    violations.append(f'Ready in {ready_sec:.2f}s, over the bound of {max_ready_sec}s')
+  if max_rss_mb is not None and peak_rss_mb > max_rss_mb:
+    violations.append(f'Peak RSS of {peak_rss_mb:.0f}MB, over the bound of {max_rss_mb}MB')
+  return {
+    'readySec': ready_sec,
+    'maxRssMb': peak_rss_mb,
+    'runs': probes,
+    'violations': violations
+  }
+
+def probe_startup(**app_kwargs: Any) -> Mapping[str, Any]:
+  start_time = time.perf_counter()
+  from .app import create_app
+  import_sec = time.perf_counter() - start_time
+
+  app = create_app(**app_kwargs)
+  create_sec = time.perf_counter() - start_time
+
+  client = app.test_client()
+  while True:
+    response = client.get('/ready')
+    models = response.get_json()['data']
+    if response.status_code == 200:
+      break
+    failed_models = [name for name, status in models.items() if status['status'] == 'failed']
+    if len(failed_models) > 0:
+      raise RuntimeError(f'Loading failed: {", ".join(failed_models)}')
+    time.sleep(0.01)
+  ready_sec = time.perf_counter() - start_time
+
+  return {
+    'importSec': import_sec,
+    'createAppSec': create_sec,
+    'readySec': ready_sec,
+    'models': models,
+    # ru_maxrss is in KB on Linux
+    'maxRssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavyModules': [name for name in heavy_modules if name in sys.modules]
+  }
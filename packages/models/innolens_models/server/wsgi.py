@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Mapping
+from typing_extensions import Final
+
+from flask import Flask
+from gunicorn.app.base import BaseApplication
+
+
+class ServerApplication(BaseApplication):
+  '''
+  Serve the app made by create_app with Gunicorn. With preload_app, the app is made
+  once in the master so the workers share the model weights copy-on-write, and is
+  made again on SIGHUP before the workers are gracefully replaced.
+  '''
+
+  __create_app: Final[Callable[[], Flask]]
+  __options: Final[Mapping[str, Any]]
+
+  def __init__(self, create_app: Callable[[], Flask], *, options: Mapping[str, Any]):
+    # The base class loads the config in its constructor
+    self.__create_app = create_app
+    self.__options = options
+    super().__init__()
+
+  def load_config(self) -> None:
+    for key, value in self.__options.items():
+      self.cfg.set(key, value)
+
+  def load(self) -> Flask:
+    return self.__create_app()
+
+  def reload(self) -> None:
+    super().reload()
+    # Make the app again, otherwise the new workers fork the models loaded at start
+    self.callable = None
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Any, Sequence
+
+import pandas as pd
+
+from innolens_models.models.utils.access_record_stream import iterate_periods
+
+
+def make_records() -> pd.DataFrame:
+  start_time = pd.Timestamp('2020-01-01 00:00')
+  minutes = [0, 5, 20, 31, 32, 45, 61, 70, 90, 95, 100, 130]
+  member_ids = ['a', 'b', 'a', 'c', 'b', 'c', 'd', 'a', 'd', 'e', 'a', 'f']
+  actions = ['enter', 'enter', 'exit', 'enter', 'exit', 'exit', 'enter', 'enter', 'exit', 'enter', 'exit', 'enter']
+  return pd.DataFrame({
+    'time': [start_time + pd.Timedelta(minutes=minute) for minute in minutes],
+    'member_id': member_ids,
+    'action': actions
+  })
+
+def collect(chunks: Sequence[pd.DataFrame], **kwargs: Any) -> Sequence[Any]:
+  return [
+    (start_time, end_time, sorted((span['member_id'], span['enter_time'], span['exit_time']) for span in spans))
+    for start_time, end_time, spans in iterate_periods(
+      chunks,
+      start_time=datetime(2020, 1, 1),
+      end_time=datetime(2020, 1, 1, 3),
+      time_step=timedelta(minutes=30),
+      enter_actions=('enter',),
+      exit_actions=('exit',),
+      **kwargs
+    )
+  ]
+
+
+def test_chunked_periods_match_unchunked() -> None:
+  records = make_records()
+  expected = collect([records])
+  assert len(expected) == 6
+  assert expected[0][2] == [
+    ('a', pd.Timestamp('2020-01-01 00:00'), pd.Timestamp('2020-01-01 00:20')),
+    ('b', pd.Timestamp('2020-01-01 00:05'), pd.Timestamp('2020-01-01 00:32'))
+  ]
+  # e and f never exit, so they are dropped
+  assert all(span[0] not in ('e', 'f') for _, _, spans in expected for span in spans)
+
+  for chunk_size in (1, 2, 3, 5):
+    chunks = [records.iloc[i : i + chunk_size] for i in range(0, records.shape[0], chunk_size)]
+    assert collect(chunks) == expected
+
+def test_long_stay_spans_every_overlapped_period() -> None:
+  periods = collect([make_records()])
+  a_periods = [i for i, (_, _, spans) in enumerate(periods) if any(span[0] == 'a' for span in spans)]
+  # a stays 00:00-00:20 and 01:10-01:40
+  assert a_periods == [0, 2, 3]
+
+def test_max_stay_drops_unclosed_stays() -> None:
+  records = make_records()
+  chunks = [records.iloc[i : i + 2] for i in range(0, records.shape[0], 2)]
+  # No closed stay is longer than max_stay, so dropping e and f early changes nothing
+  assert collect(chunks, max_stay=timedelta(hours=2)) == collect([records])
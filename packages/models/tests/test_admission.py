@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, MutableSequence
+
+import pytest
+
+from innolens_models.server.admission import DeadlineExceeded, Overloaded, RouteLimiter, check_deadline
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+  deadline = time.monotonic() + timeout
+  while not condition():
+    assert time.monotonic() < deadline
+    time.sleep(0.01)
+
+
+def test_check_deadline() -> None:
+  check_deadline(None)
+  check_deadline(time.monotonic() + 10)
+  with pytest.raises(DeadlineExceeded) as exc_info:
+    check_deadline(time.monotonic() - 0.001, 'the forecast')
+  assert exc_info.value.code == 504
+  assert 'the forecast' in str(exc_info.value.description)
+
+def test_limiter_queues_then_rejects() -> None:
+  limiter = RouteLimiter(max_concurrency=2, max_queue=1, name='/forecast')
+  limiter.acquire()
+  limiter.acquire()
+  assert limiter.queue_depth == 0
+
+  admitted: MutableSequence[bool] = []
+  def wait() -> None:
+    limiter.acquire()
+    admitted.append(True)
+  thread = threading.Thread(target=wait)
+  thread.start()
+  wait_until(lambda: limiter.queue_depth == 1)
+
+  with pytest.raises(Overloaded) as exc_info:
+    limiter.acquire()
+  assert exc_info.value.code == 503
+  assert exc_info.value.retry_after_sec >= 1
+
+  limiter.release(0.1)
+  thread.join(5)
+  assert admitted == [True]
+  assert limiter.queue_depth == 0
+
+def test_limiter_drops_expired_waiters() -> None:
+  limiter = RouteLimiter(max_concurrency=1, max_queue=4, name='/forecast')
+  limiter.acquire()
+  with pytest.raises(DeadlineExceeded):
+    limiter.acquire(time.monotonic() + 0.05)
+  assert limiter.queue_depth == 0
+  limiter.release(0.1)
+  # The slot is free again
+  limiter.acquire(time.monotonic() + 1)
+
+def test_retry_after_follows_the_mean_duration() -> None:
+  limiter = RouteLimiter(max_concurrency=1, max_queue=0, name='/correlate')
+  limiter.acquire()
+  limiter.release(10.0)
+  limiter.acquire()
+  with pytest.raises(Overloaded) as exc_info:
+    limiter.acquire()
+  assert exc_info.value.retry_after_sec == 10
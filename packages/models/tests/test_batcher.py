@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+from typing import List, Sequence
+
+import pytest
+
+from innolens_models.server.admission import DeadlineExceeded
+from innolens_models.server.batcher import MicroBatcher
+
+
+class RecordingBatch:
+  '''
+  Doubles the items of each batch and records the batches, failing those with a
+  negative item.
+  '''
+
+  def __init__(self):
+    super().__init__()
+    self.batches: List[Sequence[int]] = []
+    self.lock = threading.Lock()
+
+  def __call__(self, batch: Sequence[int]) -> Sequence[int]:
+    with self.lock:
+      self.batches.append(list(batch))
+    if any(item < 0 for item in batch):
+      raise ValueError('Negative item')
+    return [item * 2 for item in batch]
+
+
+def test_results_go_back_to_their_callers() -> None:
+  run_batch = RecordingBatch()
+  batcher = MicroBatcher(run_batch, max_batch_size=8, max_delay=0.05)
+  with ThreadPoolExecutor(16) as executor:
+    results = list(executor.map(batcher, range(40)))
+  assert results == [item * 2 for item in range(40)]
+  # Concurrent items were batched
+  assert len(run_batch.batches) < 40
+
+def test_batches_are_capped_by_the_size_of_their_items() -> None:
+  run_batch = RecordingBatch()
+  batcher = MicroBatcher(run_batch, item_size=lambda item: item, max_batch_size=5, max_delay=0.2)
+  futures = [batcher.submit(item) for item in (2, 2, 2, 2, 1, 3)]
+  assert [future.result(timeout=5) for future in futures] == [4, 4, 4, 4, 2, 6]
+  # A batch closes once its items reach the max size
+  assert run_batch.batches == [[2, 2, 2], [2, 1, 3]]
+
+def test_failed_batch_is_retried_one_by_one() -> None:
+  run_batch = RecordingBatch()
+  batcher = MicroBatcher(run_batch, max_batch_size=3, max_delay=0.2)
+  futures = [batcher.submit(item) for item in (1, -1, 3)]
+  assert futures[0].result(timeout=5) == 2
+  with pytest.raises(ValueError):
+    futures[1].result(timeout=5)
+  assert futures[2].result(timeout=5) == 6
+  assert run_batch.batches == [[1, -1, 3], [1], [-1], [3]]
+
+def test_expired_items_are_dropped_before_the_batch() -> None:
+  run_batch = RecordingBatch()
+  batcher = MicroBatcher(run_batch, max_batch_size=3, max_delay=0.2)
+  expired_future = batcher.submit(1, deadline=time.monotonic() - 1)
+  future = batcher.submit(2, deadline=time.monotonic() + 5)
+  assert future.result(timeout=5) == 4
+  with pytest.raises(DeadlineExceeded):
+    expired_future.result(timeout=5)
+  assert run_batch.batches == [[2]]
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_worker_thread_restarts_after_fork() -> None:
+  batcher = MicroBatcher(RecordingBatch(), max_delay=0.001)
+  assert batcher(1) == 2
+  pid = os.fork()
+  if pid == 0:
+    # The forked process has no worker thread until its first submit
+    try:
+      os._exit(0 if batcher(2, deadline=time.monotonic() + 5) == 4 else 1)
+    except BaseException:
+      os._exit(1)
+  _, status = os.waitpid(pid, 0)
+  assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+  assert batcher(3) == 6
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+from innolens_models.models.utils.dataset_cache import DatasetCache
+
+
+def test_key_changes_with_the_content_and_params(tmp_path: Path) -> None:
+  input_path = tmp_path / 'input.json'
+  input_path.write_text('[1, 2]')
+  cache = DatasetCache(str(tmp_path / 'cache'))
+  key = cache.key([str(input_path)], { 'window': 3 })
+  assert cache.key([str(input_path)], { 'window': 3 }) == key
+  assert cache.key([str(input_path)], { 'window': 4 }) != key
+  input_path.write_text('[1, 2, 3]')
+  assert cache.key([str(input_path)], { 'window': 3 }) != key
+
+def test_entries_are_reloaded_memory_mapped(tmp_path: Path) -> None:
+  cache = DatasetCache(str(tmp_path / 'cache'))
+  values = np.arange(12, dtype=np.float32).reshape(3, 4)
+  created = []
+  def create():
+    created.append(True)
+    return { 'values': values }, { 'names': ['a', 'b'] }
+
+  for _ in range(2):
+    arrays, meta = cache.get_or_create([], { 'n': 1 }, create)
+    assert isinstance(arrays['values'], np.memmap)
+    np.testing.assert_array_equal(arrays['values'], values)
+    assert meta == { 'names': ['a', 'b'] }
+  assert len(created) == 1
+  assert cache.load('0' * 64) is None
+
+def test_least_recently_used_entries_are_evicted(tmp_path: Path) -> None:
+  values = np.zeros(1000)
+  cache = DatasetCache(str(tmp_path / 'cache'), max_size=2 * values.nbytes + 1024)
+  cache.save('a', { 'values': values }, None)
+  cache.save('b', { 'values': values }, None)
+  os.utime(str(tmp_path / 'cache' / 'a' / 'meta.json'), (1000, 1000))
+  os.utime(str(tmp_path / 'cache' / 'b' / 'meta.json'), (2000, 2000))
+  # Loading a marks it as used after b
+  assert cache.load('a') is not None
+  cache.save('c', { 'values': values }, None)
+  assert cache.load('a') is not None
+  assert cache.load('b') is None
+  assert cache.load('c') is not None
+
+def test_entry_saved_first_is_kept(tmp_path: Path) -> None:
+  cache = DatasetCache(str(tmp_path / 'cache'))
+  cache.save('a', { 'values': np.zeros(3) }, 'first')
+  first_arrays, _ = cache.load('a')
+  # Another process missing the same key saves it again
+  cache.save('a', { 'values': np.ones(3) }, 'second')
+  arrays, meta = cache.load('a')
+  assert meta == 'first'
+  np.testing.assert_array_equal(arrays['values'], np.zeros(3))
+  np.testing.assert_array_equal(first_arrays['values'], np.zeros(3))
+  assert [path.name for path in (tmp_path / 'cache').iterdir()] == ['a']
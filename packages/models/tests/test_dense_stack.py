@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from innolens_models.models.utils.dense_stack import DenseStack
+
+
+def make_stack() -> DenseStack:
+  rng = np.random.default_rng(0)
+  return DenseStack(
+    [rng.normal(size=(6, 8)), rng.normal(size=(8, 3))],
+    [rng.normal(size=8), rng.normal(size=3)],
+    ['relu', 'linear'],
+    mean=2.0,
+    stddev=4.0,
+    meta={ 'features': ['a', 'b'] }
+  )
+
+
+def test_predict_standardizes_around_the_layers() -> None:
+  stack = make_stack()
+  X = np.random.default_rng(1).normal(2.0, 4.0, size=(5, 6))
+  hidden = np.maximum((X - 2.0) / 4.0 @ stack.kernels[0] + stack.biases[0], 0)
+  expected = (hidden @ stack.kernels[1] + stack.biases[1]) * 4.0 + 2.0
+  np.testing.assert_allclose(stack.predict(X), expected, rtol=1e-5, atol=1e-5)
+
+def test_save_and_load(tmp_path: Path) -> None:
+  stack = make_stack()
+  path = str(tmp_path / 'model.npz')
+  stack.save(path)
+  loaded = DenseStack.load(path)
+  assert loaded.activations == ['relu', 'linear']
+  assert (loaded.mean, loaded.stddev) == (2.0, 4.0)
+  assert loaded.meta == { 'features': ['a', 'b'] }
+  X = np.random.default_rng(1).normal(size=(5, 6))
+  np.testing.assert_array_equal(loaded.predict(X), stack.predict(X))
+
+def test_unsupported_activation() -> None:
+  with pytest.raises(ValueError):
+    DenseStack([np.zeros((2, 2))], [np.zeros(2)], ['tanh'], mean=0.0, stddev=1.0, meta={})
+
+def test_matches_keras() -> None:
+  tf = pytest.importorskip('tensorflow')
+  model = tf.keras.models.Sequential([
+    tf.keras.layers.InputLayer(input_shape=(6,)),
+    tf.keras.layers.Dense(8, activation=tf.nn.relu),
+    tf.keras.layers.Dense(8, activation='relu'),
+    tf.keras.layers.Dense(3)
+  ])
+  stack = DenseStack.from_keras(model, mean=2.0, stddev=4.0, meta={})
+  assert stack.activations == ['relu', 'relu', 'linear']
+  X = np.random.default_rng(1).normal(2.0, 4.0, size=(16, 6)).astype(np.float32)
+  expected = model((X - 2.0) / 4.0, training=False).numpy() * 4.0 + 2.0
+  np.testing.assert_allclose(stack.predict(X), expected, rtol=1e-4, atol=1e-4)
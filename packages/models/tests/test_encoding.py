@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import io
+import json
+from typing import Any
+
+from flask import Flask
+import numpy as np
+import pytest
+from werkzeug.exceptions import BadRequest, UnsupportedMediaType
+
+from innolens_models.server.encoding import decode_array, decode_request, encode_array, encode_response
+
+
+app = Flask(__name__)
+
+
+@pytest.mark.parametrize('arr', [
+  np.arange(12, dtype=np.float64).reshape((3, 4)),
+  np.arange(6, dtype='>i4').reshape((2, 3)),
+  np.array([], dtype=np.float32),
+  np.ones((2, 1, 2), dtype=np.uint8)
+])
+def test_array_round_trip(arr: np.ndarray) -> None:
+  encoded = encode_array(arr)
+  assert encoded['dtype'].startswith(('<', '|'))
+  decoded = decode_array(encoded)
+  assert decoded.shape == arr.shape
+  np.testing.assert_array_equal(decoded, arr)
+
+def test_other_maps_are_kept() -> None:
+  obj = { 'dtype': '<f8', 'shape': [1], 'data': 'not bytes' }
+  assert decode_array(obj) is obj
+
+@pytest.mark.parametrize('obj', [
+  { 'dtype': 'not a dtype', 'shape': [1], 'data': b'\0' * 8 },
+  { 'dtype': '|O', 'shape': [1], 'data': b'\0' * 8 },
+  { 'dtype': '<f8', 'shape': [3], 'data': b'\0' * 8 },
+  { 'dtype': '<f8', 'shape': 'x', 'data': b'\0' * 8 }
+])
+def test_invalid_arrays_are_bad_requests(obj: Any) -> None:
+  with pytest.raises(BadRequest):
+    decode_array(obj)
+
+def test_npy_request() -> None:
+  arr = np.arange(6, dtype=np.float64).reshape((2, 3))
+  buffer = io.BytesIO()
+  np.save(buffer, arr)
+  with app.test_request_context(data=buffer.getvalue(), content_type='application/x-npy'):
+    np.testing.assert_array_equal(decode_request(npy=lambda values: values), arr)
+    with pytest.raises(UnsupportedMediaType):
+      decode_request()
+  with app.test_request_context(data=b'not npy', content_type='application/x-npy'):
+    with pytest.raises(BadRequest):
+      decode_request(npy=lambda values: values)
+
+def test_json_response() -> None:
+  with app.test_request_context():
+    response = encode_response({ 'values': np.array([[1.5, 2.0]]), 'count': np.int64(3) })
+  assert response.mimetype == 'application/json'
+  assert json.loads(response.get_data()) == { 'data': { 'values': [[1.5, 2.0]], 'count': 3 } }
+
+def test_npy_response() -> None:
+  arr = np.arange(4, dtype=np.float32)
+  with app.test_request_context(headers={ 'Accept': 'application/x-npy' }):
+    response = encode_response(arr, npy=True)
+  assert response.mimetype == 'application/x-npy'
+  np.testing.assert_array_equal(np.load(io.BytesIO(response.get_data())), arr)
+
+def test_msgpack_round_trip() -> None:
+  msgpack = pytest.importorskip('msgpack')
+  arr = np.arange(6, dtype=np.float64).reshape((2, 3))
+  body = msgpack.packb({ 'values': arr, 'groups': ['a', 'b'] }, default=encode_array)
+  with app.test_request_context(data=body, content_type='application/msgpack', headers={ 'Accept': 'application/msgpack' }):
+    data = decode_request()
+    np.testing.assert_array_equal(data['values'], arr)
+    assert data['groups'] == ['a', 'b']
+    response = encode_response(data)
+  decoded = msgpack.unpackb(response.get_data(), object_hook=decode_array, raw=False)
+  np.testing.assert_array_equal(decoded['data']['values'], arr)
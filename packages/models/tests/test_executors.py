@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+import pytest
+from werkzeug.exceptions import GatewayTimeout, InternalServerError
+
+from innolens_models.server.admission import DeadlineExceeded, Overloaded
+from innolens_models.server.executors import ProcessPool
+
+
+# Run in spawned workers, so defined at the top level
+def sleep_and_double(value: int, sleep: float) -> int:
+  time.sleep(sleep)
+  return value * 2
+
+def die() -> None:
+  os._exit(1)
+
+
+def test_calls_run_in_the_pool() -> None:
+  pool = ProcessPool(workers=2, max_pending=4, timeout=30, name='test')
+  assert pool(sleep_and_double, 21, 0) == 42
+  assert pool.queue_depth == 0
+
+def test_calls_beyond_max_pending_are_rejected() -> None:
+  pool = ProcessPool(workers=1, max_pending=1, timeout=30, name='test')
+  # Start the workers first, so the pending call is not slowed by their spawning
+  pool(sleep_and_double, 1, 0)
+  pending = threading.Thread(target=pool, args=(sleep_and_double, 1, 1.0))
+  pending.start()
+  time.sleep(0.2)
+  with pytest.raises(Overloaded) as err_info:
+    pool(sleep_and_double, 2, 0)
+  assert err_info.value.retry_after_sec == 1
+  pending.join()
+  assert pool(sleep_and_double, 3, 0) == 6
+
+def test_slow_call_times_out() -> None:
+  pool = ProcessPool(workers=1, max_pending=4, timeout=0.5, name='test')
+  with pytest.raises(GatewayTimeout) as err_info:
+    pool(sleep_and_double, 1, 2.0)
+  assert not isinstance(err_info.value, DeadlineExceeded)
+
+def test_deadline_before_the_timeout() -> None:
+  pool = ProcessPool(workers=1, max_pending=4, timeout=30, name='test')
+  with pytest.raises(DeadlineExceeded):
+    pool(sleep_and_double, 1, 0, deadline=time.monotonic() - 1)
+  assert pool.queue_depth == 0
+  with pytest.raises(DeadlineExceeded):
+    pool(sleep_and_double, 1, 2.0, deadline=time.monotonic() + 0.5)
+
+def test_pool_restarts_after_a_worker_dies() -> None:
+  pool = ProcessPool(workers=1, max_pending=4, timeout=30, name='test')
+  with pytest.raises(InternalServerError):
+    pool(die)
+  assert pool(sleep_and_double, 5, 0) == 10
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+
+from innolens_models.models.history_forecast.inference import HistoryForecastModelGroup, UnknownGroupException
+
+
+class OffsetModel:
+  '''
+  Forecasts the first value of each row plus an offset, two steps ahead.
+  '''
+
+  def __init__(self, offset: float):
+    super().__init__()
+    self.offset = offset
+
+  def predict(self, X_batch: Any) -> Any:
+    return np.repeat(X_batch[:, :1] + self.offset, 2, axis=1)
+
+
+def create_group(tmp_path: Path) -> HistoryForecastModelGroup:
+  with open(str(tmp_path / 'groups.json'), 'w') as file:
+    json.dump({ 'models': [
+      { 'name': 'a', 'groups': ['a'], 'checkpointDir': 'groups/10' },
+      { 'name': 'bc', 'groups': ['b', 'c'], 'checkpointDir': 'groups/20' }
+    ] }, file)
+  return HistoryForecastModelGroup(
+    checkpoint_dir_path=str(tmp_path),
+    load_model=lambda path: OffsetModel(float(Path(path).name))
+  )
+
+def test_rows_are_forecast_by_the_model_of_their_group(tmp_path: Path) -> None:
+  model = create_group(tmp_path)
+  X = np.array([[1.0, 0.0], [2.0, 0.0], [3.0, 0.0]])
+  np.testing.assert_array_equal(model.predict(X, ['c', 'a', 'b']), [[21.0, 21.0], [12.0, 12.0], [23.0, 23.0]])
+
+def test_empty_batch_gives_an_empty_forecast(tmp_path: Path) -> None:
+  model = create_group(tmp_path)
+  assert model.predict(np.zeros((0, 2)), []).shape == (0, 2)
+
+def test_unknown_groups(tmp_path: Path) -> None:
+  model = create_group(tmp_path)
+  assert model.groups == { 'a', 'b', 'c' }
+  model.check_groups(['b', 'a'])
+  with pytest.raises(UnknownGroupException):
+    model.check_groups(['a', 'd'])
+  with pytest.raises(UnknownGroupException):
+    model.predict(np.zeros((1, 2)), ['d'])
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable
+
+import pytest
+from werkzeug.exceptions import NotFound
+
+from innolens_models.server.admission import Overloaded
+from innolens_models.server.jobs import JobManager, hash_job
+
+
+# Job functions run in spawned workers, so they are defined at the top level
+def record_run(data: Any, progress: Callable[[float], None]) -> Any:
+  with open(data['log_path'], 'a') as file:
+    file.write('run\n')
+  time.sleep(data.get('sleep', 0))
+  progress(0.5)
+  if data.get('fail', False):
+    raise ValueError('Failed on purpose')
+  return { 'value': data['value'] * 2 }
+
+def run_count(log_path: Path) -> int:
+  return len(log_path.read_text().splitlines()) if log_path.exists() else 0
+
+
+def test_identical_submissions_run_once(tmp_path: Path) -> None:
+  manager = JobManager(dir_path=str(tmp_path / 'jobs'))
+  log_path = tmp_path / 'runs.log'
+  data = { 'log_path': str(log_path), 'value': 21, 'sleep': 0.5 }
+
+  job = manager.submit('double', record_run, data)
+  assert job['id'] == hash_job('double', data)
+  assert manager.submit('double', record_run, data)['id'] == job['id']
+  done_job = manager.get(job['id'], wait=60)
+  assert done_job['status'] == 'done'
+  assert done_job['result'] == { 'value': 42 }
+  # The finished job is reused until it expires
+  assert manager.submit('double', record_run, data)['status'] == 'done'
+  assert run_count(log_path) == 1
+
+def test_other_server_worker_reuses_the_job(tmp_path: Path) -> None:
+  dir_path = str(tmp_path / 'jobs')
+  log_path = tmp_path / 'runs.log'
+  data = { 'log_path': str(log_path), 'value': 1, 'sleep': 0.5 }
+  job = JobManager(dir_path=dir_path).submit('double', record_run, data)
+  other_job = JobManager(dir_path=dir_path).submit('double', record_run, data)
+  assert other_job['id'] == job['id']
+  assert JobManager(dir_path=dir_path).get(job['id'], wait=60)['status'] == 'done'
+  assert run_count(log_path) == 1
+
+def test_failed_job_runs_again(tmp_path: Path) -> None:
+  manager = JobManager(dir_path=str(tmp_path / 'jobs'))
+  log_path = tmp_path / 'runs.log'
+  data = { 'log_path': str(log_path), 'value': 1, 'fail': True }
+  job = manager.submit('double', record_run, data)
+  failed_job = manager.get(job['id'], wait=60)
+  assert failed_job['status'] == 'failed'
+  assert 'Failed on purpose' in failed_job['error']
+
+  manager.submit('double', record_run, data)
+  assert manager.get(job['id'], wait=60)['status'] == 'failed'
+  assert run_count(log_path) == 2
+
+def test_rerun_being_claimed_is_not_run_again(tmp_path: Path) -> None:
+  dir_path = tmp_path / 'jobs'
+  log_path = tmp_path / 'runs.log'
+  data = { 'log_path': str(log_path), 'value': 1 }
+  job_id = hash_job('double', data)
+  dir_path.mkdir()
+  with open(str(dir_path / f'{job_id}.json'), 'w') as file:
+    json.dump({ 'id': job_id, 'kind': 'double', 'status': 'failed', 'progress': 0.0, 'updatedTime': int(time.time() * 1000) }, file)
+  # Another server worker holds the lock to rerun it
+  (dir_path / f'{job_id}.lock').touch()
+
+  job = JobManager(dir_path=str(dir_path)).submit('double', record_run, data)
+  assert job['status'] == 'queued'
+  time.sleep(0.5)
+  assert run_count(log_path) == 0
+
+def test_unknown_job(tmp_path: Path) -> None:
+  manager = JobManager(dir_path=str(tmp_path / 'jobs'))
+  with pytest.raises(NotFound):
+    manager.get('0' * 32)
+  with pytest.raises(NotFound):
+    manager.get('../etc/passwd')
+
+def test_waiting_gets_beyond_max_waiters_are_rejected(tmp_path: Path) -> None:
+  manager = JobManager(dir_path=str(tmp_path / 'jobs'), max_waiters=1)
+  data = { 'log_path': str(tmp_path / 'runs.log'), 'value': 1, 'sleep': 2 }
+  job = manager.submit('double', record_run, data)
+  waiter = threading.Thread(target=manager.get, args=(job['id'],), kwargs={ 'wait': 60 })
+  waiter.start()
+  time.sleep(0.2)
+  with pytest.raises(Overloaded):
+    manager.get(job['id'], wait=1)
+  # Gets not waiting are answered
+  assert manager.get(job['id'])['status'] in ('queued', 'running')
+  waiter.join()
+  assert manager.get(job['id'], wait=60)['status'] == 'done'
+
+def test_expired_jobs_are_evicted_by_their_file_time(tmp_path: Path) -> None:
+  dir_path = tmp_path / 'jobs'
+  dir_path.mkdir()
+  old_time = time.time() - 7200
+  for job_id in ('a' * 32, 'b' * 32):
+    with open(str(dir_path / f'{job_id}.json'), 'w') as file:
+      json.dump({ 'id': job_id, 'kind': 'double', 'status': 'done', 'progress': 1.0, 'updatedTime': int(old_time * 1000) }, file)
+  os.utime(str(dir_path / f'{"a" * 32}.json'), (old_time, old_time))
+
+  manager = JobManager(dir_path=str(dir_path))
+  manager.submit('double', record_run, { 'log_path': str(tmp_path / 'runs.log'), 'value': 1 })
+  assert not (dir_path / f'{"a" * 32}.json').exists()
+  # Its file was written just now, so it is not read
+  assert (dir_path / f'{"b" * 32}.json').exists()
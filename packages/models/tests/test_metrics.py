@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import pytest
+
+from innolens_models.server.metrics import Counter, Gauge, Histogram, Metric
+
+
+def test_metric_is_abstract() -> None:
+  with pytest.raises(TypeError):
+    Metric('m', 'help', 'untyped') # type: ignore
+
+def test_counter_escapes_label_values() -> None:
+  counter = Counter('requests_total', 'Number of requests', ('route', 'status'))
+  counter.inc(('/forecast', '200'))
+  counter.inc(('/forecast', '200'), 2)
+  counter.inc(('a"b\\c\nd', '500'))
+  assert list(counter.render()) == [
+    '# HELP requests_total Number of requests',
+    '# TYPE requests_total counter',
+    'requests_total{route="/forecast",status="200"} 3.0',
+    'requests_total{route="a\\"b\\\\c\\nd",status="500"} 1.0'
+  ]
+
+def test_gauge_set_or_collected() -> None:
+  gauge = Gauge('in_flight', 'Number in flight', ('route',))
+  gauge.inc(('/forecast',), 2)
+  gauge.inc(('/forecast',), -1)
+  assert list(gauge.render())[2:] == ['in_flight{route="/forecast"} 1.0']
+
+  collected = Gauge('queue_depth', 'Depth', ('queue',), collect=lambda: { ('cpu',): 4 })
+  assert list(collected.render())[2:] == ['queue_depth{queue="cpu"} 4']
+
+def test_histogram_buckets_are_cumulative() -> None:
+  histogram = Histogram('duration_seconds', 'Duration', ('model',), buckets=(0.1, 1.0))
+  for value in (0.05, 0.1, 0.5, 3.0):
+    histogram.observe(('a',), value)
+  lines = list(histogram.render())
+  assert lines[1] == '# TYPE duration_seconds histogram'
+  assert lines[2:] == [
+    'duration_seconds_bucket{model="a",le="0.1"} 2',
+    'duration_seconds_bucket{model="a",le="1.0"} 3',
+    'duration_seconds_bucket{model="a",le="+Inf"} 4',
+    'duration_seconds_sum{model="a"} 3.65',
+    'duration_seconds_count{model="a"} 4'
+  ]
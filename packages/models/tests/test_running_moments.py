@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from innolens_models.models.utils.running_moments import RunningMoments
+
+
+def test_moments_of_values_match_numpy() -> None:
+  values = np.random.default_rng(0).normal(3.0, 2.0, size=(100, 4)).astype(np.float32)
+  moments = RunningMoments.of(values)
+  assert moments.count == 400
+  assert moments.mean == pytest.approx(np.mean(values, dtype=np.float64))
+  assert moments.stddev == pytest.approx(np.sqrt(np.var(values, dtype=np.float64)))
+
+def test_updates_match_moments_of_all_values() -> None:
+  rng = np.random.default_rng(1)
+  batches = [rng.normal(mean, scale, size=(size, 3)) for mean, scale, size in ((0.0, 1.0, 50), (5.0, 3.0, 1), (-2.0, 0.5, 200), (1.0, 1.0, 0))]
+  moments = RunningMoments()
+  for batch in batches:
+    moments.update(batch)
+  all_values = np.concatenate(batches)
+  assert moments.count == all_values.size
+  assert moments.mean == pytest.approx(np.mean(all_values))
+  assert moments.m2 / moments.count == pytest.approx(np.var(all_values))
+
+def test_empty_moments_do_not_scale() -> None:
+  assert RunningMoments.of(np.zeros((0, 3))).stddev == 1.0
+
+def test_save_and_load(tmp_path: Path) -> None:
+  moments = RunningMoments.of(np.arange(10.0))
+  path = str(tmp_path / 'standardize_params.npz')
+  moments.save(path)
+  loaded = RunningMoments.load(path)
+  assert loaded is not None
+  assert (loaded.count, loaded.mean, loaded.m2) == (moments.count, moments.mean, moments.m2)
+  # The standardization params are readable without the moments too
+  arrs = np.load(path)
+  assert float(arrs['stddev']) == pytest.approx(np.std(np.arange(10.0)))
+
+def test_load_params_saved_without_moments(tmp_path: Path) -> None:
+  path = str(tmp_path / 'standardize_params.npz')
+  np.savez(path, mean=1.0, stddev=2.0)
+  assert RunningMoments.load(path) is None
+  assert RunningMoments.load(str(tmp_path / 'missing.npz')) is None
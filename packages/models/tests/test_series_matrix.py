@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from innolens_models.models.utils.series_matrix import SeriesMatrix
+
+
+def test_load_cached_memory_maps_the_parsed_json(tmp_path: Path) -> None:
+  data_path = tmp_path / 'train.json'
+  data_path.write_text(json.dumps({ 'groups': ['a', 'b'], 'values': [[1, 2, 3], [4, 5, 6]] }))
+  cache_dir_path = str(tmp_path / 'cache')
+
+  for _ in range(2):
+    series = SeriesMatrix.load_cached(str(data_path), names_key='groups', cache_dir_path=cache_dir_path)
+    assert isinstance(series.values, np.memmap)
+    assert list(series.names) == ['a', 'b']
+    np.testing.assert_array_equal(series.values, [[1, 4], [2, 5], [3, 6]])
+  assert len(list(Path(cache_dir_path).iterdir())) == 1
+
+  series = SeriesMatrix.load_cached(str(data_path), names_key='groups', no_cache=True)
+  assert not isinstance(series.values, np.memmap)
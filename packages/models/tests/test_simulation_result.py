@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import pytest
+
+from innolens_models.models.simulation_result.preprocessor import FeatureSource, count_members, discover_sources, preprocess
+
+
+hk_timezone = timezone(timedelta(hours=8))
+start_time = datetime(2020, 1, 1, tzinfo=hk_timezone)
+end_time = datetime(2020, 1, 1, 2, tzinfo=hk_timezone)
+time_step = timedelta(minutes=30)
+
+
+def write_csv(path: Path, header: str, rows: Sequence[str]) -> None:
+  path.parent.mkdir(parents=True, exist_ok=True)
+  path.write_text('\n'.join([header, *rows]) + '\n')
+
+def create_simulation_result(root: Path) -> None:
+  write_csv(root / 'space_access_records' / 'inno_wing.csv', 'time,member_id,action', [
+    '2020-01-01T00:10:00+08:00,a,enter',
+    '2020-01-01T00:20:00+08:00,b,enter',
+    '2020-01-01T00:40:00+08:00,a,exit',
+    '2020-01-01T01:10:00+08:00,b,exit'
+  ])
+  write_csv(root / 'machine_access_records' / 'printer' / 'printer_1.csv', 'time,member_id,action', [
+    '2020-01-01T01:00:00+08:00,c,acquire',
+    '2020-01-01T01:20:00+08:00,c,release'
+  ])
+  write_csv(root / 'expendable_inventory_access_records' / 'paper.csv', 'action,time,quantity,member_id,take_quantity', [
+    'set,2020-01-01T00:00:00+08:00,100,,0',
+    'take,2020-01-01T00:05:00+08:00,-1,a,3',
+    'take,2020-01-01T00:25:00+08:00,-1,b,2',
+    'take,2020-01-01T01:45:00+08:00,-1,a,4',
+    'take,2020-01-01T02:05:00+08:00,-1,a,9'
+  ])
+
+def test_discover_sources(tmp_path: Path) -> None:
+  create_simulation_result(tmp_path)
+  sources = discover_sources(str(tmp_path), ('space', 'machine', 'expendable_inventory'))
+  assert [(source.feature, source.kind) for source in sources] == [
+    ('inno_wing', 'space'),
+    ('machine/printer/printer_1', 'machine'),
+    ('expendable_inventory/paper', 'expendable_inventory')
+  ]
+  assert discover_sources(str(tmp_path), ('reusable_inventory',)) == []
+
+def test_count_members_per_period(tmp_path: Path) -> None:
+  create_simulation_result(tmp_path)
+  def count(path: Path, kind: str) -> Sequence[int]:
+    return count_members(
+      FeatureSource('feature', kind, str(path)),
+      start_time=start_time,
+      end_time=end_time,
+      time_step=time_step
+    ).tolist()
+
+  assert count(tmp_path / 'space_access_records' / 'inno_wing.csv', 'space') == [2, 2, 1, 0]
+  assert count(tmp_path / 'machine_access_records' / 'printer' / 'printer_1.csv', 'machine') == [0, 0, 1, 0]
+  # The taken quantities are summed, and those after the end are left out
+  assert count(tmp_path / 'expendable_inventory_access_records' / 'paper.csv', 'expendable_inventory') == [5, 0, 0, 4]
+
+def test_preprocess_writes_a_feature_per_source(tmp_path: Path) -> None:
+  create_simulation_result(tmp_path / 'result')
+  output_path = tmp_path / 'train.json'
+  preprocess(
+    input_path=str(tmp_path / 'result'),
+    output_path=str(output_path),
+    start_time=start_time,
+    end_time=end_time,
+    time_step=time_step,
+    workers=1,
+    no_cache=True
+  )
+  data = json.loads(output_path.read_text())
+  assert data['features'] == ['inno_wing', 'machine/printer/printer_1', 'expendable_inventory/paper']
+  assert np.array(data['values']).shape == (3, 4)
+  assert len(data['startTimes']) == 4
+
+def test_preprocess_without_sources(tmp_path: Path) -> None:
+  with pytest.raises(ValueError, match='No access records'):
+    preprocess(
+      input_path=str(tmp_path),
+      output_path=str(tmp_path / 'train.json'),
+      start_time=start_time,
+      end_time=end_time,
+      time_step=time_step,
+      kinds=('space',),
+      no_cache=True
+    )
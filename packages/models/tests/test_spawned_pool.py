@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+import pytest
+
+from innolens_models.models.utils.spawned_pool import run_in_spawned_pool
+
+
+# Run in spawned workers, so defined at the top level
+def invert(value: float) -> float:
+  return 1 / value
+
+
+def test_results_and_failures_in_the_order_of_the_items() -> None:
+  # The workers pin their TF threads
+  pytest.importorskip('tensorflow')
+  results = run_in_spawned_pool(invert, [1.0, 0.0, 4.0], workers=2)
+  assert results[0] == 1.0
+  assert isinstance(results[1], ZeroDivisionError)
+  assert results[2] == 0.25
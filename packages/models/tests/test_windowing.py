@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from innolens_models.models.utils.windowing import SlidingWindows, legacy_windows_dataset
+
+
+def make_values() -> np.ndarray:
+  return np.random.default_rng(0).normal(size=(40, 3))
+
+
+@pytest.mark.parametrize('shift', [1, 3])
+def test_per_series_samples_match_slices(shift: int) -> None:
+  values = make_values()
+  windows = SlidingWindows(values, history_size=6, forecast_size=2, shift=shift, per_series=True, mean=1.0, stddev=2.0)
+  assert windows.window_count == (40 - 8) // shift + 1
+  assert len(windows) == windows.window_count * 3
+  assert windows.history_shape == (6,) and windows.forecast_shape == (2,)
+
+  X, y = windows.batch(np.arange(len(windows)))
+  for i in range(len(windows)):
+    t = i // 3 * shift
+    s = i % 3
+    np.testing.assert_allclose(X[i], (values[t : t + 6, s] - 1.0) / 2.0, rtol=1e-6)
+    np.testing.assert_allclose(y[i], (values[t + 6 : t + 8, s] - 1.0) / 2.0, rtol=1e-6)
+
+def test_flattened_samples_match_slices() -> None:
+  values = make_values()
+  windows = SlidingWindows(values, history_size=6, forecast_size=2, per_series=False)
+  assert len(windows) == 33
+  assert windows.history_shape == (18,) and windows.forecast_shape == (6,)
+
+  X, y = windows.batch(np.arange(len(windows)))
+  for t in range(len(windows)):
+    np.testing.assert_allclose(X[t], values[t : t + 6].T.reshape(-1), rtol=1e-6)
+    np.testing.assert_allclose(y[t], values[t + 6 : t + 8].T.reshape(-1), rtol=1e-6)
+
+def test_windows_do_not_copy_values() -> None:
+  values = make_values()
+  windows = SlidingWindows(values, history_size=6, forecast_size=2, per_series=True)
+  values[10, 1] = 100.0
+  # Series 1 of the window starting at 5
+  X, _ = windows.batch(np.array([5 * 3 + 1]))
+  assert X[0, 5] == 100.0
+
+def test_sample_idxs_cover_the_series_of_each_window() -> None:
+  windows = SlidingWindows(make_values(), history_size=6, forecast_size=2, per_series=True)
+  np.testing.assert_array_equal(windows.sample_idxs(np.array([0, 2])), [0, 1, 2, 6, 7, 8])
+
+def test_batches_cover_each_sample_once() -> None:
+  windows = SlidingWindows(make_values(), history_size=6, forecast_size=2, per_series=True)
+  X_all, _ = windows.batch(np.arange(len(windows)))
+  batches = list(windows.iterate_batches(batch_size=16, shuffle=True, seed=0))
+  assert [X.shape[0] for X, _ in batches] == [16] * 6 + [3]
+  X_shuffled = np.concatenate([X for X, _ in batches])
+  np.testing.assert_array_equal(np.sort(X_shuffled, axis=0), np.sort(X_all, axis=0))
+
+
+@pytest.mark.parametrize('per_series', [True, False])
+def test_samples_match_legacy_dataset(per_series: bool) -> None:
+  pytest.importorskip('tensorflow')
+  values = make_values().astype(np.float32)
+  windows = SlidingWindows(values, history_size=6, forecast_size=2, per_series=per_series)
+  legacy_batches = list(legacy_windows_dataset(
+    values,
+    history_size=6,
+    forecast_size=2,
+    per_series=per_series,
+    batch_size=16
+  ).as_numpy_iterator())
+  batches = list(windows.iterate_batches(batch_size=16))
+  assert len(batches) == len(legacy_batches)
+  for (X, y), (legacy_X, legacy_y) in zip(batches, legacy_batches):
+    np.testing.assert_allclose(X, legacy_X, rtol=1e-6)
+    np.testing.assert_allclose(y, legacy_y, rtol=1e-6)